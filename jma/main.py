@@ -1,5 +1,6 @@
 import flet as ft
 import json
+import asyncio
 import requests
 
 # JSONファイルのパス
@@ -45,6 +46,26 @@ print("CENTER_TO_OFFICES:", CENTER_TO_OFFICES)
 # JMAのAPIのベースURL
 API_BASE_URL = 'https://www.jma.go.jp/bosai/forecast/data/forecast/{}.json'
 
+def extract_areas(data):
+    """
+    予報JSONの直近の天気を、すべての細分区域について1回の走査で取り出し、
+    {細分区域のコード: (名前, 状況, 風, 波)} を返す（順番は予報JSONの順）
+    """
+    time_series = data[0].get('timeSeries', [])
+    if not time_series:
+        raise ValueError("timeSeries データが見つかりません。")
+    areas = time_series[0].get('areas', [])
+    if not areas:
+        raise ValueError("areas データが見つかりません。")
+    # JMA APIでは直接的な温度データが含まれていない場合が多いため、必要に応じて別のAPIやデータソースを使用して温度情報を取得する
+    return {
+        area['area']['code']: (area['area']['name'],
+                               area.get('weathers', ["データなし"])[0],
+                               area.get('winds', ["データなし"])[0],
+                               area.get('waves', ["データなし"])[0])
+        for area in areas
+    }
+
 def main(page: ft.Page):
     page.title = "地域別天気アプリ（JMA）"
     page.padding = 20
@@ -77,7 +98,36 @@ def main(page: ft.Page):
         spacing=10
     )
 
-    def fetch_weather(region_code, city_name):
+    # 進行中の天気情報の取得（地域が切り替わったら取り消し、最新の結果だけを表示する）
+    fetch_task = None
+    # 表示中の地域の予報から取り出した細分区域ごとの天気（細分区域の切り替えは通信・解析せずにこれを使う）
+    area_forecasts = {}
+    displayed_city = None
+
+    def reset_areas():
+        """細分区域の選択を空にする"""
+        area_forecasts.clear()
+        area_dropdown.options = []
+        area_dropdown.value = None
+        area_dropdown.disabled = True
+
+    def show_area(area_code):
+        """取り出し済みの細分区域の天気を表示する"""
+        name, description, wind, wave = area_forecasts[area_code]
+        city_text.value = f"{displayed_city}（{name}）の天気" if len(area_forecasts) > 1 else f"{displayed_city} の天気"
+        description_text.value = f"状況: {description}"
+        wind_text.value = f"風: {wind}"
+        wave_text.value = f"波: {wave}"
+
+    def cancel_fetch():
+        """進行中の天気情報の取得を取り消す"""
+        nonlocal fetch_task
+        if fetch_task is not None and not fetch_task.done():
+            fetch_task.cancel()
+        fetch_task = None
+
+    async def fetch_weather(region_code, city_name):
+        nonlocal displayed_city
         url = API_BASE_URL.format(region_code)
 
         # ローディングインディケータを表示
@@ -85,36 +135,26 @@ def main(page: ft.Page):
         page.update()
 
         try:
-            response = requests.get(url)
+            # 通信は別スレッドで行い、その間もUIを操作できるようにする
+            response = await asyncio.to_thread(requests.get, url)
             if response.status_code == 200:
                 data = response.json()
                 if not data:
                     raise ValueError("APIからのデータが空です。")
 
-                # JMAのデータ構造に基づいて必要な情報を抽出
-                time_series = data[0].get('timeSeries', [])
-                if not time_series:
-                    raise ValueError("timeSeries データが見つかりません。")
-
-                # 直近の天気情報を取得
-                current_weather = time_series[0]
-                weathers = current_weather.get('areas', [])
-                if not weathers:
-                    raise ValueError("areas データが見つかりません。")
-
-                weather_description = weathers[0].get('weathers', ["データなし"])[0]
-                weather_wind = weathers[0].get('winds', ["データなし"])[0]
-                weather_wave = weathers[0].get('waves', ["データなし"])[0]
-                # JMA APIでは直接的な温度データが含まれていない場合が多いため、必要に応じて別のAPIやデータソースを使用して温度情報を取得する
-
-                # 天気情報を更新
-                city_text.value = f"{city_name} の天気"
-                description_text.value = f"状況: {weather_description}"
-                wind_text.value = f"風: {weather_wind}"
-                wave_text.value = f"波: {weather_wave}"
+                # すべての細分区域の天気を1回で取り出し、最初の細分区域を表示する
+                areas = extract_areas(data)
+                area_forecasts.clear()
+                area_forecasts.update(areas)
+                displayed_city = city_name
+                area_dropdown.options = [ft.dropdown.Option(key=code, text=name) for code, (name, *_) in areas.items()]
+                area_dropdown.value = next(iter(areas))
+                area_dropdown.disabled = len(areas) < 2
+                show_area(area_dropdown.value)
 
                 weather_icon.visible = False  # JMA APIには公式のアイコンがないため非表示
             else:
+                reset_areas()
                 city_text.value = "エラー"
                 description_text.value = f"天気情報の取得に失敗しました。ステータスコード: {response.status_code}"
                 description_text.size = 16
@@ -124,17 +164,23 @@ def main(page: ft.Page):
                 wave_text.size = 16
                 weather_icon.visible = False
         except Exception as ex:
+            reset_areas()
             city_text.value = "エラー"
             description_text.value = f"エラーが発生しました: {ex}"
             wind_text.value = f"エラーが発生しました: {ex}"
             wave_text.value = f"エラーが発生しました: {ex}"
             weather_icon.visible = False
         finally:
-            # ローディングインディケータを非表示
-            loading_indicator.visible = False
-            page.update()
+            # ローディングインディケータを非表示（取り消された場合は次の取得に任せる）
+            if asyncio.current_task() is fetch_task:
+                loading_indicator.visible = False
+                page.update()
+
+    async def on_center_change(e):
+        # 表示しようとしていた地域の取得は不要になる
+        cancel_fetch()
+        loading_indicator.visible = False
 
-    def on_center_change(e):
         selected_center = center_dropdown.value
         if selected_center:
             # オフィスドロップダウンを更新
@@ -148,6 +194,7 @@ def main(page: ft.Page):
             office_dropdown.disabled = True
 
         # 天気情報をリセット
+        reset_areas()
         city_text.value = "地域を選択して天気を確認してください。"
         description_text.value = ""
         wind_text.value = ""
@@ -155,12 +202,18 @@ def main(page: ft.Page):
         weather_icon.visible = False
         page.update()
 
-    def on_office_change(e):
+    async def on_office_change(e):
+        nonlocal fetch_task
+        # 前に選択した地域の取得がまだ終わっていなければ取り消す
+        cancel_fetch()
+        loading_indicator.visible = False
+
+        reset_areas()
         selected_office = office_dropdown.value
         if selected_office:
             office_code = OFFICE_CODES.get(selected_office)
             if office_code:
-                fetch_weather(office_code, selected_office)
+                fetch_task = asyncio.create_task(fetch_weather(office_code, selected_office))
             else:
                 city_text.value = "エラー"
                 description_text.value = "無効な地域コードです。"
@@ -169,6 +222,12 @@ def main(page: ft.Page):
                 weather_icon.visible = False
                 page.update()
 
+    async def on_area_change(e):
+        # 表示中の地域の予報から取り出し済みのため、通信・解析せずに切り替える
+        if area_dropdown.value in area_forecasts:
+            show_area(area_dropdown.value)
+            page.update()
+
     # センタードロップダウンを作成
     center_dropdown = ft.Dropdown(
         label="地方を選択",
@@ -186,6 +245,15 @@ def main(page: ft.Page):
         disabled=True  # センターが選択されるまで無効
     )
 
+    # 細分区域ドロップダウンを作成（天気情報を取得するまで無効）
+    area_dropdown = ft.Dropdown(
+        label="細分区域を選択",
+        options=[],
+        width=300,
+        on_change=on_area_change,
+        disabled=True
+    )
+
     # ローディングインディケータを中央に配置
     loading_view = ft.Row(
         controls=[loading_indicator],
@@ -197,6 +265,8 @@ def main(page: ft.Page):
         center_dropdown,
         ft.Container(height=10),  # スペースを追加
         office_dropdown,
+        ft.Container(height=10),  # スペースを追加
+        area_dropdown,
         loading_view,
         ft.Divider(height=20, color=ft.colors.GREY),
         weather_container
@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import sqlite3
+import argparse
+from array import array
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+from json_stream import iter_items
+
+# 上位から順に並べたエリアのレベル
+LEVELS = ('centers', 'offices', 'class10s', 'class15s', 'class20s')
+
+# このディレクトリにある area.json と、そこから作るスナップショット
+DEFAULT_AREA_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'area.json')
+DEFAULT_AREA_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'area.snapshot')
+
+# スナップショットのヘッダー（マジック, エリア数, 文字列数, 子の数, 文字列領域のバイト数）
+SNAPSHOT_MAGIC = b'JMAAREA1'
+SNAPSHOT_HEADER = struct.Struct('<8sIIII8x')
+
+def iter_area_entries(json_file=DEFAULT_AREA_JSON):
+    """
+    area.json を少しずつ読み込み、(レベル, コード, 詳細の辞書) を解析できたものから順に返します。
+    ファイル全体を辞書にしないため、大きなファイルでもメモリ使用量は1エリア分程度です。
+    """
+    with open(json_file, 'r', encoding='utf-8') as f:
+        for path, details in iter_items(f, lambda path: len(path) < 2):
+            if len(path) == 2:
+                yield path[0], path[1], details
+
+class StringTable:
+    """
+    スナップショット内の文字列領域を、文字列IDで参照するための読み取り専用のシーケンス。
+    同じ文字列は1度だけ格納されており（インターン）、参照されたときに初めてデコードします。
+    """
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        return str(self.blob[self.offsets[string_id]:self.offsets[string_id + 1]], 'utf-8')
+
+class InternedColumn:
+    """エリアの通し番号から、文字列IDを経由して文字列を返す列"""
+    def __init__(self, string_ids, strings):
+        self.string_ids = string_ids
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.string_ids)
+
+    def __getitem__(self, index):
+        return self.strings[self.string_ids[index]]
+
+class AreaIndex:
+    """
+    エリア階層（centers > offices > class10s > class15s > class20s）の読み取り専用インデックス。
+    エリアは通し番号で管理し、レベル・親・子の関係を配列で持ちます。
+    親・子・名前・コードの参照は O(1)、祖先の参照は階層の深さ（最大4段）に比例します。
+    スナップショットから開いた場合は、コード・名前の参照はソート済みの索引の二分探索（O(log n)）になり、
+    起動時に全エリアを読み込む必要がありません。
+
+    JMAのデータには別のレベルで同じコードを持つエリア（例: 011000 は地方の九州南部・奄美地方と、
+    府県予報区・一次細分区域の宗谷地方の3つ）があるため、コードだけでは一意に決まりません。
+    level を指定しない場合、office_of() は府県予報区を優先し、それ以外のメソッドは上位のレベルのエリアを返します。
+    levels() でコードが存在するレベルを調べ、level を指定して区別してください。
+
+    :param entries: (level, code, name, parent_code) のリスト（上位レベルから順に並んでいること）
+    """
+    def __init__(self, entries):
+        codes = []
+        names = []
+        levels = array('b')
+        by_level_code = {}
+        by_code = {}
+        for level, code, name, _ in entries:
+            index = len(codes)
+            codes.append(code)
+            names.append(name)
+            levels.append(LEVELS.index(level))
+            by_level_code[(level, code)] = index
+            by_code.setdefault(code, index)
+
+        # 親はひとつ上のレベルから探し、見つからなければ（area.db で重複コードが失われている場合）任意のレベルから探す
+        parents = array('i', [-1] * len(codes))
+        for index, (level, _, _, parent) in enumerate(entries):
+            if parent:
+                parent_level = LEVELS[LEVELS.index(level) - 1] if level != LEVELS[0] else None
+                parents[index] = by_level_code.get((parent_level, parent), by_code.get(parent, -1))
+
+        # 子はCSR形式（child_offsets[i]:child_offsets[i+1] が i の子の範囲）で持つ
+        counts = [0] * (len(codes) + 1)
+        for parent in parents:
+            if parent >= 0:
+                counts[parent + 1] += 1
+        child_offsets = array('i', counts)
+        for i in range(1, len(child_offsets)):
+            child_offsets[i] += child_offsets[i - 1]
+        child_indices = array('i', [0] * child_offsets[-1])
+        cursor = array('i', child_offsets[:-1])
+        for index, parent in enumerate(parents):
+            if parent >= 0:
+                child_indices[cursor[parent]] = index
+                cursor[parent] += 1
+
+        # entries はレベル順に並んでいるため、レベルごとの範囲を持っておく
+        level_offsets = array('i', [0] * (len(LEVELS) + 1))
+        for value in levels:
+            level_offsets[value + 1] += 1
+        for i in range(1, len(level_offsets)):
+            level_offsets[i] += level_offsets[i - 1]
+
+        self._codes = tuple(codes)
+        self._names = tuple(names)
+        self._levels = levels
+        self._parents = parents
+        self._child_offsets = child_offsets
+        self._child_indices = child_indices
+        self._level_offsets = level_offsets
+        self._by_level_code = by_level_code
+        self._by_code = by_code
+        self._by_name = {}
+        for index, name in enumerate(names):
+            self._by_name.setdefault(name, index)
+            self._by_name.setdefault((LEVELS[levels[index]], name), index)
+        self._code_order = None
+        self._name_order = None
+        self._mmap = None
+
+    @classmethod
+    def from_json(cls, json_file=DEFAULT_AREA_JSON, stream=True):
+        """
+        area.json からインデックスを作成する。
+        stream が False なら json.load でまとめて解析する（メモリは使うが、小さなファイルではこちらが速い）
+        """
+        if stream:
+            items = iter_area_entries(json_file)
+        else:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            items = ((level, code, details) for level, areas in data.items() for code, details in areas.items())
+        entries = [(level, code, details.get('name'), details.get('parent'))
+                   for level, code, details in items
+                   if level in LEVELS]
+        entries.sort(key=lambda entry: LEVELS.index(entry[0]))
+        return cls(entries)
+
+    @classmethod
+    def from_db(cls, db_name='area.db'):
+        """area.db の area テーブルからインデックスを作成する"""
+        conn = sqlite3.connect(db_name)
+        try:
+            rows = conn.execute("SELECT level, code, name, parent FROM area ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        rows.sort(key=lambda row: LEVELS.index(row[0]))
+        return cls(rows)
+
+    @classmethod
+    def open_snapshot(cls, snapshot_file=DEFAULT_AREA_SNAPSHOT):
+        """
+        save_snapshot() で作成したスナップショットをメモリマップで開きます。
+        配列はファイルをそのまま参照し、文字列は参照されたときにデコードするため、
+        開くコストはエリア数に依存しません。
+        """
+        with open(snapshot_file, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, string_count, child_count, blob_size = SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC:
+            mapped.close()
+            raise ValueError(f"エリアのスナップショットではありません: {snapshot_file}")
+
+        view = memoryview(mapped)
+        position = SNAPSHOT_HEADER.size
+
+        def take(length, fmt='i'):
+            nonlocal position
+            size = struct.calcsize(fmt) * length
+            column = view[position:position + size]
+            position += size
+            if sys.byteorder == 'little':
+                return column.cast(fmt)
+            # ファイルはリトルエンディアンで保存しているため、ビッグエンディアン環境ではコピーして変換する
+            converted = array(fmt, column.tobytes())
+            converted.byteswap()
+            return converted
+
+        strings_offsets = take(string_count + 1)
+        code_ids = take(count)
+        name_ids = take(count)
+        parents = take(count)
+        child_offsets = take(count + 1)
+        child_indices = take(child_count)
+        level_offsets = take(len(LEVELS) + 1)
+        code_order = take(count)
+        name_order = take(count)
+        levels = take(count, 'b')
+        blob = view[position:position + blob_size]
+
+        index = cls.__new__(cls)
+        strings = StringTable(strings_offsets, blob)
+        index._codes = InternedColumn(code_ids, strings)
+        index._names = InternedColumn(name_ids, strings)
+        index._levels = levels
+        index._parents = parents
+        index._child_offsets = child_offsets
+        index._child_indices = child_indices
+        index._level_offsets = level_offsets
+        index._by_level_code = None
+        index._by_code = None
+        index._by_name = None
+        index._code_order = code_order
+        index._name_order = name_order
+        index._mmap = mapped
+        return index
+
+    def save_snapshot(self, snapshot_file=DEFAULT_AREA_SNAPSHOT):
+        """
+        インデックスを、メモリマップで開けるバイナリのスナップショットとして保存します。
+        文字列はインターンして文字列領域に1度だけ格納し、コード・名前にはソート済みの索引を付けます。
+        """
+        string_ids = {}
+        strings = []
+
+        def intern(value):
+            value = value or ''
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value.encode('utf-8'))
+            return string_ids[value]
+
+        count = len(self)
+        code_ids = array('i', (intern(self._codes[i]) for i in range(count)))
+        name_ids = array('i', (intern(self._names[i]) for i in range(count)))
+        strings_offsets = array('i', [0])
+        for encoded in strings:
+            strings_offsets.append(strings_offsets[-1] + len(encoded))
+        blob = b''.join(strings)
+
+        # コードは (コード, レベル)、名前は (名前, 通し番号) の順に並べた索引
+        code_order = array('i', sorted(range(count), key=lambda i: (self._codes[i], self._levels[i])))
+        name_order = array('i', sorted(range(count), key=lambda i: (self._names[i] or '', i)))
+
+        columns = [strings_offsets, code_ids, name_ids, array('i', self._parents),
+                   array('i', self._child_offsets), array('i', self._child_indices),
+                   array('i', self._level_offsets), code_order, name_order, array('b', self._levels)]
+        if sys.byteorder != 'little':
+            for column in columns:
+                column.byteswap()
+
+        tmp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, len(strings),
+                                         len(self._child_indices), len(blob)))
+            for column in columns:
+                column.tofile(f)
+            f.write(blob)
+        os.replace(tmp_file, snapshot_file)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return self._find_code(code) is not None
+
+    def _find_code(self, code, level=None):
+        if self._by_code is not None:
+            return self._by_code.get(code) if level is None else self._by_level_code.get((level, code))
+        # スナップショットでは (コード, レベル) 順の索引を二分探索する。レベル未指定なら最上位のものになる
+        codes, levels = self._codes, self._levels
+        target = (code, -1 if level is None else LEVELS.index(level))
+        position = bisect_left(self._code_order, target, key=lambda i: (codes[i], levels[i]))
+        if position < len(self._code_order):
+            index = self._code_order[position]
+            if codes[index] == code and (level is None or levels[index] == target[1]):
+                return index
+        return None
+
+    def levels(self, code):
+        """コードが存在するレベルのリストを上位から返す（JMAのコードは複数のレベルにあることがある）"""
+        if self._by_code is not None:
+            return [level for level in LEVELS if (level, code) in self._by_level_code]
+        codes, levels = self._codes, self._levels
+        position = bisect_left(self._code_order, (code, -1), key=lambda i: (codes[i], levels[i]))
+        result = []
+        while position < len(self._code_order) and codes[self._code_order[position]] == code:
+            result.append(LEVELS[levels[self._code_order[position]]])
+            position += 1
+        return result
+
+    def _find_name(self, name, level=None):
+        if self._by_name is not None:
+            return self._by_name.get(name if level is None else (level, name))
+        # 名前の索引は (名前, 通し番号) 順で、通し番号はレベル順のため (名前, レベル) でも二分探索できる
+        names, levels = self._names, self._levels
+        target = (name, -1 if level is None else LEVELS.index(level))
+        position = bisect_left(self._name_order, target, key=lambda i: (names[i], levels[i]))
+        if position < len(self._name_order):
+            index = self._name_order[position]
+            if names[index] == name and (level is None or levels[index] == target[1]):
+                return index
+        return None
+
+    def _index(self, code, level=None):
+        index = self._find_code(code, level)
+        if index is None:
+            raise KeyError(code if level is None else (level, code))
+        return index
+
+    def _entry(self, index):
+        return self._codes[index], self._names[index]
+
+    def name(self, code, level=None):
+        """コードからエリア名を返す"""
+        return self._names[self._index(code, level)]
+
+    def level(self, code, level=None):
+        """コードからレベルを返す（同じコードが複数レベルにある場合は上位のもの。すべてのレベルは levels() で返す）"""
+        return LEVELS[self._levels[self._index(code, level)]]
+
+    def code(self, name, level=None):
+        """エリア名からコードを返す（見つからなければ None）"""
+        index = self._find_name(name, level)
+        return None if index is None else self._codes[index]
+
+    def parent(self, code, level=None):
+        """親エリアの (code, name) を返す（最上位なら None）"""
+        parent = self._parents[self._index(code, level)]
+        return None if parent < 0 else self._entry(parent)
+
+    def children(self, code, level=None):
+        """子エリアの (code, name) のリストを返す"""
+        index = self._index(code, level)
+        start, end = self._child_offsets[index], self._child_offsets[index + 1]
+        return [self._entry(child) for child in self._child_indices[start:end]]
+
+    def ancestors(self, code, level=None):
+        """
+        親から最上位までの (level, code, name) のリストを返す。
+        level を指定しない場合は上位のレベルのエリアの祖先になる（例: 011000 は地方のため空のリスト）
+        """
+        result = []
+        index = self._parents[self._index(code, level)]
+        while index >= 0 and len(result) < len(LEVELS):
+            result.append((LEVELS[self._levels[index]], *self._entry(index)))
+            index = self._parents[index]
+        return result
+
+    def descendants(self, code, level=None):
+        """すべての子孫の (level, code, name) のリストを返す（幅優先）"""
+        result = []
+        queue = deque([self._index(code, level)])
+        while queue:
+            index = queue.popleft()
+            start, end = self._child_offsets[index], self._child_offsets[index + 1]
+            for child in self._child_indices[start:end]:
+                result.append((LEVELS[self._levels[child]], *self._entry(child)))
+                queue.append(child)
+        return result
+
+    def entries(self, level):
+        """指定したレベルのエリアの (code, name) のリストを返す"""
+        target = LEVELS.index(level)
+        return [self._entry(index) for index in range(self._level_offsets[target], self._level_offsets[target + 1])]
+
+    def office_of(self, code, level=None):
+        """
+        任意のレベルのエリアコードから、その予報を配信している office のコードを返す。
+        level を指定しない場合、府県予報区にもあるコードはその府県予報区とみなす（例: 011000 は宗谷地方）。
+        centers や未知のコードの場合は None。
+        """
+        if level is None and self._find_code(code, 'offices') is not None:
+            return code
+        index = self._find_code(code, level)
+        if index is None:
+            return None
+        # コードだけで引くと上位レベルになるため、office と同じコードの細分区域も office 自身になる
+        start_level = self._levels[index]
+        while index >= 0:
+            value = self._levels[index]
+            if value == LEVELS.index('offices'):
+                return self._codes[index]
+            if value == LEVELS.index('centers'):
+                # area.db では重複コードの下位の行が失われているため、細分区域の親が centers になることがある。
+                # その場合はそのコードの office（例: 宗谷地方 011000）とみなす
+                return self._codes[index] if start_level > value else None
+            index = self._parents[index]
+        return None
+
+def build_snapshot(json_file=DEFAULT_AREA_JSON, snapshot_file=DEFAULT_AREA_SNAPSHOT):
+    """area.json からスナップショットを作成する"""
+    AreaIndex.from_json(json_file).save_snapshot(snapshot_file)
+    print(f"{json_file} から {snapshot_file} を作成しました。")
+
+@lru_cache(maxsize=None)
+def load_area_index(path=DEFAULT_AREA_JSON):
+    """
+    エリアインデックスを読み込む（同じパスは一度だけ読み込み、以降は同じオブジェクトを返す）。
+    拡張子が .db の場合は area.db、.snapshot の場合はスナップショット、それ以外は area.json として読み込みます。
+    area.json を指定した場合でも、同じディレクトリにそれより新しいスナップショットがあればそちらを開きます。
+    スナップショットがない（または古い）場合は area.json を json.load で読み込み、次回のためにスナップショットを作成します。
+    """
+    if path.endswith('.db'):
+        return AreaIndex.from_db(path)
+    if path.endswith('.snapshot'):
+        return AreaIndex.open_snapshot(path)
+    snapshot_file = os.path.splitext(path)[0] + '.snapshot'
+    try:
+        if os.path.getmtime(snapshot_file) >= os.path.getmtime(path):
+            return AreaIndex.open_snapshot(snapshot_file)
+    except (OSError, ValueError):
+        pass
+    index = AreaIndex.from_json(path, stream=False)
+    try:
+        index.save_snapshot(snapshot_file)
+    except OSError as e:
+        print(f"エリアのスナップショットを保存できませんでした: {e}")
+    return index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="area.json からエリアのスナップショットを作成します")
+    parser.add_argument('json_file', nargs='?', default=DEFAULT_AREA_JSON, help="読み込む area.json")
+    parser.add_argument('snapshot_file', nargs='?', default=DEFAULT_AREA_SNAPSHOT, help="作成するスナップショット")
+    args = parser.parse_args()
+    build_snapshot(args.json_file, args.snapshot_file)
@@ -0,0 +1,932 @@
+import os
+import sqlite3
+import tempfile
+import time
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import create_area_db
+import create_weather_db
+
+# ベンチマーク用の合成データの既定値
+REPORT_DATETIME = '2024-12-17T11:00:00+09:00'
+
+def load_offices(area_db='area.db'):
+    """area.db から {office_code: (name, [(class10_code, class10_name), ...])} を読み込む"""
+    conn = sqlite3.connect(area_db)
+    try:
+        offices = {code: (name, []) for code, name in conn.execute(
+            "SELECT code, name FROM area WHERE level = 'offices' ORDER BY id")}
+        for code, name, parent in conn.execute(
+                "SELECT code, name, parent FROM area WHERE level = 'class10s' ORDER BY id"):
+            if parent in offices:
+                offices[parent][1].append((code, name))
+    finally:
+        conn.close()
+    return offices
+
+def make_forecast_payload(office_code, office_name, sub_areas, report_datetime=REPORT_DATETIME):
+    """JMAの forecast/{office}.json と同じ構造の合成データを作成する"""
+    base = datetime.fromisoformat(report_datetime)
+    day0 = base.replace(hour=0)
+    sub_areas = sub_areas or [(office_code, office_name)]
+    times3 = [(base if i == 0 else day0 + timedelta(days=i)).isoformat() for i in range(3)]
+    times6 = [(day0 + timedelta(hours=6 * i + 12)).isoformat() for i in range(6)]
+    times4 = [(day0 + timedelta(days=d, hours=h)).isoformat() for d in (1, 2) for h in (0, 9)]
+    week = [(day0 + timedelta(days=i + 1)).isoformat() for i in range(7)]
+    city_code = office_code[:5] + '9'
+    return [
+        {
+            'publishingOffice': f'{office_name}気象台',
+            'reportDatetime': report_datetime,
+            'timeSeries': [
+                {'timeDefines': times3, 'areas': [
+                    {'area': {'name': name, 'code': code}, 'weatherCodes': ['100', '201', '300'],
+                     'weathers': ['晴れ', 'くもり', '雨'], 'winds': ['北の風'] * 3, 'waves': ['１メートル'] * 3}
+                    for code, name in sub_areas]},
+                {'timeDefines': times6, 'areas': [
+                    {'area': {'name': name, 'code': code}, 'pops': ['', '10', '20', '30', '40', '0']}
+                    for code, name in sub_areas]},
+                {'timeDefines': times4, 'areas': [
+                    {'area': {'name': name, 'code': code}, 'temps': ['5', '10', '3', '12']}
+                    for code, name in sub_areas]},
+            ],
+        },
+        {
+            'publishingOffice': f'{office_name}気象台',
+            'reportDatetime': report_datetime,
+            'timeSeries': [
+                {'timeDefines': week, 'areas': [
+                    {'area': {'name': office_name, 'code': office_code}, 'weatherCodes': ['101'] * 7,
+                     'pops': ['', '20', '30', '40', '50', '10', '0'], 'reliabilities': ['', '', 'A', 'B', 'C', 'A', 'B']}]},
+                {'timeDefines': week, 'areas': [
+                    {'area': {'name': office_name, 'code': city_code},
+                     'tempsMin': ['', '1', '2', '3', '4', '5', '6'], 'tempsMax': ['', '9', '8', '7', '6', '5', '4']}]},
+            ],
+            'tempAverage': {'areas': [{'area': {'name': office_name, 'code': city_code}, 'min': '2.0', 'max': '10.0'}]},
+        },
+    ]
+
+def make_payloads(rounds=1, area_db='area.db'):
+    """全officeの合成データを rounds 回分（発表時刻をずらして）作成する"""
+    offices = load_offices(area_db)
+    start = datetime.fromisoformat(REPORT_DATETIME)
+    payloads = []
+    for r in range(rounds):
+        report_datetime = (start + timedelta(hours=6 * r)).isoformat()
+        for code, (name, sub_areas) in offices.items():
+            payloads.append((code, make_forecast_payload(code, name, sub_areas, report_datetime)))
+    return payloads
+
+def count_rows(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in create_weather_db.TABLE_COLUMNS)
+    finally:
+        conn.close()
+
+def report(label, rows, seconds):
+    print(f"{label:<40} {rows:>8} 行 {seconds:>8.3f} 秒 {rows / seconds if seconds else 0:>12,.0f} 行/秒")
+
+def legacy_insert_data_from_json(data, db_name='weather.db'):
+    """以前の create_weather_db.py の insert_data_from_json（1行ずつINSERTし、エリアごとに接続・コミットする）。比較用"""
+    if not data:
+        print("データがありません")
+        return
+
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    
+    try:
+        # publishing_officesテーブルにデータを挿入
+        cursor.execute('''
+            INSERT OR IGNORE INTO publishing_offices (name, code)
+            VALUES (?, ?)
+        ''', (data[0]['publishingOffice'], None))
+        publishing_office_id = cursor.lastrowid
+
+        # 各種データの挿入
+        for forecast in data[0]['timeSeries']:
+            # weather_forecastsテーブル
+            if 'areas' in forecast and 'weatherCodes' in forecast['areas'][0]:
+                for area in forecast['areas']:
+                    for i, time in enumerate(forecast['timeDefines']):
+                        cursor.execute('''
+                            INSERT INTO weather_forecasts (
+                                publishing_office_id, report_datetime, area_code,
+                                target_datetime, weather_code, weather_text,
+                                wind_text, wave_text
+                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', (
+                            publishing_office_id,
+                            data[0]['reportDatetime'],
+                            area['area']['code'],
+                            time,
+                            area['weatherCodes'][i] if 'weatherCodes' in area else None,
+                            area['weathers'][i] if 'weathers' in area else None,
+                            area['winds'][i] if 'winds' in area else None,
+                            area['waves'][i] if 'waves' in area else None
+                        ))
+
+            # precipitation_probability_forecastsテーブル
+            elif 'areas' in forecast and 'pops' in forecast['areas'][0]:
+                for area in forecast['areas']:
+                    for i, time in enumerate(forecast['timeDefines']):
+                        cursor.execute('''
+                            INSERT INTO precipitation_probability_forecasts (
+                                publishing_office_id, report_datetime, area_code,
+                                target_datetime, probability
+                            ) VALUES (?, ?, ?, ?, ?)
+                        ''', (
+                            publishing_office_id,
+                            data[0]['reportDatetime'],
+                            area['area']['code'],
+                            time,
+                            area['pops'][i] if area['pops'][i] != '' else None
+                        ))
+
+            # temperature_forecastsテーブル
+            elif 'areas' in forecast and 'temps' in forecast['areas'][0]:
+                for area in forecast['areas']:
+                    for i, time in enumerate(forecast['timeDefines']):
+                        cursor.execute('''
+                            INSERT INTO temperature_forecasts (
+                                publishing_office_id, report_datetime, area_code,
+                                target_datetime, temperature
+                            ) VALUES (?, ?, ?, ?, ?)
+                        ''', (
+                            publishing_office_id,
+                            data[0]['reportDatetime'],
+                            area['area']['code'],
+                            time,
+                            area['temps'][i] if area['temps'][i] != '' else None
+                        ))
+
+        # 週間予報データの挿入
+        if len(data) > 1 and 'timeSeries' in data[1]:
+            for forecast in data[1]['timeSeries']:
+                for area in forecast['areas']:
+                    for i, time in enumerate(forecast['timeDefines']):
+                        cursor.execute('''
+                            INSERT INTO weekly_forecasts (
+                                publishing_office_id, report_datetime, area_code,
+                                target_date, weather_code, precipitation_probability,
+                                reliability
+                            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', (
+                            publishing_office_id,
+                            data[1]['reportDatetime'],
+                            area['area']['code'],
+                            time,
+                            area['weatherCodes'][i] if 'weatherCodes' in area else None,
+                            area['pops'][i] if 'pops' in area and area['pops'][i] != '' else None,
+                            area['reliabilities'][i] if 'reliabilities' in area else None
+                        ))
+
+        # 平均値データの挿入
+        if 'tempAverage' in data[1]:
+            for area in data[1]['tempAverage']['areas']:
+                cursor.execute('''
+                    INSERT INTO climate_averages (
+                        publishing_office_id, report_datetime, area_code,
+                        type, min_value, max_value
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    publishing_office_id,
+                    data[1]['reportDatetime'],
+                    area['area']['code'],
+                    'temperature',
+                    area['min'],
+                    area['max']
+                ))
+
+        conn.commit()
+        print("データベースへの挿入が完了しました")
+
+    except sqlite3.Error as e:
+        print(f"データベースエラーが発生しました: {e}")
+        conn.rollback()
+
+    finally:
+        conn.close()
+
+def bench_ingest(rounds=20, area_db='area.db'):
+    """
+    以前の insert_data_from_json（1行ずつINSERT）、現在の insert_data_from_json（エリアごとに接続・コミット）、
+    BatchWriter の挿入速度を比較する
+    """
+    payloads = make_payloads(rounds, area_db)
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_db = os.path.join(tmp, 'baseline.db')
+        legacy_db = os.path.join(tmp, 'legacy.db')
+        batch_db = os.path.join(tmp, 'batch.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_weather_db.create_database(baseline_db)
+            create_weather_db.create_database(legacy_db)
+            create_weather_db.create_database(batch_db)
+
+            start = time.perf_counter()
+            for _, data in payloads:
+                legacy_insert_data_from_json(data, baseline_db)
+            baseline_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _, data in payloads:
+                create_weather_db.insert_data_from_json(data, legacy_db)
+            legacy_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with create_weather_db.BatchWriter(batch_db) as writer:
+                for _, data in payloads:
+                    writer.add(data)
+            batch_seconds = time.perf_counter() - start
+
+        print(f"[ingest] {len(payloads)} 件の予報データ")
+        report("以前の insert_data_from_json (1行ずつ)", count_rows(baseline_db), baseline_seconds)
+        report("insert_data_from_json (接続/コミット毎回)", count_rows(legacy_db), legacy_seconds)
+        report("BatchWriter (単一接続・一括コミット)", count_rows(batch_db), batch_seconds)
+
+def build_area_db(db_name, json_file='area.json'):
+    """area.json から area.db を作成する"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_area_db.create_database(db_name)
+        create_area_db.insert_data_from_json(json_file, db_name)
+
+def build_history_db(db_name, rounds, area_db='area.db'):
+    """rounds 回分（6時間ごと）の発表を蓄積した weather.db を作成する"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_weather_db.create_database(db_name)
+        with create_weather_db.BatchWriter(db_name, upsert=False) as writer:
+            for _, data in make_payloads(rounds, area_db):
+                writer.add(data)
+
+def time_lookups(func, args, repeat=5):
+    """func(arg) を全引数について repeat 回実行し、1回あたりの平均時間（ミリ秒）を返す"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for arg in args:
+            func(arg)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(args))
+
+def bench_query(days=90, area_db='area.db'):
+    """
+    数か月分の履歴がある weather.db で、アプリのクエリが全件走査していないことを確認し、
+    複合インデックスの有無による履歴のテーブルからの天気予報（FORECAST_SQL）の応答時間を比較する
+    """
+    from main_1 import WeatherApp
+
+    rounds = days * 4
+    with tempfile.TemporaryDirectory() as tmp:
+        weather_db = os.path.join(tmp, 'weather.db')
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        build_history_db(weather_db, rounds, area_db)
+        app = WeatherApp(weather_db, tmp_area_db)
+
+        print(f"[query] {days} 日分（{rounds} 回の発表, {count_rows(weather_db):,} 行）")
+        for name, details in app.explain_query_plans().items():
+            print(f"  {name}: {' / '.join(details)}")
+        full_scans = app.find_full_scans()
+        if full_scans:
+            for name, detail in full_scans:
+                print(f"テーブル・インデックス全体を走査しているクエリがあります: {name}: {detail}")
+            raise SystemExit(1)
+
+        area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+
+        def from_history(code):
+            return app.query(app.weather_pool, app.forecast_sql, (code,))
+
+        indexed_ms = time_lookups(from_history, area_codes)
+
+        conn = sqlite3.connect(weather_db)
+        conn.execute("DROP INDEX idx_weather_forecasts_area_target")
+        conn.close()
+        legacy_ms = time_lookups(from_history, area_codes, repeat=1)
+
+        print(f"  履歴からの天気予報 複合インデックスなし: {legacy_ms:8.3f} ms/回")
+        print(f"  履歴からの天気予報 複合インデックスあり: {indexed_ms:8.3f} ms/回")
+
+def bench_pool(days=7, area_db='area.db'):
+    """
+    WeatherApp の検索について、呼び出しごとに接続してSQLを実行する場合と、
+    プールした接続（天気予報）・AreaIndex（都道府県一覧）を使う場合を比較する
+    """
+    import main_1
+    from main_1 import WeatherApp
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weather_db = os.path.join(tmp, 'weather.db')
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        build_history_db(weather_db, days * 4, area_db)
+        app = WeatherApp(weather_db, tmp_area_db)
+
+        def connect_per_call(connect, sql):
+            def lookup(arg):
+                conn = connect()
+                try:
+                    return conn.execute(sql, (arg,)).fetchall()
+                finally:
+                    conn.close()
+            return lookup
+
+        # 以前の get_prefectures が毎回実行していたSQL
+        prefectures_sql = """
+            SELECT Code, Name FROM area
+            WHERE Level = 'offices' AND parent = ?
+            ORDER BY ID
+        """
+        region_codes = [code for code, _ in app.get_regions()]
+        area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+        cases = [
+            ('get_prefectures', region_codes,
+             connect_per_call(app.connect_area_db, prefectures_sql), app.get_prefectures),
+            ('get_weather_forecast', area_codes,
+             connect_per_call(app.connect_weather_db, main_1.FORECAST_SQL), app.get_weather_forecast),
+        ]
+        print(f"[pool] {days} 日分の履歴")
+        for name, args, per_call, pooled in cases:
+            per_call_ms = time_lookups(per_call, args, repeat=20)
+            pooled_ms = time_lookups(pooled, args, repeat=20)
+            print(f"  {name:<22} 毎回接続: {per_call_ms:7.3f} ms/回  現在の実装: {pooled_ms:7.3f} ms/回")
+        app.close()
+
+def make_scaled_area_json(json_file, scale, source='area.json'):
+    """class20s を scale 倍に増やした合成の area.json を作成する"""
+    with open(source, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    class20s = data['class20s']
+    originals = list(class20s.items())
+    for copy in range(1, scale):
+        for code, details in originals:
+            class20s[f"{code}-{copy}"] = {**details, 'name': f"{details['name']}{copy}"}
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def cold_start_seconds(loader, path, repeat=3):
+    """新しいプロセスで AreaIndex を読み込み、最初の参照が終わるまでの時間（秒, 最小値）を返す"""
+    script = (
+        "import time; start = time.perf_counter();"
+        "from area_index import AreaIndex;"
+        f"areas = AreaIndex.{loader}({path!r});"
+        "areas.children('010300', 'centers'); areas.name('130010');"
+        "print(time.perf_counter() - start)"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    return min(float(subprocess.run([sys.executable, '-c', script], cwd=here, check=True,
+                                    capture_output=True, text=True).stdout)
+               for _ in range(repeat))
+
+def bench_startup(scales=(1, 10, 50)):
+    """area.json の大きさを変えて、JSONとスナップショットからの起動時間を比較する"""
+    from area_index import build_snapshot
+
+    print("[startup] AreaIndex の読み込みから最初の参照まで（新しいプロセス）")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            json_file = os.path.join(tmp, f'area_x{scale}.json')
+            snapshot_file = os.path.join(tmp, f'area_x{scale}.snapshot')
+            make_scaled_area_json(json_file, scale)
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_snapshot(json_file, snapshot_file)
+            json_ms = cold_start_seconds('from_json', json_file) * 1000
+            snapshot_ms = cold_start_seconds('open_snapshot', snapshot_file) * 1000
+            print(f"  x{scale:<3} area.json {os.path.getsize(json_file) / 1e6:6.1f} MB: {json_ms:8.2f} ms  "
+                  f"スナップショット {os.path.getsize(snapshot_file) / 1e6:6.1f} MB: {snapshot_ms:8.2f} ms")
+
+def count_controls(control):
+    """コントロールとその子孫の数を返す"""
+    return 1 + sum(count_controls(child) for child in control._get_children())
+
+def make_daily_views(refresh, days=7):
+    """
+    refresh 回目の再取得で表示する (日付, カードの値) のリストを作成する。
+    再取得ごとに1日分の降水確率が変わり、8回に1回は日付が1日進む。
+    """
+    start = datetime(2024, 12, 17) + timedelta(days=refresh // 8)
+    items = []
+    for i in range(days):
+        date = (start + timedelta(days=i)).strftime('%Y-%m-%d')
+        items.append((date, {
+            'date': date,
+            'description': '晴れ　時々　くもり',
+            'icon_src': f'/icons/{100 + i}.png',
+            'wind': '北の風　やや強く',
+            'wave': '１メートル',
+            'pop': str((refresh * 10 + i) % 100) if i == refresh % days else '20',
+            'temp': str(5 + i),
+        }))
+    return items
+
+def bench_view(refreshes=200, days=7):
+    """再取得のたびにカードを作り直す場合と、KeyedList で差分だけ更新する場合を比較する"""
+    import flet as ft
+    from weather_view import KeyedList, DayCardView
+
+    print(f"[view] 天気カード {days} 件の再取得 {refreshes} 回")
+
+    # 従来の方法: リストをクリアしてすべてのカードを作り直す
+    weather_list = ft.ListView()
+    created = 0
+    start = time.perf_counter()
+    for refresh in range(refreshes):
+        weather_list.controls.clear()
+        for _, day in make_daily_views(refresh, days):
+            card = DayCardView()
+            card.update(day)
+            weather_list.controls.append(card.control)
+            created += count_controls(card.control)
+    rebuild_seconds = time.perf_counter() - start
+    print(f"  作り直し:   コントロール作成 {created / refreshes:6.1f} 個/回  "
+          f"{rebuild_seconds / refreshes * 1000:7.3f} ms/回")
+
+    # KeyedList: 日付ごとにカードを使い回し、変わったプロパティだけを書き換える
+    weather_list = ft.ListView()
+    day_cards = KeyedList(weather_list, 'controls', DayCardView)
+    controls_per_card = count_controls(DayCardView().control)
+    start = time.perf_counter()
+    for refresh in range(refreshes):
+        day_cards.sync(make_daily_views(refresh, days))
+    keyed_seconds = time.perf_counter() - start
+    stats = day_cards.stats()
+    print(f"  差分更新:   コントロール作成 {stats['created'] * controls_per_card / refreshes:6.1f} 個/回  "
+          f"{keyed_seconds / refreshes * 1000:7.3f} ms/回  "
+          f"（更新したカード {stats['patched'] / refreshes:.1f} 枚/回）")
+
+def legacy_daily(data):
+    """以前の main.py と同じ方法で、最初の地域の予報を日付ごとにまとめる（比較用）"""
+    weather_ts = pops_ts = temps_ts = None
+    for ts in data[0].get('timeSeries', []):
+        areas = ts.get('areas', [])
+        if not areas:
+            continue
+        if 'weathers' in areas[0]:
+            weather_ts = ts
+        elif 'pops' in areas[0]:
+            pops_ts = ts
+        elif 'temps' in areas[0]:
+            temps_ts = ts
+
+    def extract_date(time_str):
+        return datetime.fromisoformat(time_str).strftime("%Y-%m-%d")
+
+    daily_data = {}
+    for ts, fields in ((weather_ts, (('weathers', 'description', "データなし"), ('winds', 'wind', "データなし"),
+                                     ('waves', 'wave', "データなし"), ('weatherCodes', 'weather_code', "unknown"))),
+                       (pops_ts, (('pops', 'pop', "データなし"),)),
+                       (temps_ts, (('temps', 'temp', "データなし"),))):
+        if ts is None:
+            continue
+        area = ts['areas'][0]
+        for key, field, default in fields:
+            values = area.get(key, [])
+            for i, time_define in enumerate(ts.get('timeDefines', [])):
+                daily_data.setdefault(extract_date(time_define), {})[field] = \
+                    values[i] if i < len(values) else default
+    return sorted(daily_data.items())
+
+def bench_normalize(rounds=20, area_db='area.db'):
+    """予報JSONの日ごとの集計を、以前の方法（最初の地域のみ）と ForecastFrame（全地域）で比較する"""
+    from forecast_frame import ForecastFrame
+
+    payloads = [data for _, data in make_payloads(1, area_db)]
+    for data in payloads:
+        assert ForecastFrame(data).daily() == legacy_daily(data)
+
+    area_count = sum(len(ForecastFrame(data).get('weather').codes) for data in payloads)
+    print(f"[normalize] 全 {len(payloads)} 地域（細分区域 {area_count} 件）の予報 x {rounds} 回")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in payloads:
+            legacy_daily(data)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in payloads:
+            ForecastFrame(data).daily_by_area()
+    frame_seconds = time.perf_counter() - start
+
+    per_office = rounds * len(payloads)
+    print(f"  以前の方法（最初の地域のみ）:   {legacy_seconds / per_office * 1e6:8.1f} µs/地域")
+    print(f"  ForecastFrame（全細分区域）:   {frame_seconds / per_office * 1e6:8.1f} µs/地域  "
+          f"（{frame_seconds / (rounds * area_count) * 1e6:.1f} µs/細分区域）")
+
+def measure(func):
+    """func() の実行時間（秒）と、その間に確保したメモリのピーク（バイト）を返す"""
+    import tracemalloc
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        func()
+        return time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_stream(scale=100):
+    """大きな area.json を、json.load とストリーミング（iter_area_entries）で読み込んで比較する"""
+    from area_index import iter_area_entries
+
+    def load_all(json_file):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [(level, code, details) for level, entries in data.items() for code, details in entries.items()]
+
+    def first_entry(entries):
+        next(iter(entries))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, f'area_x{scale}.json')
+        make_scaled_area_json(json_file, scale)
+        print(f"[stream] area.json x{scale}（{os.path.getsize(json_file) / 1e6:.1f} MB）の読み込み")
+
+        # 読み込む内容が同じであることを確認する
+        assert load_all(json_file) == list(iter_area_entries(json_file))
+
+        cases = [
+            ("json.load", lambda: load_all(json_file)),
+            ("ストリーミング", lambda: sum(1 for _ in iter_area_entries(json_file))),
+        ]
+        for label, func in cases:
+            seconds, peak = measure(func)
+            print(f"  {label:<10} 全件: {seconds * 1000:8.1f} ms  ピークメモリ: {peak / 1e6:7.1f} MB")
+        for label, func in [("json.load", lambda: first_entry(load_all(json_file))),
+                            ("ストリーミング", lambda: first_entry(iter_area_entries(json_file)))]:
+            seconds, _ = measure(func)
+            print(f"  {label:<10} 最初の1件まで: {seconds * 1000:8.2f} ms")
+
+        db_name = os.path.join(tmp, 'area.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_area_db.create_database(db_name)
+            seconds, peak = measure(lambda: create_area_db.insert_data_from_json(json_file, db_name))
+        print(f"  create_area_db の取り込み: {seconds:6.2f} 秒  ピークメモリ: {peak / 1e6:7.1f} MB")
+
+def bench_area_load(scales=(1, 10)):
+    """area.db の作成を、1行ずつの挿入と一括ロード（インデックスの作り直しあり/なし）で比較する"""
+    loaders = [
+        ("1行ずつ（insert_data_from_json）", create_area_db.insert_data_from_json),
+        ("一括ロード", create_area_db.bulk_insert_from_json),
+        ("一括ロード + インデックス作り直し",
+         lambda json_file, db_name: create_area_db.bulk_insert_from_json(json_file, db_name, rebuild_indexes=True)),
+    ]
+    print("[area_load] area.json から area.db の作成")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            json_file = os.path.join(tmp, f'area_x{scale}.json')
+            make_scaled_area_json(json_file, scale)
+            results = []
+            for i, (label, loader) in enumerate(loaders):
+                db_name = os.path.join(tmp, f'area_x{scale}_{i}.db')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    create_area_db.create_database(db_name)
+                    start = time.perf_counter()
+                    loader(json_file, db_name)
+                    seconds = time.perf_counter() - start
+                conn = sqlite3.connect(db_name)
+                results.append(conn.execute("SELECT * FROM area ORDER BY id").fetchall())
+                conn.close()
+                print(f"  x{scale:<3} {label:<32} {len(results[-1]):>8} 行 {seconds:8.3f} 秒")
+            assert all(rows == results[0] for rows in results)
+
+def bench_history(day_counts=(30, 90), area_db='area.db'):
+    """
+    履歴の日数を変えて、weather.db にすべて残した場合と HistoryStore で月ごとに分けた場合の
+    weather.db の大きさと get_weather_forecast の応答時間を比較する
+    """
+    from main_1 import WeatherApp
+    from history_store import HistoryStore, JST
+
+    print("[history] 履歴の日数ごとの weather.db の大きさと get_weather_forecast の応答時間")
+    area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        for days in day_counts:
+            weather_db = os.path.join(tmp, f'weather_{days}d.db')
+            build_history_db(weather_db, days * 4, area_db)
+            flat_mb = os.path.getsize(weather_db) / 1e6
+            app = WeatherApp(weather_db, tmp_area_db)
+            flat_ms = time_lookups(app.get_weather_forecast, area_codes, repeat=1)
+            app.close()
+
+            # 最後の発表の直後に保守を実行したことにする
+            store = HistoryStore(os.path.join(tmp, f'history_{days}d'), hot_days=2,
+                                 compact_after_days=14, retention_days=60)
+            now = datetime.fromisoformat(REPORT_DATETIME).astimezone(JST) + timedelta(hours=6 * days * 4)
+            start = time.perf_counter()
+            result = store.maintain(weather_db, now)
+            maintain_seconds = time.perf_counter() - start
+            app = WeatherApp(weather_db, tmp_area_db)
+            hot_ms = time_lookups(app.get_weather_forecast, area_codes, repeat=1)
+            app.close()
+
+            partitions_mb = sum(os.path.getsize(store.path(month)) for month in store.partitions()) / 1e6
+            week_start = (now - timedelta(days=21)).isoformat()
+            week_end = (now - timedelta(days=14)).isoformat()
+            history_ms = time_lookups(
+                lambda code: store.history('weather_forecasts', code, week_start, week_end, weather_db),
+                area_codes[:20], repeat=1)
+            print(f"  {days:>3} 日分  すべて weather.db: {flat_mb:7.1f} MB {flat_ms:7.3f} ms/回  "
+                  f"→ 分割後 weather.db: {os.path.getsize(weather_db) / 1e6:6.1f} MB {hot_ms:7.3f} ms/回  "
+                  f"履歴 {len(store.partitions())} ファイル {partitions_mb:6.1f} MB  "
+                  f"（保守 {maintain_seconds:.1f} 秒, 圧縮 {len(result['compacted'])} / 削除 {len(result['expired'])}, "
+                  f"1週間分の履歴の検索 {history_ms:.3f} ms/回）")
+
+def table_sizes(db_name):
+    """dbstat で {テーブル名: (テーブル本体のバイト数, インデックスのバイト数)} を返す"""
+    conn = sqlite3.connect(db_name)
+    try:
+        sizes = {table: [0, 0] for table in create_weather_db.TABLE_COLUMNS}
+        for name, tbl_name, kind, size in conn.execute('''
+            SELECT d.name, m.tbl_name, m.type, SUM(d.pgsize)
+            FROM dbstat d JOIN sqlite_master m ON m.name = d.name
+            GROUP BY d.name
+        '''):
+            if tbl_name in sizes:
+                # WITHOUT ROWID テーブルの本体は主キーのインデックスとして記録される
+                is_table = kind == 'table' or name.startswith(f'sqlite_autoindex_{tbl_name}')
+                sizes[tbl_name][0 if is_table else 1] += size
+        return sizes
+    finally:
+        conn.close()
+
+def bench_schema(days=30, area_db='area.db'):
+    """
+    従来のスキーマ（時刻・コードを文字列で保存）と v2 のスキーマ（整数の時刻・ディメンションテーブル）で、
+    テーブルとインデックスの大きさ、get_weather_forecast と対象時刻の範囲検索の応答時間を比較する
+    """
+    from main_1 import WeatherApp
+    import weather_db_v2
+
+    rounds = days * 4
+    with tempfile.TemporaryDirectory() as tmp:
+        v1_db = os.path.join(tmp, 'weather.db')
+        v2_db = os.path.join(tmp, 'weather_v2.db')
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        build_history_db(v1_db, rounds, area_db)
+        conn = sqlite3.connect(v1_db)
+        conn.execute("VACUUM")
+        conn.close()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = weather_db_v2.migrate(v1_db, v2_db)
+        migrate_seconds = time.perf_counter() - start
+
+        print(f"[schema] {days} 日分（{sum(counts.values()):,} 行）の移行 {migrate_seconds:.1f} 秒")
+        v1_sizes, v2_sizes = table_sizes(v1_db), table_sizes(v2_db)
+        for table in create_weather_db.TABLE_COLUMNS:
+            (v1_table, v1_index), (v2_table, v2_index) = v1_sizes[table], v2_sizes[table]
+            print(f"  {table:<36} 本体 {v1_table / 1e6:6.1f} → {v2_table / 1e6:6.1f} MB"
+                  f"（{v1_table / counts[table]:5.0f} → {v2_table / counts[table]:4.0f} バイト/行）  "
+                  f"インデックス {v1_index / 1e6:6.1f} → {v2_index / 1e6:6.1f} MB")
+        print(f"  ファイル全体 {os.path.getsize(v1_db) / 1e6:6.1f} → {os.path.getsize(v2_db) / 1e6:6.1f} MB")
+
+        area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+        timings = []
+        for db_name in (v1_db, v2_db):
+            app = WeatherApp(db_name, tmp_area_db)
+            assert not app.find_full_scans()
+            timings.append(time_lookups(app.get_weather_forecast, area_codes))
+            app.close()
+        print(f"  get_weather_forecast: {timings[0]:7.3f} → {timings[1]:7.3f} ms/回")
+
+        # 1週間分の対象時刻の範囲検索（エリアごと）
+        first = datetime.fromisoformat(REPORT_DATETIME) + timedelta(days=days // 2)
+        last = first + timedelta(days=7)
+        v1_conn = sqlite3.connect(v1_db)
+        v2_conn = sqlite3.connect(v2_db)
+        area_ids = dict(v2_conn.execute("SELECT code, id FROM areas"))
+
+        def v1_range(code):
+            return v1_conn.execute('''
+                SELECT target_datetime, report_datetime, weather_text FROM weather_forecasts
+                WHERE area_code = ? AND target_datetime >= ? AND target_datetime < ?
+            ''', (code, first.isoformat(), last.isoformat())).fetchall()
+
+        def v2_range(code):
+            return v2_conn.execute('''
+                SELECT w.target_time, w.report_time, t.text FROM weather_forecasts w
+                LEFT JOIN texts t ON t.id = w.weather_text_id
+                WHERE w.area_id = ? AND w.target_time >= ? AND w.target_time < ?
+            ''', (area_ids[code], int(first.timestamp()), int(last.timestamp()))).fetchall()
+
+        assert all(len(v1_range(code)) == len(v2_range(code)) for code in area_codes)
+        v1_ms = time_lookups(v1_range, area_codes)
+        v2_ms = time_lookups(v2_range, area_codes)
+        print(f"  対象時刻の範囲検索（1週間分, {len(v1_range(area_codes[0]))} 行/エリア）: {v1_ms:7.3f} → {v2_ms:7.3f} ms/回")
+        v1_conn.close()
+        v2_conn.close()
+
+def bench_current(day_counts=(7, 30, 90), area_db='area.db'):
+    """
+    履歴の日数を変えて、current_forecasts から読む get_weather_forecast と、
+    履歴のテーブルを結合して最新の発表の天気予報を求める場合の応答時間を比較する
+    """
+    from main_1 import WeatherApp, FORECAST_SQL
+
+    # FORECAST_SQL を最新の発表に絞り込んだもの（current_forecasts と同じ行になる）
+    latest_sql = FORECAST_SQL.replace('WHERE w.area_code = ?', '''WHERE w.area_code = ?
+        AND w.report_datetime = (SELECT MAX(report_datetime) FROM weather_forecasts WHERE area_code = ?)''')
+
+    print("[current] 履歴の日数ごとの get_weather_forecast の応答時間")
+    area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        for days in day_counts:
+            weather_db = os.path.join(tmp, f'weather_{days}d.db')
+            build_history_db(weather_db, days * 4, area_db)
+            app = WeatherApp(weather_db, tmp_area_db)
+            assert not app.find_full_scans()
+
+            def from_history(code):
+                return app.query(app.weather_pool, latest_sql, (code, code))
+
+            assert all(app.get_weather_forecast(code) == from_history(code) for code in area_codes)
+            current_ms = time_lookups(app.get_weather_forecast, area_codes)
+            history_ms = time_lookups(from_history, area_codes)
+            app.close()
+            print(f"  {days:>3} 日分（{count_rows(weather_db):>9,} 行）  "
+                  f"current_forecasts: {current_ms:7.3f} ms/回  履歴の結合: {history_ms:7.3f} ms/回")
+
+def bench_service(days=30, clients=8, area_db='area.db'):
+    """
+    weather_service の予報のレスポンスについて、キャッシュなし（初回）・キャッシュあり・ETagによる 304 の
+    応答時間と、取り込み中に複数のクライアントから読み込んだときのスループットを測定する
+    """
+    import threading
+    import http.client
+    from weather_service import WeatherService
+
+    area_codes = [code for _, (_, sub_areas) in load_offices(area_db).items() for code, _ in sub_areas]
+    with tempfile.TemporaryDirectory() as tmp:
+        weather_db = os.path.join(tmp, 'weather.db')
+        tmp_area_db = os.path.join(tmp, 'area.db')
+        build_area_db(tmp_area_db)
+        build_history_db(weather_db, days * 4, area_db)
+        service = WeatherService(weather_db, tmp_area_db)
+        host, port = service.start(port=0)
+
+        def get(conn, code, headers=None):
+            """keep-alive の接続で予報を取得し (ステータス, ETag) を返す"""
+            conn.request('GET', f'/forecasts/{code}', headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            return response.status, response.getheader('ETag')
+
+        conn = http.client.HTTPConnection(host, port)
+        etags = {}
+
+        def fetch(code):
+            etags[code] = get(conn, code)[1]
+
+        def revalidate(code):
+            assert get(conn, code, {'If-None-Match': etags[code]})[0] == 304
+
+        print(f"[service] {days} 日分（{count_rows(weather_db):,} 行）, {len(area_codes)} エリア")
+        print(f"  初回（weather.db を検索）: {time_lookups(fetch, area_codes, repeat=1):7.3f} ms/回")
+        print(f"  キャッシュあり           : {time_lookups(fetch, area_codes):7.3f} ms/回")
+        print(f"  If-None-Match（304）     : {time_lookups(revalidate, area_codes):7.3f} ms/回")
+        conn.close()
+        service.cache.entries.clear()
+        miss_ms = time_lookups(lambda code: service.resolve(f'/forecasts/{code}'), area_codes, repeat=1)
+        hit_ms = time_lookups(lambda code: service.resolve(f'/forecasts/{code}'), area_codes)
+        print(f"  HTTPを除いた処理（resolve）: 初回 {miss_ms:7.3f} → キャッシュあり {hit_ms:7.3f} ms/回")
+
+        # 取り込み（WAL）と同時に clients 個のクライアントから読み込む
+        errors = []
+
+        def client():
+            client_conn = http.client.HTTPConnection(host, port)
+            for code in area_codes * 20:
+                if get(client_conn, code)[0] != 200:
+                    errors.append(code)
+            client_conn.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with create_weather_db.BatchWriter(weather_db) as writer:
+                for _, data in make_payloads(4, area_db):
+                    writer.add(data)
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        requests_count = clients * len(area_codes) * 20
+        stats = service.stats()
+        service.stop()
+        print(f"  取り込み中の {clients} クライアント: {requests_count / seconds:,.0f} 回/秒"
+              f"（エラー {len(errors)} 件, ヒット {stats['hits']:,} / ミス {stats['misses']:,}）")
+
+def bench_refresh(hours=24, lateness=600, naive_interval=600, area_db='area.db'):
+    """
+    RefreshDaemon で1日分の発表を取り込んだ場合の取得回数と、発表から取り込みまでの遅れを、
+    すべての office を naive_interval 秒ごとに取得する場合と比較する。
+    スタブサーバーは、各定時の発表を office ごとに 0〜lateness 秒遅れて公開する（時刻は模擬的に進める）
+    """
+    import random
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from refresh_daemon import RefreshDaemon, PUBLISH_HOURS, JST
+
+    offices = load_offices(area_db)
+    start = datetime.fromisoformat('2024-12-17T00:00:00+09:00')
+    slots = [start + timedelta(days=day, hours=hour) for day in range(-1, hours // 24 + 1) for hour in PUBLISH_HOURS]
+    generator = random.Random(0)
+    published = {(code, slot): slot + timedelta(seconds=generator.uniform(0, lateness))
+                 for code in offices for slot in slots}
+    clock = {'now': start, 'requests': 0}
+
+    def latest_slot(code, now):
+        return max(slot for slot in slots if published[code, slot] <= now)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            code = self.path.rsplit('/', 1)[-1].split('.')[0]
+            clock['requests'] += 1
+            name, sub_areas = offices[code]
+            body = json.dumps(make_forecast_payload(code, name, sub_areas, latest_slot(code, clock['now']).isoformat()),
+                              ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/forecast/{{}}.json'
+    end = start + timedelta(hours=hours)
+    # 期間中に公開された発表（起動時に公開済みのものは除く）
+    releases = [(code, slot) for (code, slot), at in published.items() if start < at <= end]
+    with tempfile.TemporaryDirectory() as tmp:
+        daemon = RefreshDaemon(list(offices), os.path.join(tmp, 'weather.db'), base_url, workers=4, rate=0,
+                               cache_dir=None)
+        lags = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            daemon.load_state(start)
+            now = start
+            while now <= end:
+                clock['now'] = now
+                for code in daemon.poll(now)['ingested']:
+                    slot = daemon.offices[code].report_time
+                    if (code, slot) in published and published[code, slot] > start:
+                        lags.append((now - published[code, slot]).total_seconds())
+                now += timedelta(seconds=30)
+    server.shutdown()
+    server.server_close()
+
+    # 固定間隔の取得（すべての office を naive_interval 秒ごとに取得する）
+    naive_lags = []
+    for code, slot in releases:
+        waited = (published[code, slot] - start).total_seconds()
+        naive_lags.append(-waited % naive_interval)
+    naive_requests = len(offices) * (hours * 3600 // naive_interval + 1)
+
+    print(f"[refresh] {len(offices)} office, {hours} 時間（発表 {len(releases)} 件, 公開の遅れ 0〜{lateness} 秒）")
+    for label, requests_count, values in ((f"{naive_interval} 秒ごとにすべて取得", naive_requests, naive_lags),
+                                          ("RefreshDaemon", clock['requests'], lags)):
+        values = sorted(values)
+        print(f"  {label:<24} 取得 {requests_count:>6,} 回  取り込み {len(values):>4} 件  "
+              f"遅れ 平均 {sum(values) / len(values):6.0f} 秒 / 最大 {values[-1]:6.0f} 秒")
+
+BENCHMARKS = {
+    'ingest': bench_ingest,
+    'query': bench_query,
+    'pool': bench_pool,
+    'startup': bench_startup,
+    'view': bench_view,
+    'normalize': bench_normalize,
+    'stream': bench_stream,
+    'area_load': bench_area_load,
+    'history': bench_history,
+    'schema': bench_schema,
+    'current': bench_current,
+    'service': bench_service,
+    'refresh': bench_refresh,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="jma2 のベンチマークを実行します")
+    parser.add_argument('names', nargs='*',
+                        help=f"実行するベンチマーク（{', '.join(BENCHMARKS)}。省略時はすべて）")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"不明なベンチマークです: {name}")
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name]()
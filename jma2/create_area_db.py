@@ -2,6 +2,24 @@ import sqlite3
 import json
 import os
 import csv
+import argparse
+from area_index import build_snapshot, iter_area_entries, DEFAULT_AREA_JSON
+
+# 取り込むエリアのレベル（上位から順）
+LEVELS = ['centers', 'offices', 'class10s', 'class15s', 'class20s']
+
+INSERT_AREA_SQL = '''
+    INSERT INTO area (level, code, name, enName, parent, children, officeName, kana)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 一括ロード用（データベースに既にあるコードは挿入しない）
+BULK_INSERT_AREA_SQL = INSERT_AREA_SQL.replace('INSERT', 'INSERT OR IGNORE', 1)
+
+# 一括ロード時に作り直すインデックス（code の UNIQUE 制約のインデックスは削除できないため対象外）
+SECONDARY_INDEXES = {
+    'idx_area_level_parent': 'CREATE INDEX IF NOT EXISTS idx_area_level_parent ON area(level, parent)',
+}
 
 def create_database(db_name='area.db'):
     """
@@ -26,11 +44,25 @@ def create_database(db_name='area.db'):
             kana TEXT
         )
     ''')
+
+    # 地方・都道府県の一覧取得（level と parent で絞り込む）用のインデックス
+    cursor.execute(SECONDARY_INDEXES['idx_area_level_parent'])
     
     conn.commit()
     conn.close()
     print(f"データベース '{db_name}' とテーブル 'area' を作成しました。")
 
+def area_row(level, code, details):
+    """area.json の1エリア分を area テーブルの行（INSERT_AREA_SQL の引数）にする"""
+    parent = details.get('parent') if level in ['offices', 'class10s', 'class15s', 'class20s'] else None
+    children = details.get('children') if level in ['centers', 'offices'] else None
+    officeName = details.get('officeName') if level in ['centers', 'offices'] else None
+    kana = details.get('kana') if level == 'class20s' else None
+    return (level, code, details.get('name'), details.get('enName'), parent,
+            ','.join(children) if children else None,
+            officeName,
+            kana)
+
 def insert_data_from_json(json_file, db_name='area.db'):
     """
     JSONファイルからデータを読み込み、SQLiteデータベースに挿入します。
@@ -42,50 +74,129 @@ def insert_data_from_json(json_file, db_name='area.db'):
         print(f"JSONファイルが存在しません: {json_file}")
         return
     
-    with open(json_file, 'r', encoding='utf-8') as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError as e:
-            print(f"JSONの解析中にエラーが発生しました: {e}")
-            return
-    
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
     
-    # 各レベルの処理
-    levels = ['centers', 'offices', 'class10s', 'class15s', 'class20s']
-    for level in levels:
-        if level not in data:
-            print(f"レベル '{level}' はJSONデータに含まれていません。スキップします。")
-            continue
-        entries = data[level]
-        for code, details in entries.items():
-            name = details.get('name')
-            enName = details.get('enName')
-            parent = details.get('parent') if level in ['offices', 'class10s', 'class15s', 'class20s'] else None
-            children = details.get('children') if level in ['centers', 'offices'] else None
-            officeName = details.get('officeName') if level in ['centers', 'offices'] else None
-            kana = details.get('kana') if level == 'class20s' else None
-
+    # 各レベルの処理（ファイル全体を読み込まず、解析できたエリアから順に挿入する。
+    # area.json は上位のレベルから順に並んでいるため、挿入の順番はこれまでと同じ）
+    seen_levels = set()
+    try:
+        for level, code, details in iter_area_entries(json_file):
+            if level not in LEVELS:
+                continue
+            seen_levels.add(level)
             try:
-                cursor.execute('''
-                    INSERT INTO area (level, code, name, enName, parent, children, officeName, kana)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (level, code, name, enName, parent, 
-                    ','.join(children) if children else None,
-                    officeName, 
-                    kana))
+                cursor.execute(INSERT_AREA_SQL, area_row(level, code, details))
             except sqlite3.IntegrityError:
                 print(f"重複したコードのためスキップしました: {code}")
                 continue
             except Exception as e:
                 print(f"データの挿入中にエラーが発生しました（コード: {code}）: {e}")
                 continue
+    except json.JSONDecodeError as e:
+        print(f"JSONの解析中にエラーが発生しました: {e}")
+        conn.rollback()
+        conn.close()
+        return
+
+    for level in LEVELS:
+        if level not in seen_levels:
+            print(f"レベル '{level}' はJSONデータに含まれていません。スキップします。")
     
     conn.commit()
     conn.close()
     print("データの挿入が完了しました。")
 
+def bulk_insert_from_json(json_file, db_name='area.db', rebuild_indexes=False):
+    """
+    JSONファイルのエリアをメモリ上に集めて重複を除き、executemany で1トランザクションとして挿入します。
+    同じコードがJSONに複数ある場合は最初のものを使い（insert_data_from_json と同じ）、
+    データベースに既にあるコードは挿入しません。途中でエラーが発生した場合は何も挿入しません。
+
+    :param json_file: 読み込むJSONファイルのパス
+    :param db_name: 接続するデータベースファイルの名前（デフォルトは 'area.db'）
+    :param rebuild_indexes: True なら挿入前に SECONDARY_INDEXES を削除し、挿入後にまとめて作り直す
+    :return: 挿入した行数（失敗した場合は None）
+    """
+    if not os.path.exists(json_file):
+        print(f"JSONファイルが存在しません: {json_file}")
+        return None
+
+    # コード -> 行（挿入順）
+    rows = {}
+    seen_levels = set()
+    duplicates = 0
+    try:
+        for level, code, details in iter_area_entries(json_file):
+            if level not in LEVELS:
+                continue
+            seen_levels.add(level)
+            if code in rows:
+                duplicates += 1
+                continue
+            rows[code] = area_row(level, code, details)
+    except json.JSONDecodeError as e:
+        print(f"JSONの解析中にエラーが発生しました: {e}")
+        return None
+
+    for level in LEVELS:
+        if level not in seen_levels:
+            print(f"レベル '{level}' はJSONデータに含まれていません。スキップします。")
+
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        if rebuild_indexes:
+            for name in SECONDARY_INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        before = conn.total_changes
+        cursor.executemany(BULK_INSERT_AREA_SQL, rows.values())
+        inserted = conn.total_changes - before
+        if rebuild_indexes:
+            for sql in SECONDARY_INDEXES.values():
+                cursor.execute(sql)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"データの挿入中にエラーが発生しました: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+    if duplicates:
+        print(f"JSON内で重複したコード {duplicates} 件をスキップしました。")
+    if inserted < len(rows):
+        print(f"データベースに既にあるコード {len(rows) - inserted} 件をスキップしました。")
+    print(f"{inserted} 件のデータを一括挿入しました。")
+    return inserted
+
+def replace_database(json_file, db_name='area.db', rebuild_indexes=True):
+    """
+    新しいデータベースを一時ファイルに作成して一括挿入し、完成してから db_name と置き換えます。
+    置き換えは os.replace で1度に行うため、読み込み中のプロセスが作成途中のテーブルを見ることはありません
+    （既に開いている接続は、閉じるまで古いデータベースを読み続けます）。
+    失敗した場合は一時ファイルを削除し、db_name はそのまま残します。
+
+    :param json_file: 読み込むJSONファイルのパス
+    :param db_name: 置き換えるデータベースファイルの名前（デフォルトは 'area.db'）
+    :param rebuild_indexes: bulk_insert_from_json に渡す
+    :return: 置き換えた場合は True
+    """
+    tmp_name = f"{db_name}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    try:
+        create_database(tmp_name)
+        if bulk_insert_from_json(json_file, tmp_name, rebuild_indexes) is None:
+            return False
+        os.replace(tmp_name, db_name)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    print(f"データベース '{db_name}' を置き換えました。")
+    return True
+
 def fetch_all_data(db_name='area.db'):
     """
     データベースから全データを取得して表示します。
@@ -122,15 +233,27 @@ def fetch_all_data(db_name='area.db'):
     finally:
         conn.close()
 
-def main():
+def main(json_file=DEFAULT_AREA_JSON, db_name='area.db', bulk=False, rebuild_indexes=False, replace=False):
     """
     メイン関数。データベースの作成、JSONデータの挿入、データの表示を実行します。
+
+    :param json_file: 読み込むJSONファイルのパス
+    :param db_name: SQLiteデータベースの名前
+    :param bulk: True なら bulk_insert_from_json で一括挿入する
+    :param rebuild_indexes: 一括挿入時にインデックスを挿入後に作り直す
+    :param replace: True なら replace_database で新しいデータベースに置き換える
     """
-    json_file = '/Users/marina/Lecture/DS-Programming2/jma2/area.json'
-    db_name = 'area.db'      # SQLiteデータベースの名前
-    
-    create_database(db_name)
-    insert_data_from_json(json_file, db_name)
+    if replace:
+        if not replace_database(json_file, db_name, rebuild_indexes):
+            return
+    else:
+        create_database(db_name)
+        if bulk:
+            bulk_insert_from_json(json_file, db_name, rebuild_indexes)
+        else:
+            insert_data_from_json(json_file, db_name)
+    # アプリの起動を速くするため、area.json のスナップショットも作成する
+    build_snapshot(json_file, os.path.splitext(json_file)[0] + '.snapshot')
     print("\n挿入されたデータを表示します:\n")
     fetch_all_data(db_name)
 
@@ -149,5 +272,13 @@ def export_to_csv(db_name='area.db', csv_file='area.csv'):
     print(f"{csv_file} にデータをエクスポートしました。")
 
 if __name__ == '__main__':
-    main()
-    export_to_csv()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="area.json からエリアのデータベース（area.db）を作成します")
+    parser.add_argument('--json', default=DEFAULT_AREA_JSON, help="読み込む area.json")
+    parser.add_argument('--db', default='area.db', help="作成するデータベース")
+    parser.add_argument('--bulk', action='store_true', help="メモリ上で重複を除いて1トランザクションで一括挿入する")
+    parser.add_argument('--rebuild-indexes', action='store_true', help="一括挿入後にインデックスをまとめて作り直す")
+    parser.add_argument('--replace', action='store_true',
+                        help="一時ファイルに一括挿入してから既存のデータベースと置き換える（--bulk を含む）")
+    args = parser.parse_args()
+    main(args.json, args.db, args.bulk, args.rebuild_indexes or args.replace, args.replace)
+    export_to_csv(args.db)
\ No newline at end of file
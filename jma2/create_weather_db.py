@@ -2,8 +2,95 @@ import sqlite3
 import json
 import os
 import csv
+import time
+import argparse
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime
+from urllib.parse import urlparse
+from http_cache import HTTPCache
+from area_index import load_area_index
+from forecast_frame import ForecastFrame
+
+# JMAのAPIのベースURL（ローカルのスタブサーバーを使う場合は差し替える）
+API_BASE_URL = 'https://www.jma.go.jp/bosai/forecast/data/forecast/{}.json'
+
+# このディレクトリにある取得対象のエリアの一覧
+DEFAULT_AREA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'area.csv')
+
+# 前回から更新されていない（304 Not Modified）ことを表す値
+NOT_MODIFIED = object()
+
+# 各テーブルに挿入する列（extract_rows が作るタプルの順番）
+TABLE_COLUMNS = {
+    'weather_forecasts': (
+        'publishing_office_id', 'report_datetime', 'area_code',
+        'target_datetime', 'weather_code', 'weather_text',
+        'wind_text', 'wave_text',
+    ),
+    'precipitation_probability_forecasts': (
+        'publishing_office_id', 'report_datetime', 'area_code',
+        'target_datetime', 'probability',
+    ),
+    'temperature_forecasts': (
+        'publishing_office_id', 'report_datetime', 'area_code',
+        'target_datetime', 'temperature',
+    ),
+    'weekly_forecasts': (
+        'publishing_office_id', 'report_datetime', 'area_code',
+        'target_date', 'weather_code', 'precipitation_probability',
+        'reliability',
+    ),
+    'climate_averages': (
+        'publishing_office_id', 'report_datetime', 'area_code',
+        'type', 'min_value', 'max_value',
+    ),
+}
+
+# ForecastFrame の timeSeries の種類 -> (テーブル, 値の項目, 空文字を NULL にする項目)
+# 週間予報の気温（weekly_temps）も、これまでどおり weekly_forecasts に時刻ごとの行として入れる
+SERIES_TABLES = {
+    'weather': ('weather_forecasts', ('weatherCodes', 'weathers', 'winds', 'waves'), ()),
+    'pops': ('precipitation_probability_forecasts', ('pops',), ('pops',)),
+    'temps': ('temperature_forecasts', ('temps',), ('temps',)),
+    'weekly': ('weekly_forecasts', ('weatherCodes', 'pops', 'reliabilities'), ('pops',)),
+    'weekly_temps': ('weekly_forecasts', ('weatherCodes', 'pops', 'reliabilities'), ('pops',)),
+}
+
+# 各テーブルの自然キー（同じ発表の同じ対象時刻は1行だけにする）
+NATURAL_KEYS = {
+    'weather_forecasts': ('area_code', 'report_datetime', 'target_datetime'),
+    'precipitation_probability_forecasts': ('area_code', 'report_datetime', 'target_datetime'),
+    'temperature_forecasts': ('area_code', 'report_datetime', 'target_datetime'),
+    'weekly_forecasts': ('area_code', 'report_datetime', 'target_date'),
+    'climate_averages': ('area_code', 'report_datetime', 'type'),
+}
+
+# 各エリアの最新の発表の予報（current_forecasts）の列。WeatherApp が表示する天気・降水確率・気温を結合済みで持つ
+CURRENT_COLUMNS = (
+    'area_code', 'target_datetime', 'report_datetime', 'weather_code',
+    'weather_text', 'wind_text', 'wave_text', 'probability', 'temperature',
+)
+
+def build_insert_sql(table, upsert=True):
+    """
+    テーブルへのINSERT文を作成します。
+    upsert=True の場合は自然キーが重複したときに値を更新し、値が同じなら何も書き込みません。
+    """
+    columns = TABLE_COLUMNS[table]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    if upsert:
+        keys = NATURAL_KEYS[table]
+        values = [column for column in columns if column not in keys]
+        sql += (f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in values)
+                + " WHERE " + ' OR '.join(f"{column} IS NOT excluded.{column}" for column in values))
+    return sql
+
+INSERT_SQL = {table: build_insert_sql(table, upsert=False) for table in TABLE_COLUMNS}
+UPSERT_SQL = {table: build_insert_sql(table, upsert=True) for table in TABLE_COLUMNS}
 
 def create_database(db_name='weather.db'):
     conn = sqlite3.connect(db_name)
@@ -25,6 +112,50 @@ def create_database(db_name='weather.db'):
         )
     ''')
 
+    create_forecast_tables(cursor)
+
+    # officeごとに最後に取り込んだ発表時刻（変更のない発表を読み飛ばすための目印）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_watermarks (
+            office_code TEXT PRIMARY KEY,
+            report_datetime TEXT,
+            weekly_report_datetime TEXT,
+            ingested_at TEXT
+        )
+    ''')
+
+    # 各エリアの最新の発表の予報（取り込み時にエリアごとに入れ替える）。
+    # 主キー順に並ぶため、WeatherApp はエリアの範囲を1回読むだけで表示する行が揃う
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS current_forecasts (
+            area_code TEXT NOT NULL,
+            target_datetime TEXT NOT NULL,
+            report_datetime TEXT NOT NULL,
+            weather_code TEXT,
+            weather_text TEXT,
+            wind_text TEXT,
+            wave_text TEXT,
+            probability INTEGER,
+            temperature REAL,
+            PRIMARY KEY (area_code, target_datetime)
+        ) WITHOUT ROWID
+    ''')
+
+    # 自然キーの一意制約（既存のデータベースにある重複は先に取り除く）
+    deduplicate_publishing_offices(cursor)
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS uq_publishing_offices_name
+                     ON publishing_offices(name)''')
+    create_natural_key_indexes(cursor)
+
+    conn.commit()
+    conn.close()
+    print(f"データベース '{db_name}' とテーブルを作成しました。")
+
+def create_forecast_tables(cursor):
+    """
+    予報テーブル（TABLE_COLUMNS）とその検索用のインデックスを作成します。
+    weather.db のほか、履歴のパーティション（history_store.py）でも同じ定義を使います。
+    """
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS weather_forecasts (
             id INTEGER PRIMARY KEY,
@@ -108,174 +239,583 @@ def create_database(db_name='weather.db'):
     cursor.execute('''CREATE INDEX IF NOT EXISTS idx_weekly_forecasts_date 
                      ON weekly_forecasts(target_date)''')
 
-    conn.commit()
-    conn.close()
-    print(f"データベース '{db_name}' とテーブルを作成しました。")
+    # WeatherApp の検索に合わせた複合インデックス。weather_forecasts は area_code で絞り込んで
+    # target_datetime 順に読み、表示する列も含めてテーブル本体を読まずに済むようにする。
+    # 降水確率・気温との結合は自然キーの一意インデックス（area_code, report_datetime, target_datetime）を使う
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_weather_forecasts_area_target
+                     ON weather_forecasts(area_code, target_datetime, report_datetime, weather_text, wind_text)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_weekly_forecasts_area_date
+                     ON weekly_forecasts(area_code, target_date)''')
+
+def create_natural_key_indexes(cursor):
+    """予報テーブルの自然キーの一意インデックスを作成する（既存の重複は先に取り除く）"""
+    for table, keys in NATURAL_KEYS.items():
+        deduplicate_table(cursor, table, keys)
+        cursor.execute(f'''CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_key
+                         ON {table}({', '.join(keys)})''')
+
+def deduplicate_table(cursor, table, keys):
+    """自然キーが重複している行のうち、最後に挿入された行だけを残す"""
+    cursor.execute(f'''
+        DELETE FROM {table}
+        WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {', '.join(keys)})
+    ''')
+
+def deduplicate_publishing_offices(cursor):
+    """同じ名前の発表官署を最小のIDにまとめ、各予報テーブルの参照も付け替える"""
+    for table in TABLE_COLUMNS:
+        cursor.execute(f'''
+            UPDATE {table}
+            SET publishing_office_id = (
+                SELECT MIN(p2.id) FROM publishing_offices p1
+                JOIN publishing_offices p2 ON p1.name = p2.name
+                WHERE p1.id = {table}.publishing_office_id
+            )
+            WHERE publishing_office_id IN (
+                SELECT id FROM publishing_offices
+                WHERE id NOT IN (SELECT MIN(id) FROM publishing_offices GROUP BY name)
+            )
+        ''')
+    cursor.execute('''
+        DELETE FROM publishing_offices
+        WHERE id NOT IN (SELECT MIN(id) FROM publishing_offices GROUP BY name)
+    ''')
+
+class RateLimiter:
+    """
+    ホストごとのリクエスト間隔を制御するレートリミッター。
+    複数スレッドから呼び出されても、同じホストへは1秒あたり rate 回までに抑えます。
+
+    :param rate: 1ホストあたりの1秒間の最大リクエスト数（0以下なら制限なし）
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+def create_session(pool_size=10):
+    """
+    コネクションを使い回すための requests.Session を作成します。
 
-def fetch_weather_data(area_code):
-    url = f"https://www.jma.go.jp/bosai/forecast/data/forecast/{area_code}.json"
+    :param pool_size: ホストごとに保持するコネクション数（ワーカー数に合わせる）
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def fetch_weather_data(area_code, session=None, base_url=API_BASE_URL, rate_limiter=None, timeout=None,
+                       http_cache=None):
+    """
+    天気予報データを取得します。http_cache を指定した場合は条件付きGETを行い、
+    前回から更新されていなければ JSON を解析せずに NOT_MODIFIED を返します。
+    NOT_MODIFIED はキャッシュに本文があることを表すだけで、データベースに取り込み済みとは限りません
+    （本文は load_cached_weather_data() で読み込めます）。
+    """
+    url = base_url.format(area_code)
+    if rate_limiter:
+        rate_limiter.wait(urlparse(url).netloc)
     try:
-        response = requests.get(url)
+        if http_cache:
+            status_code, content = http_cache.get(url, session, timeout)
+            if status_code == 304:
+                return NOT_MODIFIED
+            if status_code != 200:
+                raise requests.HTTPError(f"{status_code} Error for url: {url}")
+            return json.loads(content)
+        response = (session or requests).get(url, timeout=timeout)
         response.raise_for_status()
         return response.json()
-    except requests.RequestException as e:
+    except (requests.RequestException, ValueError) as e:
         print(f"データの取得中にエラーが発生しました: {e}")
         return None
 
-def insert_data_from_json(data, db_name='weather.db'):
+def load_cached_weather_data(area_code, http_cache, base_url=API_BASE_URL):
+    """条件付きGETのキャッシュに保存済みの予報JSONを返す（なければ None）"""
+    body = http_cache.read_body(base_url.format(area_code)) if http_cache else None
+    try:
+        return json.loads(body) if body else None
+    except ValueError as e:
+        print(f"キャッシュの読み込み中にエラーが発生しました: {e}")
+        return None
+
+def fetch_all_weather_data(area_codes, workers=8, rate=10, base_url=API_BASE_URL, timeout=10, http_cache=None):
+    """
+    複数のエリアコードの天気データを並行して取得します。
+    結果は area_codes と同じ順番で (area_code, data) として返すため、
+    逐次処理と同じ順序でデータベースに挿入できます。
+
+    :param area_codes: 取得するエリアコードのリスト
+    :param workers: 同時に実行するワーカー数
+    :param rate: 1ホストあたりの1秒間の最大リクエスト数
+    :param base_url: APIのURLテンプレート
+    :param timeout: 1リクエストあたりのタイムアウト（秒）
+    :param http_cache: 条件付きGETに使う HTTPCache（None なら使わない）
+    """
+    rate_limiter = RateLimiter(rate)
+    session = create_session(workers)
+
+    def fetch(area_code):
+        return area_code, fetch_weather_data(area_code, session, base_url, rate_limiter, timeout, http_cache)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(fetch, area_codes)
+    finally:
+        session.close()
+
+# BatchWriter が接続時に設定するPRAGMAの既定値
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,  # 負の値はKiB単位（約20MB）
+}
+
+def get_report_version(data):
+    """予報JSONの発表時刻（短期予報, 週間予報）を返す"""
+    return (data[0]['reportDatetime'],
+            data[1]['reportDatetime'] if len(data) > 1 else None)
+
+def is_ingested(version, watermark):
+    """
+    get_report_version() の発表時刻が、ingest_watermarks の発表時刻（watermark）と同じか古いかを返します。
+    短期予報・週間予報のどちらかが新しければ、まだ取り込んでいない発表とみなします。
+    """
+    if watermark is None:
+        return False
+    for report, ingested in zip(version, watermark):
+        if report and (not ingested or datetime.fromisoformat(report) > datetime.fromisoformat(ingested)):
+            return False
+    return True
+
+def load_watermarks(cursor):
+    """ingest_watermarks テーブルから {office_code: (report_datetime, weekly_report_datetime)} を読み込む"""
+    cursor.execute("SELECT office_code, report_datetime, weekly_report_datetime FROM ingest_watermarks")
+    return {office_code: (report, weekly) for office_code, report, weekly in cursor.fetchall()}
+
+def save_watermarks(cursor, watermarks):
+    """(office_code, report_datetime, weekly_report_datetime) のリストを ingest_watermarks に書き込む"""
+    ingested_at = datetime.now().astimezone().isoformat(timespec='seconds')
+    cursor.executemany('''
+        INSERT INTO ingest_watermarks (office_code, report_datetime, weekly_report_datetime, ingested_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (office_code) DO UPDATE SET
+            report_datetime = excluded.report_datetime,
+            weekly_report_datetime = excluded.weekly_report_datetime,
+            ingested_at = excluded.ingested_at
+    ''', [(office_code, report, weekly, ingested_at) for office_code, report, weekly in watermarks])
+
+def insert_publishing_office(cursor, data):
+    """publishing_officesテーブルに発表官署を挿入し（既にあれば再利用し）、そのIDを返す"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO publishing_offices (name, code)
+        VALUES (?, ?)
+    ''', (data[0]['publishingOffice'], None))
+    cursor.execute("SELECT id FROM publishing_offices WHERE name = ?", (data[0]['publishingOffice'],))
+    return cursor.fetchone()[0]
+
+def extract_rows(data, publishing_office_id):
+    """
+    JMAの予報JSONを、テーブルごとの挿入用タプルのリストに変換します。
+
+    :param data: fetch_weather_data() で取得したJSON
+    :param publishing_office_id: publishing_offices テーブルのID
+    :return: {テーブル名: [行のタプル, ...]}
+    """
+    rows = {table: [] for table in TABLE_COLUMNS}
+    frame = ForecastFrame(data)
+
+    for report_datetime, series_list in ((frame.report_datetime, frame.short_term),
+                                         (frame.weekly_report_datetime, frame.weekly)):
+        for series in series_list:
+            table, keys, blank_keys = SERIES_TABLES[series.kind]
+            columns = [(series.column(key), key in blank_keys) for key in keys]
+            none_values = [None] * len(series.times)
+            for i, area_code in enumerate(series.codes):
+                values = []
+                for column, blank_to_none in columns:
+                    area_values = column[i]
+                    if area_values is None:
+                        area_values = none_values
+                    elif blank_to_none and '' in area_values:
+                        area_values = [value if value != '' else None for value in area_values]
+                    values.append(area_values)
+                rows[table].extend(zip(repeat(publishing_office_id), repeat(report_datetime),
+                                       repeat(area_code), series.times, *values))
+
+    # 平均値データ
+    for area in frame.temp_averages:
+        rows['climate_averages'].append((
+            publishing_office_id,
+            frame.weekly_report_datetime,
+            area['area']['code'],
+            'temperature',
+            area['min'],
+            area['max']
+        ))
+
+    return rows
+
+def extract_current_rows(data):
+    """
+    予報JSONの短期予報を、細分区域ごとの current_forecasts の行（CURRENT_COLUMNS の順）にします。
+    天気の timeSeries の時刻ごとに1行で、降水確率は同じ細分区域の同じ時刻の値、
+    気温は ForecastFrame.daily_by_area と同じく同じ順番の地点の同じ時刻の値を使います。
+
+    :param data: fetch_weather_data() で取得したJSON
+    :return: {エリアコード: [行のタプル, ...]}
+    """
+    frame = ForecastFrame(data)
+    weather = frame.get('weather')
+    if weather is None or not weather.times:
+        return {}
+    pops = frame.get('pops')
+    temps = frame.get('temps')
+    pop_index = {code: i for i, code in enumerate(pops.codes)} if pops else {}
+
+    def values_at(series, key, index):
+        """series の index 番目の地域の {時刻: 値}（空文字の値は除く）"""
+        if series is None or index is None or index >= len(series.codes):
+            return {}
+        values = series.column(key)[index] or []
+        return {time: value for time, value in zip(series.times, values) if value != ''}
+
+    columns = [weather.column(key) for key in ('weatherCodes', 'weathers', 'winds', 'waves')]
+    current = {}
+    for i, area_code in enumerate(weather.codes):
+        pop_at = values_at(pops, 'pops', pop_index.get(area_code))
+        temp_at = values_at(temps, 'temps', i)
+        area_values = [column[i] or [] for column in columns]
+        current[area_code] = [
+            (area_code, time, frame.report_datetime,
+             *(values[j] if j < len(values) else None for values in area_values),
+             pop_at.get(time), temp_at.get(time))
+            for j, time in enumerate(weather.times)
+        ]
+    return current
+
+def replace_current_forecasts(cursor, current, columns=CURRENT_COLUMNS):
+    """
+    extract_current_rows() の結果で、current_forecasts をエリアごとに入れ替えます。
+    呼び出し側のトランザクションの中で削除と挿入を行うため、読み込み側からは入れ替え前か後のどちらかだけが見えます。
+    保存済みの発表より古い発表のエリアは入れ替えません。
+
+    :param cursor: データベースのカーソル
+    :param current: {エリアコード: [行のタプル, ...]}
+    :param columns: current_forecasts の列（先頭の3列はエリア, 対象時刻, 発表時刻）
+    """
+    area_column, _, report_column = columns[:3]
+    insert_sql = (f"INSERT INTO current_forecasts ({', '.join(columns)}) "
+                  f"VALUES ({', '.join('?' * len(columns))})")
+    for area_code, rows in current.items():
+        cursor.execute(f"SELECT MAX({report_column}) FROM current_forecasts WHERE {area_column} = ?",
+                       (area_code,))
+        latest, = cursor.fetchone()
+        if latest is not None and rows[0][2] < latest:
+            continue
+        cursor.execute(f"DELETE FROM current_forecasts WHERE {area_column} = ?", (area_code,))
+        cursor.executemany(insert_sql, rows)
+
+def insert_data_from_json(data, db_name='weather.db', upsert=True, office_code=None):
+    """
+    予報JSONを1件、1つのトランザクションで weather.db に書き込みます。
+    office_code を指定した場合、ingest_watermarks に記録済みの発表と同じか古い発表は書き込みません。
+
+    :return: 書き込んだら True（取り込み済み・データなし・データベースエラーの場合は False）
+    """
     if not data:
         print("データがありません")
-        return
+        return False
 
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
     
     try:
-        # publishing_officesテーブルにデータを挿入
-        cursor.execute('''
-            INSERT OR IGNORE INTO publishing_offices (name, code)
-            VALUES (?, ?)
-        ''', (data[0]['publishingOffice'], None))
-        publishing_office_id = cursor.lastrowid
-
-        # 各種データの挿入
-        for forecast in data[0]['timeSeries']:
-            # weather_forecastsテーブル
-            if 'areas' in forecast and 'weatherCodes' in forecast['areas'][0]:
-                for area in forecast['areas']:
-                    for i, time in enumerate(forecast['timeDefines']):
-                        cursor.execute('''
-                            INSERT INTO weather_forecasts (
-                                publishing_office_id, report_datetime, area_code,
-                                target_datetime, weather_code, weather_text,
-                                wind_text, wave_text
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            publishing_office_id,
-                            data[0]['reportDatetime'],
-                            area['area']['code'],
-                            time,
-                            area['weatherCodes'][i] if 'weatherCodes' in area else None,
-                            area['weathers'][i] if 'weathers' in area else None,
-                            area['winds'][i] if 'winds' in area else None,
-                            area['waves'][i] if 'waves' in area else None
-                        ))
-
-            # precipitation_probability_forecastsテーブル
-            elif 'areas' in forecast and 'pops' in forecast['areas'][0]:
-                for area in forecast['areas']:
-                    for i, time in enumerate(forecast['timeDefines']):
-                        cursor.execute('''
-                            INSERT INTO precipitation_probability_forecasts (
-                                publishing_office_id, report_datetime, area_code,
-                                target_datetime, probability
-                            ) VALUES (?, ?, ?, ?, ?)
-                        ''', (
-                            publishing_office_id,
-                            data[0]['reportDatetime'],
-                            area['area']['code'],
-                            time,
-                            area['pops'][i] if area['pops'][i] != '' else None
-                        ))
-
-            # temperature_forecastsテーブル
-            elif 'areas' in forecast and 'temps' in forecast['areas'][0]:
-                for area in forecast['areas']:
-                    for i, time in enumerate(forecast['timeDefines']):
-                        cursor.execute('''
-                            INSERT INTO temperature_forecasts (
-                                publishing_office_id, report_datetime, area_code,
-                                target_datetime, temperature
-                            ) VALUES (?, ?, ?, ?, ?)
-                        ''', (
-                            publishing_office_id,
-                            data[0]['reportDatetime'],
-                            area['area']['code'],
-                            time,
-                            area['temps'][i] if area['temps'][i] != '' else None
-                        ))
-
-        # 週間予報データの挿入
-        if len(data) > 1 and 'timeSeries' in data[1]:
-            for forecast in data[1]['timeSeries']:
-                for area in forecast['areas']:
-                    for i, time in enumerate(forecast['timeDefines']):
-                        cursor.execute('''
-                            INSERT INTO weekly_forecasts (
-                                publishing_office_id, report_datetime, area_code,
-                                target_date, weather_code, precipitation_probability,
-                                reliability
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            publishing_office_id,
-                            data[1]['reportDatetime'],
-                            area['area']['code'],
-                            time,
-                            area['weatherCodes'][i] if 'weatherCodes' in area else None,
-                            area['pops'][i] if 'pops' in area and area['pops'][i] != '' else None,
-                            area['reliabilities'][i] if 'reliabilities' in area else None
-                        ))
-
-        # 平均値データの挿入
-        if 'tempAverage' in data[1]:
-            for area in data[1]['tempAverage']['areas']:
-                cursor.execute('''
-                    INSERT INTO climate_averages (
-                        publishing_office_id, report_datetime, area_code,
-                        type, min_value, max_value
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    publishing_office_id,
-                    data[1]['reportDatetime'],
-                    area['area']['code'],
-                    'temperature',
-                    area['min'],
-                    area['max']
-                ))
+        # 前回取り込んだ発表と同じか古ければ何もしない
+        if office_code:
+            cursor.execute("""
+                SELECT report_datetime, weekly_report_datetime
+                FROM ingest_watermarks WHERE office_code = ?
+            """, (office_code,))
+            if is_ingested(get_report_version(data), cursor.fetchone()):
+                print(f"エリアコード {office_code} の発表は取り込み済みです")
+                return False
+
+        publishing_office_id = insert_publishing_office(cursor, data)
+        sql = UPSERT_SQL if upsert else INSERT_SQL
+        for table, table_rows in extract_rows(data, publishing_office_id).items():
+            if table_rows:
+                cursor.executemany(sql[table], table_rows)
+        replace_current_forecasts(cursor, extract_current_rows(data))
+        if office_code:
+            save_watermarks(cursor, [(office_code, *get_report_version(data))])
 
         conn.commit()
         print("データベースへの挿入が完了しました")
+        return True
 
     except sqlite3.Error as e:
         print(f"データベースエラーが発生しました: {e}")
         conn.rollback()
+        return False
 
     finally:
         conn.close()
 
-def get_area_codes_from_csv(csv_path='/Users/marina/Lecture/DS-Programming2/jma2/area.csv'):
-    """CSVファイルからエリアコードを読み込む関数"""
+class BatchWriter:
+    """
+    1つの接続を使い回し、複数エリアの予報データをまとめて書き込むライター。
+    行はテーブルごとに溜めておき、batch_size 行に達したら executemany で1トランザクションとして書き込みます。
+
+    :param db_name: 書き込むデータベースファイルの名前
+    :param batch_size: 1トランザクションで書き込む行数の目安
+    :param pragmas: 接続時に設定するPRAGMA（DEFAULT_PRAGMAS を上書き）
+    :param upsert: True なら自然キーが重複する行を更新する（再実行しても行が増えない）。
+                   False なら単純なINSERT（空のデータベースへの初回ロード向け）
+    :param skip_unchanged: True なら ingest_watermarks に記録済みの発表と同じか古いデータを読み飛ばす
+    """
+    def __init__(self, db_name='weather.db', batch_size=50000, pragmas=None, upsert=True, skip_unchanged=True):
+        self.batch_size = batch_size
+        self.sql = UPSERT_SQL if upsert else INSERT_SQL
+        self.conn = sqlite3.connect(db_name)
+        for name, value in {**DEFAULT_PRAGMAS, **(pragmas or {})}.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        self.cursor = self.conn.cursor()
+        self.pending = {table: [] for table in TABLE_COLUMNS}
+        self.pending_count = 0
+        self.rows_written = 0
+        self.skip_unchanged = skip_unchanged
+        self.watermarks = load_watermarks(self.cursor)
+        self.pending_watermarks = []
+        # current_forecasts に反映する {エリアコード: 行} を発表ごとに追加順で溜める
+        self.pending_current = []
+        self.offices_skipped = 0
+        self.offices_written = 0
+
+    def add(self, data, office_code=None):
+        """
+        予報JSONを1件追加する。溜まった行数が batch_size を超えたら書き込む。
+        office_code を指定した場合、その office で取り込み済みの発表と同じか古い発表なら何もせず False を返す。
+        """
+        if not data:
+            return False
+        if office_code:
+            version = get_report_version(data)
+            if self.skip_unchanged and is_ingested(version, self.watermarks.get(office_code)):
+                self.offices_skipped += 1
+                return False
+            self.watermarks[office_code] = version
+            self.pending_watermarks.append((office_code, *version))
+        self.offices_written += 1
+        # publishing_officesのIDは行の生成に必要なため、その場で挿入する（コミットはflush時）
+        publishing_office_id = insert_publishing_office(self.cursor, data)
+        for table, table_rows in extract_rows(data, publishing_office_id).items():
+            self.pending[table].extend(table_rows)
+            self.pending_count += len(table_rows)
+        self.pending_current.append(extract_current_rows(data))
+        if self.pending_count >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """溜まっている行を1トランザクションで書き込む"""
+        try:
+            for table, table_rows in self.pending.items():
+                if table_rows:
+                    self.cursor.executemany(self.sql[table], table_rows)
+            for current in self.pending_current:
+                replace_current_forecasts(self.cursor, current)
+            save_watermarks(self.cursor, self.pending_watermarks)
+            self.conn.commit()
+            self.rows_written += self.pending_count
+        except sqlite3.Error as e:
+            print(f"データベースエラーが発生しました: {e}")
+            self.conn.rollback()
+            # 書き込めなかった発表を取り込み済みとみなさないよう、目印を読み直す
+            self.watermarks = load_watermarks(self.cursor)
+            raise
+        finally:
+            self.pending = {table: [] for table in TABLE_COLUMNS}
+            self.pending_count = 0
+            self.pending_watermarks = []
+            self.pending_current = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+            self.conn.close()
+
+def get_area_codes_from_csv(csv_path=DEFAULT_AREA_CSV, levels=None):
+    """
+    CSVファイルからエリアコードを読み込む関数
+
+    :param csv_path: area.csv のパス
+    :param levels: 読み込むレベル（例: ('offices',)）。None の場合はすべて
+    """
     area_codes = []
     try:
         with open(csv_path, 'r', encoding='utf-8') as f:
             csv_reader = csv.DictReader(f)
             for row in csv_reader:
-                if 'Code' in row:
+                if 'Code' in row and (levels is None or row.get('Level') in levels):
                     area_codes.append(row['Code'])
     except Exception as e:
         print(f"CSVファイルの読み込み中にエラーが発生しました: {e}")
     return area_codes
 
-def main():
+def select_forecast_codes(area_codes, areas):
+    """
+    指定されたエリア（任意のレベル）をすべて網羅する、最小限の予報取得用 office コードを返します。
+    centers は配下の offices に展開し、細分区域は所属する office にまとめます。
+    予報はofficesの単位でのみ配信されるため、それ以外のコードを取得しても404になります。
+    JMAのコードは複数のレベルにあることがあるため（011000 は地方と宗谷地方の府県予報区）、
+    レベルはコードごとではなく (コード, レベル) で確かめます。
+
+    :param area_codes: エリアコードのリスト
+    :param areas: AreaIndex
+    """
+    office_codes = {}
+    for code in area_codes:
+        levels = areas.levels(code)
+        if not levels:
+            continue
+        if 'centers' in levels:
+            candidates = [child for child, _ in areas.children(code, 'centers')
+                          if 'offices' in areas.levels(child)]
+            # 地方と同じコードの府県予報区も指定されたものとみなす
+            if 'offices' in levels:
+                candidates.append(code)
+        else:
+            candidates = [areas.office_of(code)]
+        for office_code in candidates:
+            if office_code:
+                office_codes[office_code] = None
+    return list(office_codes)
+
+def get_forecast_codes(csv_path=DEFAULT_AREA_CSV, area_db='area.db'):
+    """
+    CSVファイルのエリアを、予報が配信されている office コードに絞り込んで返します。
+    エリア階層を読み込めなかった場合は、CSVのエリアコードをそのまま返します。
+
+    :param csv_path: 取得対象のエリアの一覧（area.csv）のパス
+    :param area_db: エリア階層を読み込む area.db のパス
+    """
+    area_codes = get_area_codes_from_csv(csv_path)
+    if not area_codes:
+        return []
+    try:
+        areas = load_area_index(area_db)
+    except (OSError, sqlite3.Error) as e:
+        print(f"エリア階層の読み込み中にエラーが発生しました: {e}")
+        return area_codes
+    forecast_codes = select_forecast_codes(area_codes, areas)
+    print(f"{len(area_codes)} 件のエリアを {len(forecast_codes)} 件の予報区にまとめました。")
+    return forecast_codes
+
+def main(workers=1, rate=10, base_url=API_BASE_URL, area_db='area.db', cache_dir='http_cache',
+         history_dir=None, hot_days=2, v2_db=None, csv_path=DEFAULT_AREA_CSV):
+    """
+    天気予報データを取得してデータベースに格納します。
+
+    :param workers: 同時に取得するワーカー数（1なら逐次処理）
+    :param rate: 並行取得時の1ホストあたりの1秒間の最大リクエスト数
+    :param base_url: APIのURLテンプレート
+    :param area_db: エリア階層を読み込む area.db のパス
+    :param cache_dir: 条件付きGETのキャッシュを保存するディレクトリ（None なら使わない）
+    :param history_dir: 指定した場合は、hot_days 日より古い発表をこのディレクトリの月ごとの履歴に移す
+    :param hot_days: weather.db に残す発表の日数
+    :param v2_db: 指定した場合は、weather.db の代わりにこの v2 のスキーマのデータベース（weather_db_v2.py）に書き込む
+    :param csv_path: 取得対象のエリアの一覧（area.csv）のパス
+    """
     # データベースの作成
-    create_database()
-    
-    # CSVファイルからエリアコードを取得
-    area_codes = get_area_codes_from_csv()
+    if v2_db:
+        from weather_db_v2 import create_database as create_v2_database, V2Writer
+        create_v2_database(v2_db)
+    else:
+        create_database()
     
+    area_codes = get_forecast_codes(csv_path, area_db)
     if not area_codes:
         print("エリアコードを取得できませんでした。")
         return
-    
+
     # 各エリアの天気予報データを取得してデータベースに格納
-    for area_code in area_codes:
-        print(f"エリアコード {area_code} の天気データを取得中...")
-        weather_data = fetch_weather_data(area_code)
-        if weather_data:
-            insert_data_from_json(weather_data)
-            print(f"エリアコード {area_code} のデータを保存しました。")
-        else:
-            print(f"エリアコード {area_code} のデータ取得に失敗しました。")
+    http_cache = HTTPCache(cache_dir) if cache_dir else None
+    if workers > 1:
+        results = fetch_all_weather_data(area_codes, workers, rate, base_url, http_cache=http_cache)
+    else:
+        results = ((area_code, fetch_weather_data(area_code, base_url=base_url, http_cache=http_cache))
+                   for area_code in area_codes)
+
+    # 1つの接続でまとめて書き込む
+    with (V2Writer(v2_db) if v2_db else BatchWriter()) as writer:
+        for area_code, weather_data in results:
+            print(f"エリアコード {area_code} の天気データを取得中...")
+            not_modified = weather_data is NOT_MODIFIED
+            if not_modified:
+                # キャッシュは取り込み先のデータベースと別に更新されるため（ほかのデータベースへの取り込みや
+                # 別のプロセスの取得）、保存済みの本文の発表時刻を取り込み先の ingest_watermarks と比べる
+                weather_data = load_cached_weather_data(area_code, http_cache, base_url)
+            if weather_data:
+                if writer.add(weather_data, area_code):
+                    print(f"エリアコード {area_code} のデータを保存しました。")
+                elif not_modified:
+                    print(f"エリアコード {area_code} のデータは更新されていません。")
+                else:
+                    print(f"エリアコード {area_code} の発表は取り込み済みです。")
+            else:
+                print(f"エリアコード {area_code} のデータ取得に失敗しました。")
+    print(f"{writer.rows_written} 行をデータベースに挿入しました"
+          f"（取り込み {writer.offices_written} 件 / 取り込み済みでスキップ {writer.offices_skipped} 件）。")
+    if http_cache:
+        stats = http_cache.stats()
+        print(f"HTTPキャッシュ: ヒット {stats['hits']} 件 / ミス {stats['misses']} 件 / "
+              f"エラー {stats['errors']} 件（節約した転送量 {stats['bytes_saved']:,} バイト）")
+
+    # 古い発表を履歴に移し、weather.db を直近の発表だけにする
+    if history_dir:
+        from history_store import HistoryStore
+        result = HistoryStore(history_dir, hot_days=hot_days, compact_after_days=max(7, hot_days)).maintain()
+        print(f"{result['archived']} 行を履歴に移しました"
+              f"（圧縮 {len(result['compacted'])} 件 / 削除 {len(result['expired'])} 件）。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="JMAの天気予報データを取得してweather.dbに格納します")
+    parser.add_argument('--workers', type=int, default=1, help="同時に取得するワーカー数（1なら逐次処理）")
+    parser.add_argument('--rate', type=float, default=10, help="1ホストあたりの1秒間の最大リクエスト数")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="APIのURLテンプレート（スタブサーバー用）")
+    parser.add_argument('--area-db', default='area.db', help="エリア階層を読み込む area.db のパス")
+    parser.add_argument('--cache-dir', default='http_cache', help="条件付きGETのキャッシュを保存するディレクトリ")
+    parser.add_argument('--no-cache', action='store_true', help="条件付きGETのキャッシュを使わない")
+    parser.add_argument('--history-dir', help="古い発表を月ごとの履歴ファイルに移すディレクトリ（省略時は移さない）")
+    parser.add_argument('--hot-days', type=int, default=2, help="weather.db に残す発表の日数（--history-dir 指定時）")
+    parser.add_argument('--v2-db', help="weather.db の代わりに書き込む v2 のスキーマのデータベース")
+    parser.add_argument('--csv', default=DEFAULT_AREA_CSV, help="取得対象のエリアの一覧（area.csv）のパス")
+    args = parser.parse_args()
+    if args.v2_db and args.history_dir:
+        parser.error("--history-dir は従来のスキーマの weather.db にのみ使えます")
+    main(args.workers, args.rate, args.base_url, args.area_db, None if args.no_cache else args.cache_dir,
+         args.history_dir, args.hot_days, args.v2_db, args.csv)
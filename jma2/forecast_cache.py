@@ -0,0 +1,187 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
+from datetime import datetime
+
+def report_timestamp(data):
+    """予報JSONの発表時刻（reportDatetime）をUNIX時刻で返す（なければ None）"""
+    try:
+        return datetime.fromisoformat(data[0]['reportDatetime']).timestamp()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+class ForecastCache:
+    """
+    地域（office）ごとの予報JSONを保持するメモリキャッシュ。プロセスで1つ作り、すべてのセッションで共有します。
+    予報は発表時刻（reportDatetime）から ttl 秒で期限切れになり、次に使うときに取得し直します。
+    件数が max_entries を、合計サイズ（JSONにしたときのバイト数）が max_bytes を超えると、
+    最も長く使われていない地域から破棄します（LRU）。
+    同じ地域の取得が同時に要求された場合は1回だけ取得し、ほかの要求はその結果を待ちます。
+    prefetch() で地域をまとめてバックグラウンドで先読みでき、同時に取得する数は workers で制限します。
+
+    :param fetch: 地域コードを受け取り予報JSONを返す関数（取得できなければ例外を送出する）
+    :param ttl: 発表時刻からの有効期間（秒）
+    :param min_ttl: 取得してからの最低限の有効期間（秒）。次の発表がまだの予報を取得し直し続けないため
+    :param max_entries: 保持する地域の最大数
+    :param max_bytes: 保持する予報の合計サイズの上限（バイト）
+    :param workers: 先読みで同時に取得する最大数
+    """
+    def __init__(self, fetch, ttl=6 * 3600, min_ttl=300, max_entries=64, max_bytes=32 * 1024 * 1024, workers=4):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # 地域コード -> (予報JSON, 期限のUNIX時刻, サイズ)（末尾ほど最近使われた）
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # 取得中の地域コード -> 結果を受け取る Future
+        self.in_flight = {}
+        # 先読みの順番待ちの地域コード -> executor の Future
+        self.queued = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.prefetched = 0
+        self.expired = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _remove(self, code):
+        _, _, size = self.entries.pop(code)
+        self.total_bytes -= size
+
+    def _fresh(self, code):
+        """期限内の予報JSONを返す（期限切れなら破棄して None を返す）。lock を取得して呼ぶ"""
+        entry = self.entries.get(code)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self._remove(code)
+            self.expired += 1
+            return None
+        self.entries.move_to_end(code)
+        return entry[0]
+
+    def put(self, code, data):
+        """予報JSONを保存し、上限を超えた分を古いものから破棄する"""
+        now = time.time()
+        reported_at = report_timestamp(data)
+        expires_at = max((reported_at if reported_at is not None else now) + self.ttl, now + self.min_ttl)
+        size = len(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        with self.lock:
+            if code in self.entries:
+                self._remove(code)
+            self.entries[code] = (data, expires_at, size)
+            self.total_bytes += size
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                             or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _load(self, code, future):
+        """
+        地域の予報を取得して保存し、結果を future に設定して返す。
+        取得に失敗した場合は例外を future に設定してから送出する
+        """
+        try:
+            data = self.fetch(code)
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+                self.in_flight.pop(code, None)
+            future.set_exception(e)
+            raise
+        self.put(code, data)
+        with self.lock:
+            self.in_flight.pop(code, None)
+        future.set_result(data)
+        return data
+
+    def get(self, code):
+        """
+        地域の予報JSONを返します。期限内のものが保存されていればそのまま返し、
+        なければ取得します（同じ地域を取得中なら、その結果を待ちます）。
+        取得に失敗した場合は fetch の例外をそのまま送出します。
+        """
+        while True:
+            with self.lock:
+                data = self._fresh(code)
+                if data is not None:
+                    self.hits += 1
+                    return data
+                future = self.in_flight.get(code)
+                job = self.queued.get(code)
+                if future is None:
+                    owner = True
+                    future = self.in_flight[code] = Future()
+                elif job is not None and job.cancel():
+                    # 順番待ちの先読みは待たずに、ここで取得する
+                    owner = True
+                    del self.queued[code]
+                else:
+                    owner = False
+                if owner:
+                    future.set_running_or_notify_cancel()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+            if owner:
+                return self._load(code, future)
+            try:
+                return future.result()
+            except CancelledError:
+                # 待っていた先読みが取り消された場合は取得し直す
+                continue
+
+    def _prefetch_one(self, code, future):
+        with self.lock:
+            self.queued.pop(code, None)
+            if not future.set_running_or_notify_cancel():
+                return
+        try:
+            self._load(code, future)
+        except Exception as e:
+            print(f"地域 {code} の先読み中にエラーが発生しました: {e}")
+            return
+        with self.lock:
+            self.prefetched += 1
+
+    def prefetch(self, codes):
+        """
+        地域をバックグラウンドで先読みします。期限内のものが保存されている地域や取得中の地域は取得しません。
+        順番待ちの以前の先読みのうち、codes に含まれないものは取り消します。
+        """
+        codes = list(dict.fromkeys(codes))
+        wanted = set(codes)
+        with self.lock:
+            for code, job in list(self.queued.items()):
+                if code not in wanted and job.cancel():
+                    del self.queued[code]
+                    self.in_flight.pop(code).cancel()
+            for code in codes:
+                if code in self.in_flight or self._fresh(code) is not None:
+                    continue
+                future = self.in_flight[code] = Future()
+                self.queued[code] = self.executor.submit(self._prefetch_one, code, future)
+
+    def stats(self):
+        """ヒット・ミス・取得待ちの回数、ヒット率、保持している件数とサイズを返す"""
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'prefetched': self.prefetched,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'size': len(self.entries),
+                'bytes': self.total_bytes,
+            }
@@ -0,0 +1,142 @@
+from array import array
+
+# timeSeries の種類（最初の地域が持つ項目で判別する）
+SHORT_TERM_KINDS = (('weatherCodes', 'weather'), ('weathers', 'weather'), ('pops', 'pops'), ('temps', 'temps'))
+WEEKLY_KINDS = (('weatherCodes', 'weekly'), ('tempsMin', 'weekly_temps'))
+
+# 日ごとの表示に使う項目: (timeSeriesの種類, [(JSONの項目, 表示の項目, 値がない場合), ...])
+DAILY_FIELDS = (
+    ('weather', (('weathers', 'description', "データなし"),
+                 ('winds', 'wind', "データなし"),
+                 ('waves', 'wave', "データなし"),
+                 ('weatherCodes', 'weather_code', "unknown"))),
+    ('pops', (('pops', 'pop', "データなし"),)),
+    ('temps', (('temps', 'temp', "データなし"),)),
+)
+
+def series_kind(areas, kinds):
+    """timeSeries の最初の地域の項目から種類を判別する（不明なら None）"""
+    if not areas:
+        return None
+    for key, kind in kinds:
+        if key in areas[0]:
+            return kind
+    return None
+
+class SeriesFrame:
+    """
+    予報JSONの timeSeries 1つ分を列形式にしたもの。
+    values[key][i] は i 番目の地域の時刻ごとの値のリスト（その地域にない項目は None）、
+    days[j] は j 番目の時刻が ForecastFrame.dates の何番目の日付かを表します（dates の参照後に設定されます）。
+    """
+    __slots__ = ('kind', 'times', 'days', 'codes', 'names', 'values')
+
+    def __init__(self, kind, times, codes, names, values):
+        self.kind = kind
+        self.times = times
+        self.days = None
+        self.codes = codes
+        self.names = names
+        self.values = values
+
+    @classmethod
+    def from_json(cls, kind, series):
+        areas = series['areas']
+        keys = dict.fromkeys(key for area in areas for key in area)
+        keys.pop('area', None)
+        return cls(kind,
+                   series.get('timeDefines', []),
+                   [area['area']['code'] for area in areas],
+                   [area['area']['name'] for area in areas],
+                   {key: [area.get(key) for area in areas] for key in keys})
+
+    def column(self, key):
+        """項目の値を地域ごとに返す（項目がなければすべて None）"""
+        return self.values.get(key) or [None] * len(self.codes)
+
+class ForecastFrame:
+    """
+    予報JSON（forecast/{office}.json）を、報告に含まれるすべての地域について列形式に正規化したもの。
+    短期予報の timeSeries は weather（天気・風・波）, pops（降水確率）, temps（気温）、
+    週間予報は weekly（天気・降水確率・信頼度）, weekly_temps（最低・最高気温）に分けて保持します。
+    時刻は日付ごとにまとめ、各 timeSeries の時刻の日付は dates の番号の配列（days）として1度だけ求めます
+    （dates を最初に参照したときに求めるため、日付を使わない取り込みでは計算しません）。
+
+    :param data: JMAの予報JSON
+    """
+    def __init__(self, data):
+        self.publishing_office = data[0].get('publishingOffice')
+        self.report_datetime = data[0].get('reportDatetime')
+        self.weekly_report_datetime = data[1].get('reportDatetime') if len(data) > 1 else None
+        self.short_term = self._load_series(data[0], SHORT_TERM_KINDS)
+        self.weekly = self._load_series(data[1], WEEKLY_KINDS) if len(data) > 1 else []
+        self.temp_averages = data[1].get('tempAverage', {}).get('areas', []) if len(data) > 1 else []
+        self._dates = None
+
+    @property
+    def dates(self):
+        """予報に含まれる日付（YYYY-MM-DD）の昇順のリスト"""
+        if self._dates is None:
+            # 時刻の文字列（ISO 8601、現地時刻）の先頭10文字が日付になる
+            date_of = {}
+            for series in self.short_term + self.weekly:
+                for time in series.times:
+                    if time not in date_of:
+                        date_of[time] = time[:10]
+            dates = sorted(set(date_of.values()))
+            index = {date: i for i, date in enumerate(dates)}
+            for series in self.short_term + self.weekly:
+                series.days = array('H', [index[date_of[time]] for time in series.times])
+            self._dates = dates
+        return self._dates
+
+    @staticmethod
+    def _load_series(report, kinds):
+        frames = []
+        for series in report.get('timeSeries', []):
+            kind = series_kind(series.get('areas'), kinds)
+            if kind is not None:
+                frames.append(SeriesFrame.from_json(kind, series))
+        return frames
+
+    def get(self, kind):
+        """種類が kind の最初の timeSeries を返す（なければ None）"""
+        for series in self.short_term + self.weekly:
+            if series.kind == kind:
+                return series
+        return None
+
+    def _merge_daily(self, area_count):
+        """先頭から area_count 件の地域について、日付ごとの辞書のリストを1回の走査で作る"""
+        days_by_area = [[{} for _ in self.dates] for _ in range(area_count)]
+        for kind, fields in DAILY_FIELDS:
+            series = self.get(kind)
+            if series is None:
+                continue
+            for key, field, default in fields:
+                column = series.column(key)
+                for days, values in zip(days_by_area, column):
+                    values = values or []
+                    for j, day in enumerate(series.days):
+                        days[day][field] = values[j] if j < len(values) else default
+        return [[(date, day) for date, day in zip(self.dates, days) if day] for days in days_by_area]
+
+    def areas(self, kind='weather'):
+        """種類が kind の timeSeries の地域を [(地域コード, 地域名), ...] で返す"""
+        series = self.get(kind)
+        return list(zip(series.codes, series.names)) if series is not None else []
+
+    def daily(self, area_index=0):
+        """
+        短期予報を日付ごとにまとめ、[(日付, {description, wind, wave, weather_code, pop, temp}), ...] を返します。
+        各 timeSeries の area_index 番目の地域の値を使い、同じ日付に複数の時刻がある場合は後の時刻の値を使います。
+        """
+        return self._merge_daily(area_index + 1)[area_index]
+
+    def daily_by_area(self):
+        """
+        短期予報のすべての細分区域を1回の走査で日付ごとにまとめ、{地域コード: daily() と同じリスト} を返します。
+        地域は天気の timeSeries の順で、気温（地点ごとの予報）は同じ順番の地点の値を使います。
+        """
+        codes = [code for code, _ in self.areas('weather')]
+        return dict(zip(codes, self._merge_daily(len(codes))))
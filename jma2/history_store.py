@@ -0,0 +1,298 @@
+import os
+import re
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from create_weather_db import (TABLE_COLUMNS, NATURAL_KEYS, DEFAULT_PRAGMAS,
+                               create_forecast_tables, create_natural_key_indexes)
+
+# JMAの発表時刻のタイムゾーン（report_datetime はすべて +09:00 の文字列のため、文字列のまま比較できる）
+JST = timezone(timedelta(hours=9))
+
+# パーティションのファイル名（発表時刻の年月ごと）
+PARTITION_FILE = 'weather_{}.db'
+PARTITION_PATTERN = re.compile(r'weather_(\d{4}-\d{2})\.db$')
+
+# 圧縮時に「同じ予報」とみなす列（自然キーから発表時刻を除いたもの）
+HISTORY_KEYS = {table: tuple(key for key in keys if key != 'report_datetime')
+                for table, keys in NATURAL_KEYS.items()}
+
+def month_of(report_datetime):
+    """発表時刻の文字列（ISO 8601）からパーティションの年月（YYYY-MM）を返す"""
+    return report_datetime[:7]
+
+def next_month(month):
+    """年月（YYYY-MM）の翌月を返す"""
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+def jst_isoformat(moment):
+    """datetime を report_datetime と比較できる +09:00 の文字列にする"""
+    return moment.astimezone(JST).isoformat(timespec='seconds')
+
+class HistoryStore:
+    """
+    予報の履歴を発表時刻の年月ごとのファイル（パーティション）に分けて保存するストア。
+    weather.db には直近 hot_days 日分の発表だけを残し、それより古い行は archive() でパーティションに移します。
+    パーティションは weather.db と同じ予報テーブルを持ち、publishing_office_id は weather.db の
+    publishing_offices を参照します。
+
+    - 発表から compact_after_days 日を過ぎた月のパーティションは、対象時刻ごとに最新の発表だけを残して圧縮します。
+    - 月全体が retention_days 日より古くなったパーティションは、ファイルごと削除します。
+    - 履歴の検索（history）は、期間に重なる月のパーティションだけを開きます。
+
+    このため weather.db の大きさとアプリの検索時間は、履歴が何か月分たまっても直近の発表の分で頭打ちになります。
+
+    :param root: パーティションを保存するディレクトリ
+    :param hot_days: weather.db に残す発表の日数
+    :param compact_after_days: パーティションを圧縮するまでの日数（月末からの日数）
+    :param retention_days: パーティションを保持する日数（月末からの日数）
+    """
+    def __init__(self, root='history', hot_days=2, compact_after_days=7, retention_days=180):
+        if compact_after_days < hot_days:
+            raise ValueError("compact_after_days は hot_days 以上にしてください")
+        self.root = root
+        self.hot_days = hot_days
+        self.compact_after_days = compact_after_days
+        self.retention_days = retention_days
+        # 同じストアの保守処理（archive / compact / 削除）を同時に実行しない
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def path(self, month):
+        return os.path.join(self.root, PARTITION_FILE.format(month))
+
+    def partitions(self):
+        """保存されているパーティションの年月を古い順に返す"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(match.group(1) for match in map(PARTITION_PATTERN.match, names) if match)
+
+    def partitions_between(self, start=None, end=None):
+        """発表時刻が [start, end) に含まれうるパーティションの年月を返す（None は制限なし）"""
+        first = month_of(start) if start else None
+        last = month_of(end) if end else None
+        return [month for month in self.partitions()
+                if (first is None or month >= first) and (last is None or month <= last)]
+
+    def _create_partition(self, month):
+        os.makedirs(self.root, exist_ok=True)
+        conn = sqlite3.connect(self.path(month))
+        try:
+            for name, value in DEFAULT_PRAGMAS.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            cursor = conn.cursor()
+            create_forecast_tables(cursor)
+            create_natural_key_indexes(cursor)
+            # 圧縮済みかどうかの記録（行を移したら消し、次の compact() で圧縮し直す）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS partition_info (
+                    month TEXT PRIMARY KEY,
+                    compacted_at TEXT
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def archive(self, weather_db='weather.db', now=None):
+        """
+        weather.db の発表のうち hot_days 日より古いものを、年月ごとのパーティションに移します。
+        パーティションへの挿入は自然キーで重複を無視するため、途中で失敗しても再実行すれば続きから移せます。
+
+        :return: 移した行数
+        """
+        cutoff = jst_isoformat((now or datetime.now(JST)) - timedelta(days=self.hot_days))
+        moved = 0
+        conn = sqlite3.connect(weather_db, timeout=30)
+        try:
+            months = set()
+            for table in TABLE_COLUMNS:
+                months.update(month for month, in conn.execute(
+                    f"SELECT DISTINCT substr(report_datetime, 1, 7) FROM {table} WHERE report_datetime < ?",
+                    (cutoff,)))
+            for month in sorted(months):
+                if not os.path.exists(self.path(month)):
+                    self._create_partition(month)
+                conn.execute("ATTACH DATABASE ? AS part", (self.path(month),))
+                try:
+                    # この月の cutoff より前の発表（cutoff が月の途中でも、月の範囲で区切る）
+                    bounds = (month, next_month(month), cutoff)
+                    for table, columns in TABLE_COLUMNS.items():
+                        column_list = ', '.join(columns)
+                        conn.execute(f'''
+                            INSERT OR IGNORE INTO part.{table} ({column_list})
+                            SELECT {column_list} FROM main.{table}
+                            WHERE report_datetime >= ? AND report_datetime < ? AND report_datetime < ?
+                        ''', bounds)
+                        moved += conn.execute(f'''
+                            DELETE FROM main.{table}
+                            WHERE report_datetime >= ? AND report_datetime < ? AND report_datetime < ?
+                        ''', bounds).rowcount
+                    conn.execute("DELETE FROM part.partition_info WHERE month = ?", (month,))
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE part")
+            if moved:
+                # 空いたページが多ければ weather.db を詰める（以降は空いたページが再利用されるため大きくならない）
+                free_pages, = conn.execute("PRAGMA freelist_count").fetchone()
+                page_count, = conn.execute("PRAGMA page_count").fetchone()
+                if free_pages * 2 > page_count:
+                    conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return moved
+
+    def compact(self, now=None):
+        """
+        月末から compact_after_days 日を過ぎたパーティションを、対象時刻ごとに最新の発表だけを残して圧縮します。
+
+        :return: 圧縮したパーティションの年月のリスト
+        """
+        cutoff = month_of(jst_isoformat((now or datetime.now(JST)) - timedelta(days=self.compact_after_days)))
+        compacted = []
+        for month in self.partitions():
+            # 月が終わっていないパーティションには、まだ発表が追加される
+            if month >= cutoff:
+                continue
+            conn = sqlite3.connect(self.path(month), timeout=30)
+            try:
+                if conn.execute("SELECT 1 FROM partition_info WHERE month = ?", (month,)).fetchone():
+                    continue
+                for table, keys in HISTORY_KEYS.items():
+                    # MAX() と一緒に選んだ id は、最新の発表の行の id になる
+                    conn.execute(f'''
+                        DELETE FROM {table}
+                        WHERE id NOT IN (
+                            SELECT id FROM (
+                                SELECT id, MAX(report_datetime) FROM {table} GROUP BY {', '.join(keys)}
+                            )
+                        )
+                    ''')
+                conn.execute("INSERT OR REPLACE INTO partition_info (month, compacted_at) VALUES (?, ?)",
+                             (month, jst_isoformat(datetime.now(JST))))
+                conn.commit()
+                conn.execute("VACUUM")
+                compacted.append(month)
+            finally:
+                conn.close()
+        return compacted
+
+    def expire(self, now=None):
+        """
+        月全体が retention_days 日より古いパーティションを削除します。
+
+        :return: 削除したパーティションの年月のリスト
+        """
+        cutoff = month_of(jst_isoformat((now or datetime.now(JST)) - timedelta(days=self.retention_days)))
+        expired = []
+        for month in self.partitions():
+            if month >= cutoff:
+                continue
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.path(month) + suffix)
+                except FileNotFoundError:
+                    pass
+            expired.append(month)
+        return expired
+
+    def maintain(self, weather_db='weather.db', now=None):
+        """archive, expire, compact を順に実行し、結果を辞書で返す（削除するパーティションは圧縮しない）"""
+        with self.lock:
+            archived = self.archive(weather_db, now)
+            expired = self.expire(now)
+            return {'archived': archived, 'compacted': self.compact(now), 'expired': expired}
+
+    def start(self, weather_db='weather.db', interval=3600):
+        """maintain() を interval 秒ごとにバックグラウンドのスレッドで実行する"""
+        def run():
+            while not self.stop_event.is_set():
+                try:
+                    result = self.maintain(weather_db)
+                    if any(result.values()):
+                        print(f"履歴の保守: {result}")
+                except (OSError, sqlite3.Error) as e:
+                    print(f"履歴の保守中にエラーが発生しました: {e}")
+                self.stop_event.wait(interval)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=run, name='history-maintenance', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """バックグラウンドの保守を止める（実行中の maintain() の終了を待つ）"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def history(self, table, area_code, start=None, end=None, weather_db='weather.db'):
+        """
+        エリアの予報の履歴を、発表時刻が [start, end) のものについて発表時刻順に返します。
+        期間に重なる月のパーティションと weather.db（直近の発表）だけを検索します。
+
+        :param table: 予報テーブル名（TABLE_COLUMNS のキー）
+        :param area_code: エリアコード
+        :param start: 発表時刻の下限（ISO 8601 の文字列, None なら制限なし）
+        :param end: 発表時刻の上限（含まない, None なら制限なし）
+        :param weather_db: 直近の発表を保存している weather.db
+        :return: TABLE_COLUMNS[table] の列の行のリスト
+        """
+        conditions = ['area_code = ?']
+        params = [area_code]
+        if start:
+            conditions.append('report_datetime >= ?')
+            params.append(start)
+        if end:
+            conditions.append('report_datetime < ?')
+            params.append(end)
+        sql = (f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {{schema}}.{table} "
+               f"WHERE {' AND '.join(conditions)} ORDER BY {', '.join(NATURAL_KEYS[table][1:])}")
+
+        rows = []
+        conn = sqlite3.connect(f"file:{os.path.abspath(weather_db)}?mode=ro", uri=True)
+        try:
+            # パーティションは1つずつ開くため、ATTACH できる数の上限を気にしなくてよい。
+            # パーティションは古い月から、weather.db の発表はすべてのパーティションより新しいため、
+            # 順につなげれば発表時刻順になる
+            for month in self.partitions_between(start, end):
+                conn.execute("ATTACH DATABASE ? AS part",
+                             (f"file:{os.path.abspath(self.path(month))}?mode=ro",))
+                try:
+                    rows.extend(conn.execute(sql.format(schema='part'), params).fetchall())
+                finally:
+                    conn.execute("DETACH DATABASE part")
+            rows.extend(conn.execute(sql.format(schema='main'), params).fetchall())
+        finally:
+            conn.close()
+        return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="weather.db の古い発表を月ごとの履歴ファイルに移し、圧縮・削除します")
+    parser.add_argument('--db', default='weather.db', help="直近の発表を保存している weather.db")
+    parser.add_argument('--history-dir', default='history', help="パーティションを保存するディレクトリ")
+    parser.add_argument('--hot-days', type=int, default=2, help="weather.db に残す発表の日数")
+    parser.add_argument('--compact-after-days', type=int, default=7, help="パーティションを圧縮するまでの日数（月末から）")
+    parser.add_argument('--retention-days', type=int, default=180, help="パーティションを保持する日数（月末から）")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="指定した場合は、この秒数ごとに保守を繰り返す（Ctrl+C で終了）")
+    args = parser.parse_args()
+    store = HistoryStore(args.history_dir, args.hot_days, args.compact_after_days, args.retention_days)
+    if args.interval > 0:
+        store.start(args.db, args.interval)
+        try:
+            store.thread.join()
+        except KeyboardInterrupt:
+            store.stop()
+    else:
+        result = store.maintain(args.db)
+        print(f"{result['archived']} 行を履歴に移しました"
+              f"（圧縮 {len(result['compacted'])} 件 / 削除 {len(result['expired'])} 件）。")
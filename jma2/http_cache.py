@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import threading
+import requests
+
+class HTTPCache:
+    """
+    ETag / Last-Modified を使った条件付きGETのためのディスクキャッシュ。
+    URLごとに検証子（ETag, Last-Modified）とレスポンス本文を保存し、
+    次回以降は If-None-Match / If-Modified-Since を付けてリクエストします。
+    サーバーが 304 を返した場合は本文をダウンロードせず、保存済みの内容を使います。
+
+    :param cache_dir: キャッシュを保存するディレクトリ
+    """
+    def __init__(self, cache_dir='http_cache'):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.meta.json', base + '.body'
+
+    def _load_meta(self, url):
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return meta if meta.get('url') == url else None
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url, response):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        for path, write in ((body_path, lambda f: f.write(response.content)),
+                            (meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+
+    def read_body(self, url):
+        """保存済みのレスポンス本文を返す（なければ None）"""
+        _, body_path = self._paths(url)
+        try:
+            with open(body_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, url, session=None, timeout=None):
+        """
+        条件付きGETを行い (status_code, content) を返します。
+        200 の場合は新しい本文、304 の場合は None を返します（本文は read_body() で取得できます）。
+        それ以外のステータスの場合はキャッシュを更新せず、そのまま返します。
+        """
+        headers = {}
+        meta = self._load_meta(url)
+        if meta and os.path.exists(self._paths(url)[1]):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = (session or requests).get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            with self.lock:
+                self.errors += 1
+            raise
+
+        if response.status_code == 304 and headers:
+            with self.lock:
+                self.hits += 1
+                self.bytes_saved += os.path.getsize(self._paths(url)[1])
+            return 304, None
+
+        if response.status_code == 200:
+            self._store(url, response)
+            with self.lock:
+                self.misses += 1
+                self.bytes_downloaded += len(response.content)
+            return 200, response.content
+
+        with self.lock:
+            self.errors += 1
+        return response.status_code, None
+
+    def get_json(self, url, session=None, timeout=None):
+        """
+        条件付きGETを行い (status_code, data) を返します。
+        304 の場合は保存済みの本文を解析して返します。解析済みのJSONは保持しないため、
+        メモリに置く予報は呼び出し側のキャッシュ（ForecastCache）の上限だけで決まります。
+        """
+        status_code, content = self.get(url, session, timeout)
+        if status_code == 200:
+            return status_code, json.loads(content)
+        if status_code == 304:
+            return status_code, json.loads(self.read_body(url))
+        return status_code, None
+
+    def stats(self):
+        """ヒット（304）・ミス（200）の回数と転送量を返す"""
+        with self.lock:
+            requests_made = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_rate': self.hits / requests_made if requests_made else 0.0,
+                'bytes_downloaded': self.bytes_downloaded,
+                'bytes_saved': self.bytes_saved,
+            }
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# JMAの天気アイコンのURL
+ICON_URL = 'https://www.jma.go.jp/bosai/forecast/img/{}.png'
+FALLBACK_ICON_URL = 'https://www.jma.go.jp/bosai/forecast/img/unknown.png'
+
+class IconResolver:
+    """
+    天気コードからアイコンのURLを求めるリゾルバー。
+    各天気コードのアイコンが存在するかは1度だけ確認し、結果をファイルに保存して次回以降も使います。
+    保存した結果は ttl 秒を過ぎると破棄し、再確認します。未確認のコードはバックグラウンドで並行して確認します。
+
+    :param cache_file: 確認結果を保存するJSONファイル
+    :param ttl: 確認結果の有効期間（秒）
+    :param workers: 同時に確認するワーカー数
+    :param icon_url: アイコンのURLテンプレート
+    :param fallback_url: アイコンが存在しない場合のURL
+    """
+    def __init__(self, cache_file='icon_cache.json', ttl=7 * 24 * 3600, workers=4,
+                 icon_url=ICON_URL, fallback_url=FALLBACK_ICON_URL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.icon_url = icon_url
+        self.fallback_url = fallback_url
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.session = requests.Session()
+        # 天気コード -> (アイコンが存在するか, 確認した時刻)
+        self.checked = self._load()
+        # 確認中の天気コード -> 完了時に呼ぶコールバックのリスト
+        self.in_flight = {}
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {code: (valid, checked_at) for code, (valid, checked_at) in entries.items()
+                if now - checked_at < self.ttl}
+
+    def _save(self):
+        with self.lock:
+            entries = dict(self.checked)
+        tmp_file = f"{self.cache_file}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"アイコンキャッシュの保存中にエラーが発生しました: {e}")
+
+    def _url(self, code, valid):
+        return self.icon_url.format(code) if valid else self.fallback_url
+
+    def cached(self, code):
+        """確認済みで有効期間内ならアイコンのURLを、そうでなければ None を返す"""
+        with self.lock:
+            entry = self.checked.get(code)
+            if entry is None:
+                return None
+            valid, checked_at = entry
+            if time.time() - checked_at >= self.ttl:
+                del self.checked[code]
+                return None
+        return self._url(code, valid)
+
+    def _check(self, code):
+        try:
+            valid = self.session.head(self.icon_url.format(code), timeout=5).status_code == 200
+        except requests.RequestException:
+            # 通信エラーは結果を保存せず、代替アイコンを使う
+            valid = None
+        with self.lock:
+            if valid is not None:
+                self.checked[code] = (valid, time.time())
+            callbacks = self.in_flight.pop(code, [])
+        if valid is not None:
+            self._save()
+        url = self._url(code, bool(valid))
+        for callback in callbacks:
+            callback(code, url)
+
+    def resolve_async(self, code, callback):
+        """
+        天気コードのアイコンURLを求め、callback(code, url) を呼びます。
+        確認済みならその場で呼び、未確認ならバックグラウンドで確認してから呼びます。
+        同じコードの確認が進行中なら、その結果を待ちます（リクエストは1回だけ）。
+        """
+        url = self.cached(code)
+        if url is not None:
+            callback(code, url)
+            return
+        with self.lock:
+            if code in self.in_flight:
+                self.in_flight[code].append(callback)
+                return
+            self.in_flight[code] = [callback]
+        self.executor.submit(self._check, code)
+
+    def resolve(self, code):
+        """天気コードのアイコンURLを返す（未確認ならその場で確認する）"""
+        done = threading.Event()
+        result = []
+        self.resolve_async(code, lambda _, url: (result.append(url), done.set()))
+        done.wait()
+        return result[0]
+
+class IconStore:
+    """
+    天気アイコンをローカルに保存するストア。
+    画像はその内容のSHA-256をファイル名として保存し（同じ画像は1つだけ）、
+    天気コードとファイル名の対応は manifest.json に記録します。
+    Flet の assets ディレクトリの下に置くため、アプリはネットワークにアクセスせずにアイコンを表示できます。
+
+    :param assets_dir: Flet の assets ディレクトリ
+    :param subdir: assets ディレクトリ内でアイコンを保存するディレクトリ
+    """
+    def __init__(self, assets_dir='assets', subdir='icons'):
+        self.subdir = subdir
+        self.icon_dir = os.path.join(assets_dir, subdir)
+        self.manifest_file = os.path.join(self.icon_dir, 'manifest.json')
+        self.lock = threading.Lock()
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def __contains__(self, code):
+        return code in self.manifest
+
+    def src(self, code):
+        """天気コードのアイコンの Image.src 用のパスを返す（保存されていなければ None）"""
+        filename = self.manifest.get(code)
+        return f"/{self.subdir}/{filename}" if filename else None
+
+    def add(self, code, content, extension='.png'):
+        """アイコンの画像を保存し、天気コードに対応付ける"""
+        filename = hashlib.sha256(content).hexdigest() + extension
+        path = os.path.join(self.icon_dir, filename)
+        os.makedirs(self.icon_dir, exist_ok=True)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.manifest[code] = filename
+
+    def save(self):
+        """天気コードとファイル名の対応を manifest.json に保存する"""
+        os.makedirs(self.icon_dir, exist_ok=True)
+        with self.lock:
+            manifest = dict(sorted(self.manifest.items()))
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+def get_weather_codes(weather_db='weather.db'):
+    """weather.db に出現するすべての天気コードを返す"""
+    conn = sqlite3.connect(weather_db)
+    try:
+        rows = conn.execute("""
+            SELECT weather_code FROM weather_forecasts WHERE weather_code IS NOT NULL
+            UNION
+            SELECT weather_code FROM weekly_forecasts WHERE weather_code IS NOT NULL
+        """).fetchall()
+    finally:
+        conn.close()
+    return sorted(code for code, in rows)
+
+def prefetch_icons(codes, store, icon_url=ICON_URL, workers=8, refresh=False):
+    """
+    天気コードのアイコンをまとめてダウンロードし、IconStore に保存します。
+    代替アイコン（unknown）も必ず取得します。
+
+    :param codes: 天気コードのリスト
+    :param store: 保存先の IconStore
+    :param icon_url: アイコンのURLテンプレート
+    :param workers: 同時にダウンロードするワーカー数
+    :param refresh: True なら保存済みのコードも取得し直す
+    :return: (保存した数, 見つからなかった数, 失敗した数)
+    """
+    targets = [code for code in dict.fromkeys([*codes, 'unknown']) if refresh or code not in store]
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    def download(code):
+        try:
+            response = session.get(icon_url.format(code), timeout=10)
+        except requests.RequestException as e:
+            print(f"天気コード {code} のアイコンの取得中にエラーが発生しました: {e}")
+            return 'failed'
+        if response.status_code != 200:
+            return 'missing'
+        store.add(code, response.content)
+        return 'saved'
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(download, targets))
+    finally:
+        session.close()
+    store.save()
+    return results.count('saved'), results.count('missing'), results.count('failed')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="weather.db に出現する天気コードのアイコンを assets にダウンロードします")
+    parser.add_argument('--db', default='weather.db', help="天気コードを読み込む weather.db")
+    parser.add_argument('--assets-dir', default='assets', help="Flet の assets ディレクトリ")
+    parser.add_argument('--icon-url', default=ICON_URL, help="アイコンのURLテンプレート（スタブサーバー用）")
+    parser.add_argument('--workers', type=int, default=8, help="同時にダウンロードするワーカー数")
+    parser.add_argument('--refresh', action='store_true', help="保存済みのアイコンも取得し直す")
+    args = parser.parse_args()
+    saved, missing, failed = prefetch_icons(get_weather_codes(args.db), IconStore(args.assets_dir),
+                                            args.icon_url, args.workers, args.refresh)
+    print(f"アイコンを {saved} 件保存しました（見つからない {missing} 件 / 失敗 {failed} 件）。")
@@ -0,0 +1,101 @@
+import re
+import json
+
+# JSONの空白
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# 数値の続きになりうる文字
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+class _Reader:
+    """ファイルを少しずつ読み込みながら、JSONの値を先頭から順に解析する"""
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """続きを読み込む（読み込めなければ False）"""
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """空白を読み飛ばし、次の文字を返す（終端なら空文字）"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        """次の値を1つ解析して返す（途中で切れていれば続きを読み込んで解析し直す）"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 読み込んだ分より大きな値なら、読み込む量を倍にして解析し直す
+                if self._fill(max(self.chunk_size, len(self.buf))):
+                    continue
+                raise
+            # 数値はバッファの終わりで切れていても解析できてしまうため、続きを読み込んで解析し直す
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and NUMBER_TAIL.match(self.buf, end).end() == len(self.buf) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+def _walk(reader, path, expand):
+    start = reader.peek()
+    if start not in ('{', '[') or not expand(path):
+        yield path, reader.decode()
+        return
+    reader.pos += 1
+    end = '}' if start == '{' else ']'
+    if reader.peek() == end:
+        reader.pos += 1
+        return
+    index = 0
+    while True:
+        if start == '{':
+            key = reader.decode()
+            reader.expect(':')
+        else:
+            key = index
+            index += 1
+        yield from _walk(reader, path + (key,), expand)
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == end:
+            return
+        if separator != ',':
+            raise json.JSONDecodeError(f"Expecting ',' or '{end}'", reader.buf, reader.pos - 1)
+
+def iter_items(f, expand, chunk_size=1 << 16):
+    """
+    JSONファイルを少しずつ読み込み、値を解析できたものから順に (パス, 値) を返します。
+    expand(パス) が True のオブジェクト・配列はその中の値を1つずつ返し、それ以外はまとめて解析して返します。
+    パスはオブジェクトのキーと配列の添字のタプルです（最上位は ()）。
+
+    :param f: テキストモードで開いたファイル
+    :param expand: 中の値を1つずつ返すオブジェクト・配列かを判定する関数
+    :param chunk_size: 1回に読み込む文字数
+    """
+    reader = _Reader(f, chunk_size)
+    yield from _walk(reader, (), expand)
+    if reader.peek():
+        raise json.JSONDecodeError("Extra data", reader.buf, reader.pos)
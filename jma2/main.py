@@ -1,52 +1,49 @@
 import flet as ft
+import os
+import asyncio
 import json
 import requests
 from collections import defaultdict
-from datetime import datetime
-
-# JSONファイルのパス
-json_file_path = "/Users/marina/Lecture/DS-Programming2/jma/area.json"
-
-# JSONデータの読み込み
-with open(json_file_path, 'r', encoding='utf-8') as file:
-    data = json.load(file)
-
-# centersから地方名と地方コードを抽出
-centers = data.get('centers', {})
-CENTER_CODES = {}
-for center_id, center_info in centers.items():
-    name = center_info.get('name')
-    if name and center_id:
-        CENTER_CODES[name] = center_id
-
-# officesから地域名と地域コードを抽出
-offices = data.get('offices', {})
-OFFICE_CODES = {}
-for office_id, office_info in offices.items():
-    name = office_info.get('name')
-    if name and office_id:
-        OFFICE_CODES[name] = office_id
-
-# 地方ごとに対応する地域名のリストを作成
-CENTER_TO_OFFICES = {}
-for center_name, center_id in CENTER_CODES.items():
-    center_info = centers.get(center_id, {})
-    children_ids = center_info.get('children', [])
-    office_names = []
-    for office_id in children_ids:
-        office_info = offices.get(office_id, {})
-        office_name = office_info.get('name')
-        if office_name:
-            office_names.append(office_name)
-    CENTER_TO_OFFICES[center_name] = office_names
-
-# デバッグ用にCENTER_CODESとCENTER_TO_OFFICESを表示
-print("CENTER_CODES:", CENTER_CODES)
-print("CENTER_TO_OFFICES:", CENTER_TO_OFFICES)
+from http_cache import HTTPCache
+from area_index import load_area_index
+from icon_cache import IconResolver, IconStore
+from forecast_cache import ForecastCache
+from weather_view import KeyedList, DayCardView
+from forecast_frame import ForecastFrame
+
+# エリア階層（起動時に一度だけ読み込み、以降はインデックスから参照する）
+areas = load_area_index()
 
 # JMAのAPIのベースURL
 API_BASE_URL = 'https://www.jma.go.jp/bosai/forecast/data/forecast/{}.json'
 
+# 予報JSONの条件付きGET用キャッシュ（更新がなければ本文をダウンロードしない）。
+# create_weather_db.py のキャッシュとは別のディレクトリにし、互いの取得で 304 にならないようにする
+http_cache = HTTPCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_http_cache'))
+
+class FetchError(Exception):
+    """予報JSONを取得できなかったときの例外（HTTPステータスコードを保持する）"""
+    def __init__(self, status_code):
+        super().__init__(f"ステータスコード: {status_code}")
+        self.status_code = status_code
+
+def load_forecast(office_code):
+    """地域の予報JSONを取得する"""
+    status_code, data = http_cache.get_json(API_BASE_URL.format(office_code))
+    if status_code not in (200, 304):
+        raise FetchError(status_code)
+    return data
+
+# 地域ごとの予報のキャッシュ（すべてのセッションで共有し、同じ地域を同時に取得しない）
+forecast_cache = ForecastCache(load_forecast)
+
+# 天気コードごとのアイコンの確認結果（アプリを再起動しても使い回す）
+icon_resolver = IconResolver(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icon_cache.json'))
+
+# ローカルに保存した天気アイコン（python icon_cache.py で事前にダウンロードする）
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+icon_store = IconStore(ASSETS_DIR)
+
 def main(page: ft.Page):
     page.title = "地域別天気アプリ（JMA）"
     page.padding = 20
@@ -70,6 +67,9 @@ def main(page: ft.Page):
         padding=10
     )
     
+    # 日付ごとの天気カード（再取得のたびに作り直さず、変わった部分だけを更新する）
+    day_cards = KeyedList(weather_list, 'controls', DayCardView)
+
     loading_indicator = ft.ProgressRing(visible=False)
 
     # 天気情報を表示するためのコンテナ
@@ -82,7 +82,74 @@ def main(page: ft.Page):
         expand=True  # ListViewが拡張されるように設定
     )
 
-    def fetch_weather(region_code, office_name):
+    # 進行中の天気情報の取得（地域が切り替わったら取り消し、最新の結果だけを表示する）
+    fetch_task = None
+
+    # 表示中の地域の細分区域コード -> 日付ごとの予報
+    area_days = {}
+
+    def cancel_fetch():
+        """進行中の天気情報の取得を取り消す"""
+        nonlocal fetch_task
+        if fetch_task is not None and not fetch_task.done():
+            fetch_task.cancel()
+        fetch_task = None
+
+    def reset_areas():
+        """細分区域の選択と、保持している予報を消す"""
+        nonlocal area_days
+        area_days = {}
+        area_dropdown.options = []
+        area_dropdown.value = None
+        area_dropdown.disabled = True
+
+    def show_area(area_code):
+        """保持している細分区域の予報を表示する（通信も再解析もしない）"""
+        daily_data = dict(area_days.get(area_code, []))
+
+        # 各日の表示内容をまとめる
+        # アイコンが未確認の天気コード -> そのアイコンを表示する日付のリスト
+        pending_dates = defaultdict(list)
+        days = []
+        for date in sorted(daily_data.keys()):
+            day_info = daily_data[date]
+            
+            weather_code = day_info.get('weather_code', 'unknown')
+            
+            # ローカルに保存済みのアイコンを使い、保存されていない天気コードは保存済みの代替アイコン
+            # （prefetch_icons が必ず保存する unknown）にする。アイコンを保存していない場合だけ、
+            # 確認済みのURL、未確認ならひとまず天気コードのアイコンを表示する
+            icon_url = (icon_store.src(weather_code) or icon_store.src('unknown')
+                        or icon_resolver.cached(weather_code))
+
+            if icon_url is None:
+                pending_dates[weather_code].append(date)
+            days.append((date, {**day_info, 'date': date,
+                                'icon_src': icon_url or icon_resolver.icon_url.format(weather_code)}))
+
+        # 日付ごとのカードを使い回し、前回の表示から変わった部分だけを更新する
+        day_cards.sync(days)
+        weather_list.update()
+
+        # 未確認のアイコンはバックグラウンドでまとめて確認し、確認できたものから差し替える
+        def set_icons(weather_code, url, icons):
+            for icon in icons:
+                # カードは使い回すため、すでに別の天気を表示している場合は書き換えない
+                if icon.src == icon_resolver.icon_url.format(weather_code) and icon.src != url:
+                    icon.src = url
+                    print(f"Fallback icon used for weather code {weather_code}")
+                    try:
+                        icon.update()
+                    except Exception:
+                        pass  # すでに別の地域の表示に切り替わっている
+
+        for weather_code, dates in pending_dates.items():
+            icons = [day_cards.views[date].icon for date in dates]
+            icon_resolver.resolve_async(
+                weather_code, lambda code, url, icons=icons: set_icons(code, url, icons))
+
+    async def fetch_weather(region_code, office_name):
+        nonlocal area_days
         url = API_BASE_URL.format(region_code)
         print(f"Fetching weather data from URL: {url}")  # デバッグ
 
@@ -91,202 +158,33 @@ def main(page: ft.Page):
         page.update()
 
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
+            # 期限内の予報が保存されていればそれを使い、なければ取得する
+            # （通信は別スレッドで行い、その間もUIを操作できるようにする）
+            try:
+                data = await asyncio.to_thread(forecast_cache.get, region_code)
+                status_code = 200
+            except FetchError as ex:
+                status_code, data = ex.status_code, None
+            if status_code in (200, 304):
                 if not data:
                     raise ValueError("APIからのデータが空です。")
                 
-                # 最初のレポートを使用
-                report = data[0]
-                time_series_list = report.get('timeSeries', [])
-                if not time_series_list:
+                # すべての地域の予報を列形式にまとめる
+                frame = ForecastFrame(data)
+                if not frame.short_term:
                     raise ValueError("timeSeries データが見つかりません。")
-                
-                # 各timeSeriesをタイプ別に分類
-                weather_ts = None
-                pops_ts = None
-                temps_ts = None
-
-                # 天気コードのタイムシリーズを取得
-                weather_codes_ts = None
-
-                for ts in time_series_list:
-                    areas = ts.get('areas', [])
-                    if not areas:
-                        continue
-                    # 天気関連のキーが存在するか確認
-                    if 'weathers' in areas[0]:
-                        weather_ts = ts
-                    elif 'pops' in areas[0]:
-                        pops_ts = ts
-                    elif 'temps' in areas[0]:
-                        temps_ts = ts
-                    elif 'weatherCodes' in areas[0]:  # 天気コードのキーがある場合
-                        weather_codes_ts = ts
-
-                if not weather_ts or not pops_ts:
+                if not frame.get('weather') or not frame.get('pops'):
                     raise ValueError("必要なtimeSeriesデータが不足しています。")
 
-                # データ取得関数の定義
-                def get_first_area_data(ts, key):
-                    areas = ts.get('areas', [])
-                    if not areas:
-                        return []
-                    area = areas[0]  # 最初のareaを取得
-                    print(f"Processing area: {area['area']['name']}")  # デバッグ
-                    return area.get(key, [])
-
-                # 気温データはtimeSeries内の別のオブジェクトに存在する場合がある
-                temps_times = []
-                temps = []
-                if temps_ts:
-                    temps_times = temps_ts.get('timeDefines', [])
-                    temps = get_first_area_data(temps_ts, 'temps')
-
-                # 時間定義の取得
-                weather_times = weather_ts.get('timeDefines', [])
-                pops_times = pops_ts.get('timeDefines', [])
-
-                weathers = get_first_area_data(weather_ts, 'weathers')
-                winds = get_first_area_data(weather_ts, 'winds')
-                waves = get_first_area_data(weather_ts, 'waves')
-                pops = get_first_area_data(pops_ts, 'pops')
-
-                # 天気コードの取得
-                # 天気コードを取得する部分を修正
-                if weather_ts:
-                    areas = weather_ts.get('areas', [])
-                    if areas:
-                        # 最初のエリアから天気コードを取得
-                        weather_codes = areas[0].get('weatherCodes', [])
-                    else:
-                        weather_codes = ["unknown"] * len(weathers)
-                else:
-                    weather_codes = ["unknown"] * len(weathers)
-
-                # 日付をキーとする辞書にデータを統合
-                daily_data = defaultdict(dict)
-
-                # Helper function to extract date string
-                def extract_date(time_str):
-                    return datetime.fromisoformat(time_str).strftime("%Y-%m-%d")
-
-                # 天気、風、波のデータを統合
-                for i, time_define in enumerate(weather_times):
-                    date = extract_date(time_define)
-                    daily_data[date]['description'] = weathers[i] if i < len(weathers) else "データなし"
-                    daily_data[date]['wind'] = winds[i] if i < len(winds) else "データなし"
-                    daily_data[date]['wave'] = waves[i] if i < len(waves) else "データなし"
-                    daily_data[date]['weather_code'] = weather_codes[i] if i < len(weather_codes) else "unknown"
-
-                # 降水確率のデータを統合
-                for i, time_define in enumerate(pops_times):
-                    date = extract_date(time_define)
-                    daily_data[date]['pop'] = pops[i] if i < len(pops) else "データなし"
-
-                # 気温のデータを統合（存在する場合）
-                for i, time_define in enumerate(temps_times):
-                    date = extract_date(time_define)
-                    daily_data[date]['temp'] = temps[i] if i < len(temps) else "データなし"
-
-                # UIをクリア
-                weather_list.controls.clear()
-
-                # 各日のデータをリストビューに追加
-                for date in sorted(daily_data.keys()):
-                    day_info = daily_data[date]
-                    
-                    weather_code = day_info.get('weather_code', 'unknown')
-                    
-                    # PNG形式に変更
-                    icon_url = f"https://www.jma.go.jp/bosai/forecast/img/{weather_code}.png"
-                    fallback_icon_url = "https://www.jma.go.jp/bosai/forecast/img/unknown.png"
-
-                    # デバッグ用にURLを表示
-                    print(f"Date: {date}, Weather Code: {weather_code}, Icon URL: {icon_url}")
-
-                    # アイコンを表示するImageコンポーネント
-                    weather_icon = ft.Image(
-                        src=icon_url,
-                        width=100,
-                        height=100,
-                        fit=ft.ImageFit.CONTAIN,
-                    )
-
-                    # 有効な画像か確認するための関数
-                    def is_valid_image(url):
-                        try:
-                            head = requests.head(url)
-                            return head.status_code == 200
-                        except:
-                            return False
-
-                    if not is_valid_image(icon_url):
-                        icon_url = fallback_icon_url
-                        weather_icon.src = icon_url  # 代替画像を設定
-                        print(f"Fallback icon used for date {date}")
-
-                    # 天気内容を表示するTextコンポーネント
-                    weather_description = ft.Text(
-                        value=f"天気: {day_info.get('description', 'データなし')}",
-                        size=16
-                    )
-
-                    # 天気アイコンと天気説明を左右に配置
-                    weather_row = ft.Row(
-                        controls=[
-                            weather_description,
-                            weather_icon
-                        ],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,  # 左右に配置
-                        vertical_alignment=ft.CrossAxisAlignment.CENTER,
-                        spacing=10
-                    )
-
-                    # その他の天気情報（風、波、降水確率、気温）をテキストで表示
-                    wind_text = ft.Text(
-                        value=f"風: {day_info.get('wind', 'データなし')}",
-                        size=16
-                    )
-                    wave_text = ft.Text(
-                        value=f"波: {day_info.get('wave', 'データなし')}",
-                        size=16
-                    )
-                    pop_text = ft.Text(
-                        value=f"降水確率: {day_info.get('pop', 'データなし')}%",
-                        size=16
-                    )
-                    temp_text = ft.Text(
-                        value=f"気温: {day_info.get('temp', 'データなし')}°C",
-                        size=16
-                    )
-
-                    # Card内に表示するコンテンツを配置
-                    card_content = ft.Container(
-                        padding=10,
-                        content=ft.Column([
-                            ft.Text(value=f"日付: {date}", size=18, weight="bold"),
-                            weather_row,
-                            wind_text,
-                            wave_text,
-                            pop_text,
-                            temp_text,
-                        ])
-                    )
-
-                    # Cardコンポーネントにコンテンツを設定
-                    item = ft.Card(
-                        content=card_content
-                    )
-                    weather_list.controls.append(item)
-
-                # デバッグ用にデータを出力
-                print(f"Fetched weather data for {office_name}:")
-                for date in sorted(daily_data.keys()):
-                    print(date, daily_data[date])
-
-                weather_list.update()
+                # すべての細分区域を日付ごとにまとめて保持し、細分区域の切り替えは再取得せずに表示する
+                area_days = frame.daily_by_area()
+                area_dropdown.options = [ft.dropdown.Option(key=code, text=name)
+                                         for code, name in frame.areas('weather')]
+                area_dropdown.value = next(iter(area_days), None)
+                area_dropdown.disabled = not area_days
+                print(f"Fetched weather data for {office_name}: {len(area_days)} areas")  # デバッグ
+                show_area(area_dropdown.value)
+                page.update()
 
             else:
                 # エラーメッセージの表示
@@ -297,7 +195,7 @@ def main(page: ft.Page):
                         padding=10,
                         content=ft.Column([
                             ft.Text(value="天気情報の取得に失敗しました。", size=20, color=ft.colors.RED),
-                            ft.Text(value=f"ステータスコード: {response.status_code}", size=16)
+                            ft.Text(value=f"ステータスコード: {status_code}", size=16)
                         ])
                     )
                 )
@@ -320,16 +218,24 @@ def main(page: ft.Page):
             weather_list.update()
             print(f"Exception occurred: {ex}")  # デバッグ
         finally:
-            # ローディングインディケータを非表示
-            loading_indicator.visible = False
-            page.update()
+            # ローディングインディケータを非表示（取り消された場合は次の取得に任せる）
+            if asyncio.current_task() is fetch_task:
+                loading_indicator.visible = False
+                page.update()
+
+    async def on_center_change(e):
+        # 表示しようとしていた地域の取得は不要になる
+        cancel_fetch()
+        loading_indicator.visible = False
+        reset_areas()
 
-    def on_center_change(e):
         selected_center = center_dropdown.value
         if selected_center:
             # オフィスドロップダウンを更新
-            offices_list = CENTER_TO_OFFICES.get(selected_center, [])
-            office_dropdown.options = [ft.dropdown.Option(office) for office in offices_list]
+            offices_list = areas.children(selected_center, 'centers')
+            office_dropdown.options = [ft.dropdown.Option(key=code, text=name) for code, name in offices_list]
+            # 選択されそうな地域の予報をバックグラウンドで先読みする
+            forecast_cache.prefetch([code for code, _ in offices_list])
             office_dropdown.value = None  # 選択をリセット
             office_dropdown.disabled = False  # 有効にする
         else:
@@ -343,12 +249,21 @@ def main(page: ft.Page):
         weather_list.update()
         page.update()
 
-    def on_office_change(e):
-        selected_office = office_dropdown.value
-        if selected_office:
-            office_code = OFFICE_CODES.get(selected_office)
-            if office_code:
-                fetch_weather(office_code, selected_office)
+    async def on_office_change(e):
+        nonlocal fetch_task
+        # 前に選択した地域の取得がまだ終わっていなければ取り消す
+        cancel_fetch()
+        loading_indicator.visible = False
+        reset_areas()
+
+        office_code = office_dropdown.value
+        if office_code:
+            try:
+                selected_office = areas.name(office_code, 'offices')
+            except KeyError:
+                selected_office = None
+            if selected_office:
+                fetch_task = asyncio.create_task(fetch_weather(office_code, selected_office))
             else:
                 city_text.value = "エラー"
                 weather_list.controls.clear()
@@ -361,16 +276,21 @@ def main(page: ft.Page):
                     )
                 )
                 weather_list.controls.append(error_card)
-                weather_list.update()
+                page.update()
         else:
             city_text.value = "地域を選択して天気を確認してください。"
             weather_list.controls.clear()
-            weather_list.update()
+            page.update()
+
+    async def on_area_change(e):
+        # 取得済みの予報から表示するため、通信しない
+        show_area(area_dropdown.value)
+        page.update()
 
     # センタードロップダウンを作成
     center_dropdown = ft.Dropdown(
         label="地方を選択",
-        options=[ft.dropdown.Option(center) for center in CENTER_CODES.keys()],
+        options=[ft.dropdown.Option(key=code, text=name) for code, name in areas.entries('centers')],
         width=300,
         on_change=on_center_change,
     )
@@ -384,6 +304,15 @@ def main(page: ft.Page):
         disabled=True  # センターが選択されるまで無効
     )
 
+    # 細分区域ドロップダウンを作成（地域の予報を取得するまで無効）
+    area_dropdown = ft.Dropdown(
+        label="細分区域を選択",
+        options=[],
+        width=200,
+        on_change=on_area_change,
+        disabled=True
+    )
+
     # ローディングインディケータを配置
     loading_view = ft.Row(
         controls=[loading_indicator],
@@ -395,7 +324,8 @@ def main(page: ft.Page):
         controls=[
             center_dropdown,
             ft.Container(width=20),  # ドロップダウン間のスペース
-            office_dropdown
+            office_dropdown,
+            area_dropdown
         ],
         alignment=ft.MainAxisAlignment.START,
         vertical_alignment=ft.CrossAxisAlignment.CENTER,
@@ -411,4 +341,4 @@ def main(page: ft.Page):
     )
 
 # Fletアプリケーションを実行
-ft.app(target=main)
\ No newline at end of file
+ft.app(target=main, assets_dir=ASSETS_DIR)
\ No newline at end of file
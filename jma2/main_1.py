@@ -1,11 +1,204 @@
 import flet as ft
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from area_index import load_area_index
+from weather_view import KeyedList, ForecastRowView
+from weather_db_v2 import SCHEMA_VERSION, schema_version
+
+# 特定のエリアの最新の発表の天気予報（取り込み時に作る current_forecasts を主キーの範囲で読むだけ）。
+# 対象時刻は表示用の文字列（YYYY-MM-DD HH:MM）にして返す
+# （時刻の文字列は現地時刻の ISO 8601 のため、先頭の日付と時刻を切り出せばよい）
+CURRENT_SQL = """
+    SELECT
+        substr(target_datetime, 1, 10) || ' ' || substr(target_datetime, 12, 5),
+        weather_text,
+        wind_text,
+        probability,
+        temperature
+    FROM current_forecasts
+    WHERE area_code = ?
+    ORDER BY target_datetime
+    LIMIT 10
+"""
+
+# current_forecasts がない（または取り込み前の）データベース用に、履歴のテーブルを結合して求める天気予報
+FORECAST_SQL = """
+    SELECT 
+        substr(w.target_datetime, 1, 10) || ' ' || substr(w.target_datetime, 12, 5),
+        w.weather_text,
+        w.wind_text,
+        p.probability,
+        t.temperature
+    FROM weather_forecasts w
+    LEFT JOIN precipitation_probability_forecasts p 
+        ON w.area_code = p.area_code 
+        AND w.report_datetime = p.report_datetime
+        AND w.target_datetime = p.target_datetime
+    LEFT JOIN temperature_forecasts t 
+        ON w.area_code = t.area_code 
+        AND w.report_datetime = t.report_datetime
+        AND w.target_datetime = t.target_datetime
+    WHERE w.area_code = ?
+    ORDER BY w.target_datetime
+    LIMIT 10
+"""
+
+# v2 のスキーマ（weather_db_v2.py）の場合の CURRENT_SQL / FORECAST_SQL。
+# 時刻はUNIX時刻の整数のため、日本時間にずらして表示用の文字列にする
+CURRENT_SQL_V2 = """
+    SELECT
+        strftime('%Y-%m-%d %H:%M', target_time, 'unixepoch', '+9 hours'),
+        weather_text,
+        wind_text,
+        probability,
+        temperature
+    FROM current_forecasts
+    WHERE area_code = ?
+    ORDER BY target_time
+    LIMIT 10
+"""
+
+FORECAST_SQL_V2 = """
+    SELECT
+        strftime('%Y-%m-%d %H:%M', w.target_time, 'unixepoch', '+9 hours'),
+        weather_text.text,
+        wind_text.text,
+        p.probability,
+        t.temperature
+    FROM areas a
+    JOIN weather_forecasts w ON w.area_id = a.id
+    LEFT JOIN texts weather_text ON weather_text.id = w.weather_text_id
+    LEFT JOIN texts wind_text ON wind_text.id = w.wind_text_id
+    LEFT JOIN precipitation_probability_forecasts p
+        ON w.area_id = p.area_id
+        AND w.target_time = p.target_time
+        AND w.report_time = p.report_time
+    LEFT JOIN temperature_forecasts t
+        ON w.area_id = t.area_id
+        AND w.target_time = t.target_time
+        AND w.report_time = t.report_time
+    WHERE a.code = ?
+    ORDER BY w.target_time
+    LIMIT 10
+"""
+
+# get_weather_forecast が返す予報の発表時刻（HTTPサービスのキャッシュの検証に使う）
+CURRENT_VERSION_SQL = "SELECT MAX(report_datetime) FROM current_forecasts WHERE area_code = ?"
+FORECAST_VERSION_SQL = "SELECT MAX(report_datetime) FROM weather_forecasts WHERE area_code = ?"
+CURRENT_VERSION_SQL_V2 = "SELECT MAX(report_time) FROM current_forecasts WHERE area_code = ?"
+FORECAST_VERSION_SQL_V2 = """
+    SELECT MAX(w.report_time)
+    FROM areas a
+    JOIN weather_forecasts w ON w.area_id = a.id
+    WHERE a.code = ?
+"""
+
+# weather.db に対してアプリが実行するクエリ（名前, SQL, 実行計画の確認に使う引数）をスキーマのバージョンごとに。
+# 地方・都道府県の一覧は AreaIndex から引くため、SQLは実行しない
+APP_QUERIES = [
+    ('get_weather_forecast', CURRENT_SQL, ('130010',)),
+    ('get_weather_forecast（履歴から）', FORECAST_SQL, ('130010',)),
+    ('get_report_version', CURRENT_VERSION_SQL, ('130010',)),
+    ('get_report_version（履歴から）', FORECAST_VERSION_SQL, ('130010',)),
+]
+APP_QUERIES_V2 = [
+    ('get_weather_forecast', CURRENT_SQL_V2, ('130010',)),
+    ('get_weather_forecast（履歴から）', FORECAST_SQL_V2, ('130010',)),
+    ('get_report_version', CURRENT_VERSION_SQL_V2, ('130010',)),
+    ('get_report_version（履歴から）', FORECAST_VERSION_SQL_V2, ('130010',)),
+]
+
+class ConnectionPool:
+    """
+    読み取り専用のSQLite接続を使い回すための小さなプール。
+    接続ごとにコンパイル済みのSQL文がキャッシュされるため、同じクエリを繰り返し実行しても
+    接続・スキーマ読み込み・SQLのコンパイルのコストがかかりません。
+    Fletのイベントは別スレッドから呼ばれるため、1つの接続を同時に使うのは1スレッドだけにします。
+
+    :param db_path: データベースファイルのパス
+    :param size: 最大の接続数
+    :param cached_statements: 接続ごとにキャッシュするSQL文の数
+    """
+    def __init__(self, db_path, size=4, cached_statements=128):
+        self.uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        self.size = size
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def _connect(self):
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+
+    @contextmanager
+    def connection(self):
+        """プールから接続を借り、使い終わったら返す"""
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                # すべての接続が使用中なら返却を待つ
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        """使用中でない接続をすべて閉じる"""
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
 
 class WeatherApp:
-    def __init__(self, weather_db='/Users/marina/Lecture/DS-Programming2/jma2/weather.db', area_db='/Users/marina/Lecture/DS-Programming2/jma2/area.db'):
+    def __init__(self, weather_db='/Users/marina/Lecture/DS-Programming2/jma2/weather.db', area_db='/Users/marina/Lecture/DS-Programming2/jma2/area.db', pool_size=4):
         self.weather_db = weather_db
         self.area_db = area_db
+        self.weather_pool = ConnectionPool(weather_db, pool_size)
+        # weather.db のスキーマに合わせてクエリを選ぶ
+        try:
+            with self.weather_pool.connection() as conn:
+                self.schema_version = schema_version(conn)
+                self.has_current = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'current_forecasts'").fetchone() is not None
+        except sqlite3.Error as e:
+            print(f"データベースエラー: {e}")
+            self.schema_version = 0
+            self.has_current = False
+        app_queries = APP_QUERIES_V2 if self.schema_version == SCHEMA_VERSION else APP_QUERIES
+        sql = {name: query for name, query, _ in app_queries}
+        if self.has_current:
+            self.app_queries = app_queries
+            self.current_sql = sql['get_weather_forecast']
+            self.current_version_sql = sql['get_report_version']
+        else:
+            # current_forecasts を読むクエリは使わず、履歴のテーブルから求める
+            self.app_queries = [query for query in app_queries if query[0].endswith('（履歴から）')]
+            self.current_sql = self.current_version_sql = None
+        self.forecast_sql = sql['get_weather_forecast（履歴から）']
+        self.forecast_version_sql = sql['get_report_version（履歴から）']
+        # エリア階層は一度だけ読み込み、プロセス内で共有する
+        self.areas = load_area_index(area_db)
 
     def connect_weather_db(self):
         return sqlite3.connect(self.weather_db)
@@ -13,72 +206,71 @@ class WeatherApp:
     def connect_area_db(self):
         return sqlite3.connect(self.area_db)
 
-    def get_regions(self):
-        """地方の一覧を取得"""
-        conn = self.connect_area_db()
-        cursor = conn.cursor()
+    def query(self, pool, sql, params=()):
+        """プールの接続でクエリを実行し、結果の行を返す"""
         try:
-            cursor.execute("""
-                SELECT Code, Name 
-                FROM area 
-                WHERE Level = 'centers'
-                ORDER BY ID
-            """)
-            return cursor.fetchall()
+            with pool.connection() as conn:
+                return conn.execute(sql, params).fetchall()
         except sqlite3.Error as e:
             print(f"データベースエラー: {e}")
             return []
-        finally:
-            conn.close()
+
+    def get_regions(self):
+        """地方の一覧を取得"""
+        return self.areas.entries('centers')
 
     def get_prefectures(self, region_code):
         """選択された地方に属する都道府県の一覧を取得"""
-        conn = self.connect_area_db()
-        cursor = conn.cursor()
         try:
-            cursor.execute("""
-                SELECT Code, Name 
-                FROM area 
-                WHERE Level = 'offices' 
-                AND parent = ?
-                ORDER BY ID
-            """, (region_code,))
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            print(f"データベースエラー: {e}")
+            children = self.areas.children(region_code, 'centers')
+        except KeyError:
             return []
-        finally:
-            conn.close()
+        return [(code, name) for code, name in children if 'offices' in self.areas.levels(code)]
 
     def get_weather_forecast(self, area_code):
-        """weather.dbから特定のエリアの天気予報を取得"""
-        conn = self.connect_weather_db()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("""
-                SELECT 
-                    w.target_datetime,
-                    w.weather_text,
-                    w.wind_text,
-                    p.probability,
-                    t.temperature
-                FROM weather_forecasts w
-                LEFT JOIN precipitation_probability_forecasts p 
-                    ON w.area_code = p.area_code 
-                    AND w.target_datetime = p.target_datetime
-                LEFT JOIN temperature_forecasts t 
-                    ON w.area_code = t.area_code 
-                    AND w.target_datetime = t.target_datetime
-                WHERE w.area_code = ?
-                ORDER BY w.target_datetime
-                LIMIT 10
-            """, (area_code,))
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            print(f"データベースエラー: {e}")
-            return []
-        finally:
-            conn.close()
+        """
+        weather.dbから特定のエリアの最新の発表の天気予報を取得
+        （current_forecasts にまだ行がないエリアは、履歴のテーブルから求める）
+        """
+        if self.current_sql:
+            rows = self.query(self.weather_pool, self.current_sql, (area_code,))
+            if rows:
+                return rows
+        return self.query(self.weather_pool, self.forecast_sql, (area_code,))
+
+    def get_report_version(self, area_code):
+        """get_weather_forecast が返す予報の発表時刻を取得（予報がなければ None）"""
+        for sql in (self.current_version_sql, self.forecast_version_sql):
+            if sql:
+                rows = self.query(self.weather_pool, sql, (area_code,))
+                if rows and rows[0][0] is not None:
+                    return rows[0][0]
+        return None
+
+    def close(self):
+        """プールの接続を閉じる"""
+        self.weather_pool.close()
+
+    def explain_query_plans(self):
+        """アプリの各クエリの EXPLAIN QUERY PLAN の結果を {名前: [detail, ...]} で返す"""
+        plans = {}
+        for name, sql, params in self.app_queries:
+            with self.weather_pool.connection() as conn:
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            plans[name] = [row[-1] for row in rows]
+        return plans
+
+    def find_full_scans(self):
+        """
+        テーブルやインデックスを先頭から走査するクエリを [(名前, detail), ...] で返す。
+        "SCAN テーブル USING (COVERING) INDEX ..." もインデックス全体の走査のため含め、SEARCH だけを許す
+        """
+        full_scans = []
+        for name, details in self.explain_query_plans().items():
+            for detail in details:
+                if detail.split()[0] == 'SCAN':
+                    full_scans.append((name, detail))
+        return full_scans
 
 def main(page: ft.Page):
     page.title = "天気情報アプリ"
@@ -102,6 +294,9 @@ def main(page: ft.Page):
         horizontal_lines=ft.border.BorderSide(1, "grey"),
     )
 
+    # 日時ごとの行（検索のたびに作り直さず、変わったセルだけを更新する）
+    forecast_rows = KeyedList(weather_table, 'rows', ForecastRowView)
+
     # 都道府県選択用ドロップダウン
     prefecture_dd = ft.Dropdown(
         width=400,
@@ -125,10 +320,10 @@ def main(page: ft.Page):
         page.update()
 
     def search_weather(e):
-        # テーブルの行をクリア
-        weather_table.rows.clear()
-        
         if not prefecture_dd.value:
+            # テーブルの行をクリア
+            forecast_rows.clear()
+            page.update()
             page.show_snack_bar(ft.SnackBar(content=ft.Text("都道府県を選択してください")))
             return
         
@@ -138,25 +333,23 @@ def main(page: ft.Page):
         forecasts = app.get_weather_forecast(prefecture_dd.value)
         
         if not forecasts:
+            forecast_rows.clear()
+            page.update()
             page.show_snack_bar(ft.SnackBar(content=ft.Text("データが見つかりませんでした")))
             return
 
-        # テーブルに天気予報データを追加
+        # 天気予報データをテーブルに反映（行は日時ごとに使い回す。日時はSQLで表示用の文字列にしてある）
+        rows = []
         for forecast in forecasts:
-            target_time = datetime.fromisoformat(forecast[0].replace('Z', '+00:00'))
-            weather_table.rows.append(
-                ft.DataRow(
-                    cells=[
-                        ft.DataCell(ft.Text(target_time.strftime('%Y-%m-%d %H:%M'))),
-                        ft.DataCell(ft.Text(forecast[1] if forecast[1] else "-")),
-                        ft.DataCell(ft.Text(forecast[2] if forecast[2] else "-")),
-                        ft.DataCell(ft.Text(f"{forecast[3]}%" if forecast[3] else "-")),
-                        ft.DataCell(ft.Text(f"{forecast[4]}℃" if forecast[4] else "-")),
-                    ]
-                )
-            )
-        
-        page.update()
+            rows.append((forecast[0], (
+                forecast[0],
+                forecast[1] if forecast[1] else "-",
+                forecast[2] if forecast[2] else "-",
+                f"{forecast[3]}%" if forecast[3] else "-",
+                f"{forecast[4]}℃" if forecast[4] else "-",
+            )))
+        if forecast_rows.sync(rows):
+            page.update()
 
     # 地方選択用ドロップダウン
     regions = app.get_regions()
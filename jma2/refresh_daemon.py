@@ -0,0 +1,332 @@
+import random
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from create_weather_db import (API_BASE_URL, DEFAULT_AREA_CSV, NOT_MODIFIED, create_database,
+                               fetch_all_weather_data, get_forecast_codes, get_report_version,
+                               insert_data_from_json, is_ingested, load_cached_weather_data,
+                               load_watermarks)
+from history_store import JST
+from http_cache import HTTPCache
+
+# JMAの府県天気予報の定時の発表時刻（時, 日本時間）。週間天気予報は 11時・17時に発表される
+PUBLISH_HOURS = (5, 11, 17)
+
+def next_publish_time(after, hours=PUBLISH_HOURS):
+    """after より後の最初の定時の発表時刻（日本時間の datetime）を返す"""
+    after = after.astimezone(JST)
+    day = after.replace(hour=0, minute=0, second=0, microsecond=0)
+    for days in range(2):
+        for hour in hours:
+            moment = day + timedelta(days=days, hours=hour)
+            if moment > after:
+                return moment
+    raise ValueError("発表時刻がありません")
+
+class OfficeState:
+    """RefreshDaemon が office ごとに保持する取り込みの状態"""
+    __slots__ = ('code', 'report_time', 'ingested_at', 'next_poll', 'failures',
+                 'polls', 'ingested', 'unchanged', 'errors')
+
+    def __init__(self, code, report_time=None, ingested_at=None, next_poll=None):
+        self.code = code
+        # 取り込み済みの最新の発表時刻と、それを取り込んだ時刻
+        self.report_time = report_time
+        self.ingested_at = ingested_at
+        self.next_poll = next_poll
+        # 新しい発表を取り込めなかった連続の回数（バックオフに使う）
+        self.failures = 0
+        self.polls = 0
+        self.ingested = 0
+        self.unchanged = 0
+        self.errors = 0
+
+class RefreshDaemon:
+    """
+    JMAの発表時刻に合わせて、次の発表が出ているはずの office の予報だけを取得し、
+    insert_data_from_json で weather.db に取り込み続けるデーモン。
+    各 office は取り込み済みの発表時刻の次の定時（PUBLISH_HOURS）から publish_delay 秒後に取得し、
+    取得の時刻は 0〜jitter 秒ずらして、すべての office が同時に取得しないようにします。
+    発表がまだ出ていない・取得に失敗した場合は retry_interval 秒から倍々に（max_backoff 秒まで）間隔を空けて取得し直し、
+    定時以外の発表も取り込めるよう、最後の取得から max_interval 秒たった office は定時を待たずに取得します。
+
+    :param office_codes: 取得する office コードのリスト
+    :param db_name: 取り込む weather.db のパス
+    :param base_url: APIのURLテンプレート
+    :param workers: 同時に取得するワーカー数
+    :param rate: 1ホストあたりの1秒間の最大リクエスト数
+    :param cache_dir: 条件付きGETのキャッシュを保存するディレクトリ（None なら使わない）。
+                      他のクライアントの取得で304が返らないよう、デーモン専用のディレクトリにする
+    :param publish_delay: 定時から取得を始めるまでの秒数
+    :param jitter: 取得の時刻をずらす最大の秒数
+    :param retry_interval: 取得し直すまでの最初の間隔（秒）
+    :param max_backoff: 取得し直すまでの最大の間隔（秒）
+    :param max_interval: 定時を待たずに取得するまでの最大の間隔（秒）
+    :param timeout: 1回の取得のタイムアウト（秒）
+    """
+    def __init__(self, office_codes, db_name='weather.db', base_url=API_BASE_URL, workers=4, rate=2,
+                 cache_dir='refresh_http_cache', publish_delay=120, jitter=60, retry_interval=120, max_backoff=1800,
+                 max_interval=3 * 3600, timeout=10):
+        self.db_name = db_name
+        self.base_url = base_url
+        self.workers = workers
+        self.rate = rate
+        self.http_cache = HTTPCache(cache_dir) if cache_dir else None
+        self.publish_delay = publish_delay
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.offices = {code: OfficeState(code) for code in office_codes}
+
+    def load_state(self, now=None):
+        """weather.db の取り込み済みの発表時刻（ingest_watermarks）から、各 office の次の取得時刻を決める"""
+        now = (now or datetime.now(JST)).astimezone(JST)
+        create_database(self.db_name)
+        conn = sqlite3.connect(self.db_name)
+        try:
+            watermarks = load_watermarks(conn.cursor())
+            ingested_at = dict(conn.execute("SELECT office_code, ingested_at FROM ingest_watermarks"))
+        except sqlite3.Error as e:
+            print(f"データベースエラー: {e}")
+            watermarks, ingested_at = {}, {}
+        finally:
+            conn.close()
+        with self.lock:
+            for code, state in self.offices.items():
+                report, _ = watermarks.get(code, (None, None))
+                if report:
+                    state.report_time = datetime.fromisoformat(report)
+                    state.ingested_at = datetime.fromisoformat(ingested_at[code])
+                self._schedule(state, now)
+
+    def _backoff(self, failures):
+        return min(self.retry_interval * 2 ** max(failures - 1, 0), self.max_backoff)
+
+    def _schedule(self, state, now, last_poll=None):
+        """次の取得時刻を決める（last_poll は最後に取得した時刻、起動時は None）。lock を取得して呼ぶ"""
+        if state.report_time is None:
+            # まだ取り込んでいない office はすぐに取得する
+            due = now if state.failures == 0 else now + timedelta(seconds=self._backoff(state.failures))
+        else:
+            expected = next_publish_time(state.report_time) + timedelta(seconds=self.publish_delay)
+            if expected > now:
+                due = min(expected, (last_poll or now) + timedelta(seconds=self.max_interval))
+            elif last_poll is None:
+                # 起動時に次の発表の時刻を過ぎていれば、すぐに取得する
+                due = now
+            else:
+                # 次の発表がまだ出ていない（または取得に失敗した）
+                due = now + timedelta(seconds=self._backoff(state.failures))
+        state.next_poll = due + timedelta(seconds=random.uniform(0, self.jitter))
+
+    def due_offices(self, now=None):
+        """取得時刻を過ぎた office コードを、取得時刻の早い順に返す"""
+        now = (now or datetime.now(JST)).astimezone(JST)
+        with self.lock:
+            due = [state for state in self.offices.values() if state.next_poll and state.next_poll <= now]
+        return [state.code for state in sorted(due, key=lambda state: state.next_poll)]
+
+    def poll(self, now=None):
+        """
+        取得時刻を過ぎた office の予報を取得して取り込み、次の取得時刻を決めます。
+
+        :return: {'ingested': [...], 'unchanged': [...], 'failed': [...]}（office コードのリスト）
+        """
+        result = {'ingested': [], 'unchanged': [], 'failed': []}
+        codes = self.due_offices(now)
+        if not codes:
+            return result
+        for code, data in fetch_all_weather_data(codes, self.workers, self.rate, self.base_url,
+                                                 self.timeout, self.http_cache):
+            fetched_at = (now or datetime.now(JST)).astimezone(JST)
+            with self.lock:
+                state = self.offices[code]
+                known = state.report_time
+            if data is NOT_MODIFIED:
+                # 304 はキャッシュに本文があることしか示さないため、保存済みの本文の発表時刻を
+                # 取り込み済みの発表時刻と比べ、weather.db にまだない発表であれば取り込む
+                data = load_cached_weather_data(code, self.http_cache, self.base_url)
+            report_time = None
+            if data:
+                try:
+                    report_time = datetime.fromisoformat(get_report_version(data)[0])
+                except (IndexError, KeyError, TypeError, ValueError) as e:
+                    print(f"エリアコード {code} の発表時刻を読み取れませんでした: {e}")
+                    data = None
+            if not data:
+                outcome = 'failed'
+            elif known and report_time <= known:
+                outcome = 'unchanged'
+            elif insert_data_from_json(data, self.db_name, office_code=code):
+                outcome = 'ingested'
+            elif is_ingested(get_report_version(data), self._watermark(code)):
+                # 他のプロセスが同じ発表をすでに取り込んでいた
+                outcome = 'unchanged'
+            else:
+                # データベースエラー（insert_data_from_json が表示する）
+                outcome = 'failed'
+            with self.lock:
+                state.polls += 1
+                if outcome == 'ingested':
+                    state.report_time = report_time
+                    state.ingested_at = fetched_at
+                    state.failures = 0
+                    state.ingested += 1
+                else:
+                    state.failures += 1
+                    if outcome == 'failed':
+                        state.errors += 1
+                    else:
+                        state.unchanged += 1
+                        if known is None or report_time > known:
+                            state.report_time = report_time
+                self._schedule(state, fetched_at, fetched_at)
+            result[outcome].append(code)
+        return result
+
+    def _watermark(self, code):
+        """ingest_watermarks の office の (report_datetime, weekly_report_datetime) を返す（なければ None）"""
+        conn = sqlite3.connect(self.db_name)
+        try:
+            return load_watermarks(conn.cursor()).get(code)
+        except sqlite3.Error as e:
+            print(f"データベースエラー: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def metrics(self, now=None):
+        """
+        office ごとの取り込みの遅れを {office コード: {...}} で返します。
+        report_age は最新の発表からの経過秒数、ingest_lag はその発表を取り込むまでにかかった秒数、
+        overdue は次の定時の発表の取り込みが遅れている秒数（遅れていなければ 0）です。
+        """
+        now = (now or datetime.now(JST)).astimezone(JST)
+        metrics = {}
+        with self.lock:
+            for code, state in self.offices.items():
+                values = {'report_age': None, 'ingest_lag': None, 'overdue': None,
+                          'next_poll': (state.next_poll - now).total_seconds() if state.next_poll else None,
+                          'failures': state.failures, 'polls': state.polls, 'ingested': state.ingested,
+                          'unchanged': state.unchanged, 'errors': state.errors}
+                if state.report_time:
+                    values['report_age'] = (now - state.report_time).total_seconds()
+                    values['overdue'] = max((now - next_publish_time(state.report_time)).total_seconds(), 0)
+                if state.report_time and state.ingested_at:
+                    values['ingest_lag'] = (state.ingested_at - state.report_time).total_seconds()
+                metrics[code] = values
+        return metrics
+
+    def render_metrics(self, now=None):
+        """metrics() をPrometheusのテキスト形式にする"""
+        lines = []
+        metrics = self.metrics(now)
+        for key, metric, kind, help_text in (
+                ('report_age', 'jma_refresh_report_age_seconds', 'gauge', "最新の発表からの経過秒数"),
+                ('ingest_lag', 'jma_refresh_ingest_lag_seconds', 'gauge', "最新の発表を取り込むまでにかかった秒数"),
+                ('overdue', 'jma_refresh_overdue_seconds', 'gauge', "次の定時の発表の取り込みが遅れている秒数"),
+                ('next_poll', 'jma_refresh_next_poll_seconds', 'gauge', "次の取得までの秒数"),
+                ('failures', 'jma_refresh_consecutive_failures', 'gauge', "新しい発表を取り込めなかった連続の回数"),
+                ('polls', 'jma_refresh_polls_total', 'counter', "取得の回数"),
+                ('ingested', 'jma_refresh_ingested_total', 'counter', "新しい発表を取り込んだ回数"),
+                ('unchanged', 'jma_refresh_unchanged_total', 'counter', "発表が更新されていなかった回数"),
+                ('errors', 'jma_refresh_errors_total', 'counter', "取得・取り込みに失敗した回数")):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for code, values in metrics.items():
+                if values[key] is not None:
+                    lines.append(f'{metric}{{office="{code}"}} {round(values[key], 3)}')
+        return '\n'.join(lines) + '\n'
+
+    def serve_metrics(self, host='127.0.0.1', port=9108):
+        """GET /metrics で render_metrics() を返すHTTPサーバーをバックグラウンドのスレッドで起動する"""
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = daemon.render_metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='refresh-metrics', daemon=True).start()
+        return server
+
+    def run(self):
+        """stop() が呼ばれるまで、次の取得時刻まで待っては poll() を繰り返す"""
+        while not self.stop_event.is_set():
+            try:
+                result = self.poll()
+                if any(result.values()):
+                    print(f"取り込み {len(result['ingested'])} 件 / 更新なし {len(result['unchanged'])} 件 / "
+                          f"失敗 {len(result['failed'])} 件")
+            except (OSError, sqlite3.Error) as e:
+                print(f"予報の更新中にエラーが発生しました: {e}")
+            with self.lock:
+                polls = [state.next_poll for state in self.offices.values() if state.next_poll]
+            wait = (min(polls) - datetime.now(JST)).total_seconds() if polls else self.max_interval
+            self.stop_event.wait(min(max(wait, 1), self.max_interval))
+
+    def start(self):
+        """run() をバックグラウンドのスレッドで実行する"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='forecast-refresh', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """更新を止める（実行中の poll() の終了を待つ）"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="JMAの発表時刻に合わせて、天気予報を weather.db に取り込み続けます")
+    parser.add_argument('--db', default='weather.db', help="取り込む weather.db")
+    parser.add_argument('--csv', default=DEFAULT_AREA_CSV, help="取得対象のエリアの一覧（area.csv）のパス")
+    parser.add_argument('--area-db', default='area.db', help="エリア階層を読み込む area.db のパス")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="APIのURLテンプレート（スタブサーバー用）")
+    parser.add_argument('--workers', type=int, default=4, help="同時に取得するワーカー数")
+    parser.add_argument('--rate', type=float, default=2, help="1ホストあたりの1秒間の最大リクエスト数")
+    parser.add_argument('--cache-dir', default='refresh_http_cache', help="条件付きGETのキャッシュを保存するディレクトリ（デーモン専用）")
+    parser.add_argument('--no-cache', action='store_true', help="条件付きGETのキャッシュを使わない")
+    parser.add_argument('--publish-delay', type=float, default=120, help="定時から取得を始めるまでの秒数")
+    parser.add_argument('--jitter', type=float, default=60, help="取得の時刻をずらす最大の秒数")
+    parser.add_argument('--retry-interval', type=float, default=120, help="取得し直すまでの最初の間隔（秒）")
+    parser.add_argument('--max-backoff', type=float, default=1800, help="取得し直すまでの最大の間隔（秒）")
+    parser.add_argument('--max-interval', type=float, default=3 * 3600, help="定時を待たずに取得するまでの最大の間隔（秒）")
+    parser.add_argument('--metrics-port', type=int, help="指定した場合は、このポートの /metrics で office ごとの遅れを公開する")
+    args = parser.parse_args()
+
+    office_codes = get_forecast_codes(args.csv, args.area_db)
+    if not office_codes:
+        parser.error("エリアコードを取得できませんでした")
+    daemon = RefreshDaemon(office_codes, args.db, args.base_url, args.workers, args.rate,
+                           None if args.no_cache else args.cache_dir, args.publish_delay, args.jitter,
+                           args.retry_interval, args.max_backoff, args.max_interval)
+    daemon.load_state()
+    if args.metrics_port is not None:
+        daemon.serve_metrics(port=args.metrics_port)
+        print(f"http://127.0.0.1:{args.metrics_port}/metrics で取り込みの遅れを公開しています")
+    print(f"{len(office_codes)} 件の予報区の更新を開始します（Ctrl+C で終了）")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
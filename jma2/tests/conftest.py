@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+# jma2 のモジュールはディレクトリ内で import し合うため、jma2 を検索パスに加える
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class ForecastServer:
+    """
+    テスト用のJMAの予報APIのスタブサーバー。
+    payloads の予報JSONをETag付きで返し、If-None-Match が一致すれば 304 を返します。
+    failures に指定したコードは、そのステータスでエラーを返します。
+    """
+    def __init__(self):
+        self.payloads = {}
+        self.failures = {}
+        # 受け取ったリクエストの (コード, ヘッダーの辞書)
+        self.requests = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                code = self.path.rsplit('/', 1)[-1].split('.')[0]
+                with server.lock:
+                    server.requests.append((code, dict(self.headers)))
+                if code in server.failures or code not in server.payloads:
+                    self.send_error(server.failures.get(code, 404))
+                    return
+                body = json.dumps(server.payloads[code], ensure_ascii=False).encode('utf-8')
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/forecast/{{}}.json'
+
+    def requested(self, code):
+        """code へのリクエストのヘッダーのリスト"""
+        with self.lock:
+            return [headers for requested, headers in self.requests if requested == code]
+
+@pytest.fixture
+def forecast_server():
+    server = ForecastServer()
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+    thread.join()
@@ -0,0 +1,57 @@
+import os
+import pytest
+from area_index import AreaIndex
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_JSON = os.path.join(JMA2_DIR, 'area.json')
+
+@pytest.fixture(scope='module')
+def in_memory():
+    return AreaIndex.from_json(AREA_JSON, stream=False)
+
+@pytest.fixture(params=['in_memory', 'snapshot'])
+def areas(request, in_memory, tmp_path):
+    if request.param == 'in_memory':
+        return in_memory
+    snapshot_file = str(tmp_path / 'area.snapshot')
+    in_memory.save_snapshot(snapshot_file)
+    return AreaIndex.open_snapshot(snapshot_file)
+
+def test_ambiguous_code_levels(areas):
+    # 011000 は地方（九州南部・奄美地方）と府県予報区・一次細分区域（宗谷地方）のコード
+    assert areas.levels('011000') == ['centers', 'offices', 'class10s']
+    assert areas.levels('130000') == ['offices']
+    assert areas.levels('999999') == []
+    assert areas.level('011000') == 'centers'
+    assert areas.name('011000') == '九州南部・奄美地方'
+    assert areas.name('011000', 'offices') == '宗谷地方'
+
+def test_office_of_prefers_offices(areas):
+    assert areas.office_of('011000') == '011000'
+    assert areas.office_of('011000', 'offices') == '011000'
+    assert areas.office_of('011000', 'class10s') == '011000'
+    assert areas.office_of('011011') == '011000'
+    assert areas.office_of('011000', 'centers') is None
+    assert areas.office_of('010100') is None
+    assert areas.office_of('999999') is None
+
+def test_ambiguous_code_hierarchy(areas):
+    assert areas.ancestors('011000') == []
+    assert areas.ancestors('011000', 'offices') == [('centers', '010100', '北海道地方')]
+    assert areas.ancestors('011011') == [('class10s', '011000', '宗谷地方'), ('offices', '011000', '宗谷地方'),
+                                         ('centers', '010100', '北海道地方')]
+    assert [code for code, _ in areas.children('011000')] == ['450000', '460040', '460100']
+    assert areas.children('011000', 'offices') == [('011000', '宗谷地方')]
+    assert '011000' in [code for code, _ in areas.children('010100')]
+
+def test_prefectures_include_ambiguous_office(tmp_path, capsys):
+    from create_weather_db import create_database
+    from main_1 import WeatherApp
+    db_name = str(tmp_path / 'weather.db')
+    create_database(db_name)
+    app = WeatherApp(db_name, AREA_JSON)
+    try:
+        assert ('011000', '宗谷地方') in app.get_prefectures('010100')
+        assert [code for code, _ in app.get_prefectures('011000')] == ['450000', '460040', '460100']
+    finally:
+        app.close()
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import pytest
+import create_area_db
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_JSON = os.path.join(JMA2_DIR, 'area.json')
+
+def read_rows(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute("SELECT * FROM area ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def index_names(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize('rebuild_indexes', [False, True])
+def test_bulk_insert_matches_streaming_insert(tmp_path, capsys, rebuild_indexes):
+    streaming_db = str(tmp_path / 'streaming.db')
+    bulk_db = str(tmp_path / 'bulk.db')
+    create_area_db.create_database(streaming_db)
+    create_area_db.insert_data_from_json(AREA_JSON, streaming_db)
+    create_area_db.create_database(bulk_db)
+    inserted = create_area_db.bulk_insert_from_json(AREA_JSON, bulk_db, rebuild_indexes)
+
+    rows = read_rows(streaming_db)
+    assert inserted == len(rows) > 0
+    assert read_rows(bulk_db) == rows
+    assert 'idx_area_level_parent' in index_names(bulk_db)
+    # 2回目は既にあるコードをすべて読み飛ばす
+    assert create_area_db.bulk_insert_from_json(AREA_JSON, bulk_db, rebuild_indexes) == 0
+    assert read_rows(bulk_db) == rows
+
+def make_existing_db(tmp_path):
+    db_name = str(tmp_path / 'area.db')
+    create_area_db.create_database(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.execute(create_area_db.INSERT_AREA_SQL, ('centers', '999999', '古い地方', None, None, None, None, None))
+    conn.commit()
+    conn.close()
+    return db_name, read_rows(db_name)
+
+def test_replace_database(tmp_path, capsys):
+    db_name, _ = make_existing_db(tmp_path)
+    assert create_area_db.replace_database(AREA_JSON, db_name)
+    rows = read_rows(db_name)
+    assert rows and '999999' not in [row[2] for row in rows]
+    assert os.listdir(tmp_path) == ['area.db']
+
+def test_replace_database_keeps_old_db_on_bad_json(tmp_path, capsys):
+    db_name, old_rows = make_existing_db(tmp_path)
+    bad_json = tmp_path / 'broken.json'
+    with open(AREA_JSON, 'r', encoding='utf-8') as f:
+        bad_json.write_text(f.read()[:5000], encoding='utf-8')
+    assert create_area_db.replace_database(str(bad_json), db_name) is False
+    assert read_rows(db_name) == old_rows
+    assert sorted(os.listdir(tmp_path)) == ['area.db', 'broken.json']
+
+def test_replace_database_removes_temp_file_on_error(tmp_path, capsys, monkeypatch):
+    db_name, old_rows = make_existing_db(tmp_path)
+
+    def fail(json_file, tmp_name, rebuild_indexes):
+        assert os.path.exists(tmp_name)
+        raise OSError("ディスクがいっぱいです")
+
+    monkeypatch.setattr(create_area_db, 'bulk_insert_from_json', fail)
+    with pytest.raises(OSError):
+        create_area_db.replace_database(AREA_JSON, db_name)
+    assert read_rows(db_name) == old_rows
+    assert os.listdir(tmp_path) == ['area.db']
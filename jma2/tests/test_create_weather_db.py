@@ -0,0 +1,153 @@
+import os
+import copy
+import time
+import sqlite3
+import pytest
+import benchmark
+from area_index import AreaIndex
+from create_weather_db import (TABLE_COLUMNS, UPSERT_SQL, INSERT_SQL, BatchWriter, create_database,
+                               create_forecast_tables, create_natural_key_indexes, extract_rows,
+                               fetch_all_weather_data, fetch_weather_data, insert_data_from_json,
+                               is_ingested, load_watermarks, select_forecast_codes)
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_DB = os.path.join(JMA2_DIR, 'area.db')
+AREA_JSON = os.path.join(JMA2_DIR, 'area.json')
+
+@pytest.fixture(scope='module')
+def offices():
+    return benchmark.load_offices(AREA_DB)
+
+def make_payload(offices, code, report_datetime=benchmark.REPORT_DATETIME):
+    name, sub_areas = offices[code]
+    return benchmark.make_forecast_payload(code, name, sub_areas, report_datetime)
+
+def test_fetch_all_matches_serial_fetch(forecast_server, offices):
+    codes = list(offices)[:12]
+    for code in codes:
+        forecast_server.payloads[code] = make_payload(offices, code)
+    forecast_server.failures = {codes[3]: 500, codes[7]: 404}
+    base_url = forecast_server.base_url
+
+    serial = [(code, fetch_weather_data(code, base_url=base_url)) for code in codes]
+    rate = 40
+    start = time.perf_counter()
+    concurrent = list(fetch_all_weather_data(codes, workers=4, rate=rate, base_url=base_url))
+    elapsed = time.perf_counter() - start
+
+    # 取得した順ではなく、渡したコードの順に同じ結果が返る
+    assert concurrent == serial
+    assert [code for code, data in concurrent if data is None] == [codes[3], codes[7]]
+    assert all(data == forecast_server.payloads[code] for code, data in concurrent if data is not None)
+    # 同じホストへのリクエストは rate 回/秒に抑えられる
+    assert elapsed >= (len(codes) - 1) / rate * 0.9
+
+def test_fetch_all_reports_unreachable_host(offices):
+    codes = list(offices)[:3]
+    # 接続できないポートでも、office を落とさずに None として返す
+    results = list(fetch_all_weather_data(codes, workers=2, rate=0, base_url='http://127.0.0.1:9/{}.json',
+                                          timeout=1))
+    assert results == [(code, None) for code in codes]
+
+@pytest.fixture(scope='module')
+def areas():
+    return AreaIndex.from_json(AREA_JSON, stream=False)
+
+def test_select_forecast_codes_keeps_ambiguous_office(areas):
+    # 011000 は地方（九州南部・奄美地方）のコードでもあるが、北海道地方の宗谷地方の府県予報区でもある
+    hokkaido = select_forecast_codes(['010100'], areas)
+    assert '011000' in hokkaido
+    assert set(hokkaido) == {code for code, _ in areas.children('010100', 'centers')}
+    all_centers = select_forecast_codes([code for code, _ in areas.entries('centers')], areas)
+    assert sorted(all_centers) == sorted(code for code, _ in areas.entries('offices'))
+    assert select_forecast_codes(['011000'], areas) == ['450000', '460040', '460100', '011000']
+    assert select_forecast_codes(['011011', '130010', '999999'], areas) == ['011000', '130000']
+
+def count_table_rows(conn):
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in TABLE_COLUMNS}
+
+def test_upsert_same_payload_twice(offices):
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    create_forecast_tables(cursor)
+    create_natural_key_indexes(cursor)
+    data = make_payload(offices, '130000')
+
+    def ingest(payload, sql=UPSERT_SQL):
+        for table, rows in extract_rows(payload, 1).items():
+            cursor.executemany(sql[table], rows)
+        conn.commit()
+
+    ingest(data)
+    counts = count_table_rows(conn)
+    assert all(counts.values())
+    ingest(data)
+    assert count_table_rows(conn) == counts
+
+    # 同じ発表の訂正は行を増やさずに値を書き換える
+    corrected = copy.deepcopy(data)
+    corrected[0]['timeSeries'][0]['areas'][0]['weathers'] = ['雪', '雪', '雪']
+    corrected[0]['timeSeries'][1]['areas'][0]['pops'] = ['', '90', '90', '90', '90', '90']
+    ingest(corrected)
+    assert count_table_rows(conn) == counts
+    area_code = corrected[0]['timeSeries'][0]['areas'][0]['area']['code']
+    assert {row[0] for row in conn.execute(
+        "SELECT weather_text FROM weather_forecasts WHERE area_code = ?", (area_code,))} == {'雪'}
+    assert [row[0] for row in conn.execute(
+        "SELECT probability FROM precipitation_probability_forecasts WHERE area_code = ? ORDER BY target_datetime",
+        (area_code,))] == [None, 90, 90, 90, 90, 90]
+
+    # 一意インデックスがあるため、upsert しない INSERT は重複を挿入できない
+    with pytest.raises(sqlite3.IntegrityError):
+        ingest(data, INSERT_SQL)
+    conn.close()
+
+def read_state(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return load_watermarks(conn.cursor()), count_table_rows(conn)
+    finally:
+        conn.close()
+
+def test_is_ingested():
+    watermark = ('2024-12-17T11:00:00+09:00', '2024-12-17T11:00:00+09:00')
+    assert is_ingested(watermark, watermark)
+    assert is_ingested(('2024-12-17T05:00:00+09:00', '2024-12-16T17:00:00+09:00'), watermark)
+    assert not is_ingested(('2024-12-17T17:00:00+09:00', '2024-12-17T11:00:00+09:00'), watermark)
+    assert not is_ingested(('2024-12-17T11:00:00+09:00', '2024-12-17T17:00:00+09:00'), watermark)
+    assert not is_ingested(watermark, None)
+    # 週間予報のない発表は短期予報の発表時刻だけで比べる
+    assert is_ingested(('2024-12-17T11:00:00+09:00', None), watermark)
+
+def test_insert_skips_equal_or_older_reports(offices, tmp_path, capsys):
+    db_name = str(tmp_path / 'weather.db')
+    create_database(db_name)
+    current = make_payload(offices, '130000', '2024-12-17T11:00:00+09:00')
+    older = make_payload(offices, '130000', '2024-12-17T05:00:00+09:00')
+    newer = make_payload(offices, '130000', '2024-12-17T17:00:00+09:00')
+
+    assert insert_data_from_json(current, db_name, office_code='130000') is True
+    watermarks, counts = read_state(db_name)
+    assert watermarks == {'130000': ('2024-12-17T11:00:00+09:00', '2024-12-17T11:00:00+09:00')}
+
+    # 同じ発表・古い発表は書き込まず、目印も戻さない
+    assert insert_data_from_json(current, db_name, office_code='130000') is False
+    assert insert_data_from_json(older, db_name, office_code='130000') is False
+    assert read_state(db_name) == (watermarks, counts)
+
+    assert insert_data_from_json(newer, db_name, office_code='130000') is True
+    watermarks, new_counts = read_state(db_name)
+    assert watermarks == {'130000': ('2024-12-17T17:00:00+09:00', '2024-12-17T17:00:00+09:00')}
+    assert new_counts['weather_forecasts'] > counts['weather_forecasts']
+
+def test_batch_writer_skips_equal_or_older_reports(offices, tmp_path, capsys):
+    db_name = str(tmp_path / 'weather.db')
+    create_database(db_name)
+    with BatchWriter(db_name) as writer:
+        assert writer.add(make_payload(offices, '130000', '2024-12-17T11:00:00+09:00'), '130000')
+    with BatchWriter(db_name) as writer:
+        assert not writer.add(make_payload(offices, '130000', '2024-12-17T11:00:00+09:00'), '130000')
+        assert not writer.add(make_payload(offices, '130000', '2024-12-17T05:00:00+09:00'), '130000')
+        assert writer.add(make_payload(offices, '130000', '2024-12-17T17:00:00+09:00'), '130000')
+        assert (writer.offices_skipped, writer.offices_written) == (2, 1)
+    assert read_state(db_name)[0]['130000'][0] == '2024-12-17T17:00:00+09:00'
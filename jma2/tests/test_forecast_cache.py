@@ -0,0 +1,99 @@
+import time
+import threading
+import pytest
+from forecast_cache import ForecastCache
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("タイムアウトしました")
+        time.sleep(0.01)
+
+def test_prefetch_failure_is_reported(capsys):
+    def fetch(code):
+        raise RuntimeError(f"{code} を取得できません")
+
+    cache = ForecastCache(fetch)
+    cache.prefetch(['130000'])
+    cache.executor.shutdown(wait=True)
+    assert "地域 130000 の先読み中にエラーが発生しました: 130000 を取得できません" in capsys.readouterr().out
+    stats = cache.stats()
+    assert (stats['errors'], stats['prefetched'], stats['size']) == (1, 0, 0)
+    # 失敗した予報は保存せず、次の get() で取得し直して例外を送出する
+    with pytest.raises(RuntimeError):
+        cache.get('130000')
+    assert cache.stats()['errors'] == 2
+
+def test_prefetch_counts_loaded_offices():
+    cache = ForecastCache(lambda code: [{'reportDatetime': '2099-01-01T00:00:00+09:00', 'code': code}])
+    cache.prefetch(['130000', '270000'])
+    cache.executor.shutdown(wait=True)
+    assert cache.stats()['prefetched'] == 2
+    assert cache.get('130000')[0]['code'] == '130000'
+    assert cache.stats()['hits'] == 1
+
+def make_fetch(report_datetime='2099-01-01T00:00:00+09:00'):
+    """地域コードごとの取得回数を数える fetch"""
+    calls = {}
+
+    def fetch(code):
+        calls[code] = calls.get(code, 0) + 1
+        return [{'reportDatetime': report_datetime, 'code': code, 'calls': calls[code]}]
+    return fetch, calls
+
+def test_expired_forecast_is_fetched_again():
+    # 発表時刻から ttl 秒を過ぎていても、取得してから min_ttl 秒は使う
+    fetch, calls = make_fetch('2000-01-01T00:00:00+09:00')
+    cache = ForecastCache(fetch, ttl=60, min_ttl=0.1)
+    assert cache.get('130000')[0]['calls'] == 1
+    assert cache.get('130000')[0]['calls'] == 1
+    time.sleep(0.15)
+    assert cache.get('130000')[0]['calls'] == 2
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expired']) == (1, 2, 1)
+
+def test_least_recently_used_is_evicted():
+    fetch, calls = make_fetch()
+    cache = ForecastCache(fetch, max_entries=2)
+    cache.get('130000')
+    cache.get('270000')
+    cache.get('130000')
+    cache.get('400000')
+    assert list(cache.entries) == ['130000', '400000']
+    cache.get('270000')
+    assert calls == {'130000': 1, '270000': 2, '400000': 1}
+    assert cache.stats()['evictions'] == 2
+
+def test_max_bytes_limits_total_size():
+    fetch, _ = make_fetch()
+    cache = ForecastCache(fetch, max_bytes=150)
+    for code in ('130000', '270000', '400000'):
+        cache.get(code)
+    stats = cache.stats()
+    assert stats['bytes'] <= 150
+    assert list(cache.entries) == ['400000']
+    assert stats['evictions'] == 2
+
+def test_concurrent_gets_share_one_fetch():
+    release = threading.Event()
+    fetch, calls = make_fetch()
+
+    def slow_fetch(code):
+        release.wait(5)
+        return fetch(code)
+
+    cache = ForecastCache(slow_fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('130000'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    # 1つのスレッドが取得し、残りの7つはその結果を待つ
+    wait_for(lambda: cache.stats()['coalesced'] == 7)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == {'130000': 1}
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced']) == (1, 7)
@@ -0,0 +1,68 @@
+import sqlite3
+from datetime import datetime
+import benchmark
+from create_weather_db import TABLE_COLUMNS, BatchWriter, create_database
+from history_store import HistoryStore, JST, month_of
+
+REPORTS = ('2024-11-30T17:00:00+09:00', '2024-12-01T05:00:00+09:00', '2024-12-01T11:00:00+09:00',
+           '2024-12-20T11:00:00+09:00')
+AREA_CODE = '130010'
+
+def build_weather_db(db_name):
+    create_database(db_name)
+    with BatchWriter(db_name) as writer:
+        for report_datetime in REPORTS:
+            writer.add(benchmark.make_forecast_payload('130000', '東京都', [(AREA_CODE, '東京地方')],
+                                                       report_datetime))
+
+def count_rows(db_name, tables=TABLE_COLUMNS):
+    conn = sqlite3.connect(db_name)
+    try:
+        return sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables)
+    finally:
+        conn.close()
+
+def latest_per_target(rows):
+    """パーティションの月ごとに、対象時刻ごとの最新の発表の行だけを残す（compact と同じ）"""
+    latest = {}
+    for row in rows:
+        key = (month_of(row[1]), row[3])
+        if key not in latest or row[1] > latest[key][1]:
+            latest[key] = row
+    return sorted(latest.values(), key=lambda row: (row[1], row[3]))
+
+def test_archive_compact_expire(tmp_path, capsys):
+    weather_db = str(tmp_path / 'weather.db')
+    build_weather_db(weather_db)
+    store = HistoryStore(str(tmp_path / 'history'), hot_days=2, compact_after_days=7, retention_days=40)
+    all_rows = store.history('weather_forecasts', AREA_CODE, weather_db=weather_db)
+    assert [row[1] for row in all_rows] == sorted(row[1] for row in all_rows)
+    total = count_rows(weather_db)
+
+    # hot_days より古い3つの発表を、発表の年月ごとのパーティションに移す
+    moved = store.archive(weather_db, now=datetime(2024, 12, 21, 12, tzinfo=JST))
+    assert store.partitions() == ['2024-11', '2024-12']
+    assert moved == total - count_rows(weather_db) > 0
+    hot_rows = [row for row in all_rows if row[1] == REPORTS[-1]]
+    assert count_rows(weather_db, ['weather_forecasts']) == len(hot_rows)
+    assert store.history('weather_forecasts', AREA_CODE, weather_db=weather_db) == all_rows
+    # 期間を指定すると、その月のパーティションだけを検索する
+    december = store.history('weather_forecasts', AREA_CODE, '2024-12-01T00:00:00+09:00',
+                             '2024-12-02T00:00:00+09:00', weather_db)
+    assert december == [row for row in all_rows if row[1] in REPORTS[1:3]]
+    # 再実行しても何も移さない
+    assert store.archive(weather_db, now=datetime(2024, 12, 21, 12, tzinfo=JST)) == 0
+
+    # 月が終わって compact_after_days 日を過ぎたパーティションは、対象時刻ごとに最新の発表だけにする
+    archived_rows = [row for row in all_rows if row[1] != REPORTS[-1]]
+    assert store.compact(now=datetime(2025, 1, 10, tzinfo=JST)) == ['2024-11', '2024-12']
+    compacted = store.history('weather_forecasts', AREA_CODE, weather_db=weather_db)
+    assert compacted == latest_per_target(archived_rows) + hot_rows
+    assert len(compacted) < len(all_rows)
+    assert store.compact(now=datetime(2025, 1, 10, tzinfo=JST)) == []
+
+    # 月全体が retention_days 日より古いパーティションは削除し、残りの履歴は引き続き検索できる
+    assert store.expire(now=datetime(2025, 1, 10, tzinfo=JST)) == ['2024-11']
+    assert store.partitions() == ['2024-12']
+    assert store.history('weather_forecasts', AREA_CODE, weather_db=weather_db) == \
+        [row for row in compacted if not row[1].startswith('2024-11')]
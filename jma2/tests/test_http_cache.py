@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import benchmark
+import create_weather_db
+from http_cache import HTTPCache
+from create_weather_db import NOT_MODIFIED, fetch_weather_data, load_cached_weather_data
+
+def make_payload(code='130000', report_datetime=benchmark.REPORT_DATETIME):
+    return benchmark.make_forecast_payload(code, '東京都', [('130010', '東京地方')], report_datetime)
+
+def test_not_modified_returns_cached_body(forecast_server, tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http_cache'))
+    url = forecast_server.base_url.format('130000')
+    forecast_server.payloads['130000'] = make_payload()
+
+    status_code, content = cache.get(url)
+    assert status_code == 200
+    first_headers = forecast_server.requested('130000')[0]
+    assert 'If-None-Match' not in first_headers
+
+    status_code, content = cache.get(url)
+    assert (status_code, content) == (304, None)
+    # 2回目は保存したETagを付けて検証する
+    etag = forecast_server.requested('130000')[1]['If-None-Match']
+    assert etag and etag == cache._load_meta(url)['etag']
+    assert cache.read_body(url) is not None
+    assert cache.get_json(url) == (304, forecast_server.payloads['130000'])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['bytes_saved'] > 0
+
+def test_modified_body_replaces_cache(forecast_server, tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http_cache'))
+    url = forecast_server.base_url.format('130000')
+    forecast_server.payloads['130000'] = make_payload()
+    assert cache.get_json(url)[0] == 200
+    forecast_server.payloads['130000'] = make_payload(report_datetime='2024-12-17T17:00:00+09:00')
+    assert cache.get_json(url) == (200, forecast_server.payloads['130000'])
+    assert cache.get_json(url) == (304, forecast_server.payloads['130000'])
+
+def test_fetch_weather_data_not_modified(forecast_server, tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http_cache'))
+    base_url = forecast_server.base_url
+    forecast_server.payloads['130000'] = make_payload()
+    assert fetch_weather_data('130000', base_url=base_url, http_cache=cache) == forecast_server.payloads['130000']
+    assert fetch_weather_data('130000', base_url=base_url, http_cache=cache) is NOT_MODIFIED
+    # 304 でも、保存済みの本文から予報を読み込める
+    assert load_cached_weather_data('130000', cache, base_url) == forecast_server.payloads['130000']
+    assert load_cached_weather_data('270000', cache, base_url) is None
+
+def test_main_ingests_not_modified_body_missing_from_db(forecast_server, tmp_path, monkeypatch):
+    area_db = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'area.db')
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'area.csv').write_text('Code,Name,Level\n130000,東京都,offices\n', encoding='utf-8')
+    forecast_server.payloads['130000'] = make_payload()
+
+    def run():
+        create_weather_db.main(base_url=forecast_server.base_url, area_db=area_db, cache_dir='http_cache',
+                               csv_path='area.csv')
+        conn = sqlite3.connect('weather.db')
+        try:
+            return (conn.execute("SELECT COUNT(*) FROM weather_forecasts").fetchone()[0],
+                    conn.execute("SELECT report_datetime FROM ingest_watermarks").fetchall())
+        finally:
+            conn.close()
+
+    rows, watermarks = run()
+    assert rows and watermarks == [(benchmark.REPORT_DATETIME,)]
+    # キャッシュは残したまま weather.db だけを消すと、304 でも保存済みの本文から取り込み直す
+    os.remove('weather.db')
+    assert run() == (rows, watermarks)
+    assert 'If-None-Match' in forecast_server.requested('130000')[-1]
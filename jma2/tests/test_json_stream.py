@@ -0,0 +1,59 @@
+import io
+import json
+import pytest
+from json_stream import iter_items
+
+DOCUMENT = {
+    'offices': {
+        '130000': {'name': '東京都', 'enName': 'Tokyo', 'children': ['130010', '130020']},
+        '011000': {'name': '宗谷地方', 'escaped': 'a\\"bあ\n', 'pops': [0, 12345, -1.5e3, True, None]},
+    },
+    'empty': {},
+    'list': [[], [1, 22, 333], {'x': 'ｘ🌞'}],
+    'count': 1234567890,
+}
+
+def expand_top(path):
+    return len(path) < 2
+
+def flatten(value, path=(), expand=expand_top):
+    """iter_items と同じ (パス, 値) を json.loads の結果から作る"""
+    if not isinstance(value, (dict, list)) or not expand(path):
+        return [(path, value)]
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    return [item for key, child in items for item in flatten(child, path + (key,), expand)]
+
+def parse(text, chunk_size, expand=expand_top):
+    return list(iter_items(io.StringIO(text), expand, chunk_size))
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_every_chunk_boundary(indent):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    expected = flatten(DOCUMENT)
+    # チャンクの境界が文字列・数値・エスケープ・区切りの途中になるすべての位置を試す
+    for chunk_size in range(1, 40):
+        assert parse(text, chunk_size) == expected, chunk_size
+    assert parse(text, 1, lambda path: True) == flatten(DOCUMENT, expand=lambda path: True)
+
+def test_number_at_chunk_boundary_is_not_cut():
+    assert parse('[12345, 6.25e2]', 3, lambda path: True) == [((0,), 12345), ((1,), 625.0)]
+    assert parse('12345', 2, lambda path: True) == [((), 12345)]
+
+def test_multibyte_utf8_split_across_reads():
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8')
+    # 1バイトずつ読むバイナリの上のテキストファイル（マルチバイト文字が読み込みの途中で切れる）
+    f = io.TextIOWrapper(io.BufferedReader(io.BytesIO(data), buffer_size=1), encoding='utf-8')
+    f._CHUNK_SIZE = 1
+    assert list(iter_items(f, expand_top, 1)) == flatten(DOCUMENT)
+
+def test_truncated_input_raises():
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+    for end in range(len(text)):
+        with pytest.raises(json.JSONDecodeError):
+            parse(text[:end], 7)
+
+def test_extra_data_raises():
+    with pytest.raises(json.JSONDecodeError):
+        parse('{"a": 1} {"b": 2}', 4)
+    with pytest.raises(json.JSONDecodeError):
+        parse('{"a": 1 "b": 2}', 4)
@@ -0,0 +1,71 @@
+import os
+import io
+import shutil
+import sqlite3
+import contextlib
+import pytest
+import benchmark
+import create_weather_db
+import weather_db_v2
+from main_1 import WeatherApp
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_DB = os.path.join(JMA2_DIR, 'area.db')
+
+def build_v1(db_name):
+    benchmark.build_history_db(db_name, 8, AREA_DB)
+
+def build_v2(db_name):
+    v1_db = db_name + '.v1'
+    build_v1(v1_db)
+    with contextlib.redirect_stdout(io.StringIO()):
+        weather_db_v2.migrate(v1_db, db_name)
+
+def build_without_current(db_name):
+    build_v1(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.execute("DROP TABLE current_forecasts")
+    conn.close()
+
+def build_upgraded(db_name):
+    # リポジトリにある以前のスキーマの weather.db を create_database で更新したもの
+    shutil.copy(os.path.join(JMA2_DIR, 'weather.db'), db_name)
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_weather_db.create_database(db_name)
+
+def build_migrated(db_name):
+    # リポジトリにある以前のスキーマ（ingest_watermarks も current_forecasts もない）の weather.db を v2 に変換したもの
+    with contextlib.redirect_stdout(io.StringIO()):
+        weather_db_v2.migrate(os.path.join(JMA2_DIR, 'weather.db'), db_name)
+
+@pytest.fixture(params=[build_v1, build_v2, build_without_current, build_upgraded, build_migrated],
+                ids=['v1', 'v2', 'v1_without_current', 'upgraded', 'migrated'])
+def app(request, tmp_path):
+    db_name = str(tmp_path / 'weather.db')
+    request.param(db_name)
+    app = WeatherApp(db_name, AREA_DB)
+    yield app
+    app.close()
+
+def test_every_query_uses_search_only(app):
+    plans = app.explain_query_plans()
+    assert set(plans) == {name for name, _, _ in app.app_queries}
+    for name, details in plans.items():
+        for detail in details:
+            assert detail.split()[0] == 'SEARCH', f"{name}: {detail}"
+    assert app.find_full_scans() == []
+
+def test_find_full_scans_reports_index_scans(tmp_path):
+    db_name = str(tmp_path / 'weather.db')
+    build_without_current(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.execute("DROP INDEX idx_weather_forecasts_area_target")
+    conn.execute("DROP INDEX uq_weather_forecasts_key")
+    conn.close()
+    app = WeatherApp(db_name, AREA_DB)
+    try:
+        full_scans = app.find_full_scans()
+    finally:
+        app.close()
+    assert full_scans
+    assert all(detail.startswith('SCAN') for _, detail in full_scans)
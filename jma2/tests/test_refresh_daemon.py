@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import benchmark
+from create_weather_db import create_database, insert_data_from_json
+from history_store import JST
+from refresh_daemon import RefreshDaemon, OfficeState, next_publish_time
+
+REPORT = '2024-12-17T11:00:00+09:00'
+
+def jst(day, hour, minute=0):
+    return datetime(2024, 12, day, hour, minute, tzinfo=JST)
+
+@pytest.mark.parametrize('after, expected', [
+    (jst(17, 4, 59), jst(17, 5)),
+    (jst(17, 5), jst(17, 11)),
+    (jst(17, 11), jst(17, 17)),
+    (jst(17, 16, 59), jst(17, 17)),
+    (jst(17, 17), jst(18, 5)),
+    (jst(17, 23, 59), jst(18, 5)),
+    # UTCで渡しても日本時間の定時で数える（UTC 20:00 は日本時間の翌日 05:00）
+    (datetime(2024, 12, 17, 20, 0, tzinfo=timezone.utc), jst(18, 11)),
+    (datetime(2024, 12, 17, 19, 59, tzinfo=timezone.utc), jst(18, 5)),
+])
+def test_next_publish_time(after, expected):
+    result = next_publish_time(after)
+    assert result == expected and result.utcoffset() == timedelta(hours=9)
+
+def test_backoff_doubles_up_to_max():
+    daemon = RefreshDaemon([], cache_dir=None, retry_interval=120, max_backoff=1800)
+    assert [daemon._backoff(failures) for failures in range(7)] == [120, 120, 240, 480, 960, 1800, 1800]
+
+def test_schedule_backs_off_after_failures():
+    daemon = RefreshDaemon(['130000'], cache_dir=None, jitter=0, publish_delay=120, retry_interval=120,
+                           max_backoff=1800, max_interval=3 * 3600)
+    state = daemon.offices['130000']
+    now = jst(17, 17, 5)
+
+    # まだ取り込んでいない office はすぐに、失敗が続けばバックオフして取得する
+    daemon._schedule(state, now)
+    assert state.next_poll == now
+    state.failures = 2
+    daemon._schedule(state, now, now)
+    assert state.next_poll == now + timedelta(seconds=240)
+
+    # 次の発表（17:00）の時刻を過ぎても出ていなければ、失敗の回数に応じて間隔を空ける
+    state.report_time = jst(17, 11)
+    for failures, wait in ((1, 120), (3, 480), (8, 1800)):
+        state.failures = failures
+        daemon._schedule(state, now, now)
+        assert state.next_poll == now + timedelta(seconds=wait)
+
+    # 次の発表の前なら、定時から publish_delay 秒後（max_interval 以内）に取得する
+    state.failures = 0
+    daemon._schedule(state, jst(17, 12), jst(17, 12))
+    assert state.next_poll == jst(17, 15)
+    daemon._schedule(state, jst(17, 15), jst(17, 15))
+    assert state.next_poll == jst(17, 17, 2)
+
+def test_render_metrics():
+    daemon = RefreshDaemon(['130000', '270000'], cache_dir=None)
+    now = jst(17, 12)
+    state = daemon.offices['130000']
+    state.report_time = jst(17, 11)
+    state.ingested_at = jst(17, 11, 3)
+    state.next_poll = now + timedelta(seconds=60)
+    state.polls, state.ingested, state.unchanged, state.errors, state.failures = 4, 1, 2, 1, 3
+
+    lines = daemon.render_metrics(now).splitlines()
+    assert lines[:5] == [
+        '# HELP jma_refresh_report_age_seconds 最新の発表からの経過秒数',
+        '# TYPE jma_refresh_report_age_seconds gauge',
+        'jma_refresh_report_age_seconds{office="130000"} 3600.0',
+        '# HELP jma_refresh_ingest_lag_seconds 最新の発表を取り込むまでにかかった秒数',
+        '# TYPE jma_refresh_ingest_lag_seconds gauge',
+    ]
+    values = [line for line in lines if not line.startswith('#')]
+    assert values == [
+        'jma_refresh_report_age_seconds{office="130000"} 3600.0',
+        'jma_refresh_ingest_lag_seconds{office="130000"} 180.0',
+        'jma_refresh_overdue_seconds{office="130000"} 0',
+        'jma_refresh_next_poll_seconds{office="130000"} 60.0',
+        # まだ取り込んでいない office は発表に関する値を出さない
+        'jma_refresh_consecutive_failures{office="130000"} 3',
+        'jma_refresh_consecutive_failures{office="270000"} 0',
+        'jma_refresh_polls_total{office="130000"} 4',
+        'jma_refresh_polls_total{office="270000"} 0',
+        'jma_refresh_ingested_total{office="130000"} 1',
+        'jma_refresh_ingested_total{office="270000"} 0',
+        'jma_refresh_unchanged_total{office="130000"} 2',
+        'jma_refresh_unchanged_total{office="270000"} 0',
+        'jma_refresh_errors_total{office="130000"} 1',
+        'jma_refresh_errors_total{office="270000"} 0',
+    ]
+    assert '# TYPE jma_refresh_polls_total counter' in lines
+    # 次の発表（17:00）を過ぎると overdue が増える
+    assert 'jma_refresh_overdue_seconds{office="130000"} 300.0' in daemon.render_metrics(jst(17, 17, 5))
+
+@pytest.fixture
+def daemon(tmp_path, forecast_server):
+    db_name = str(tmp_path / 'weather.db')
+    create_database(db_name)
+    forecast_server.payloads['130000'] = benchmark.make_forecast_payload('130000', '東京都', [('130010', '東京地方')], REPORT)
+    return RefreshDaemon(['130000'], db_name, forecast_server.base_url, workers=1, rate=0, cache_dir=None, jitter=0)
+
+def counters(state):
+    return state.polls, state.ingested, state.unchanged, state.errors, state.failures
+
+def test_poll_counts_ingested(daemon):
+    now = jst(17, 11, 2)
+    daemon.load_state(now)
+    assert daemon.poll(now) == {'ingested': ['130000'], 'unchanged': [], 'failed': []}
+    state = daemon.offices['130000']
+    assert counters(state) == (1, 1, 0, 0, 0)
+    assert state.report_time == jst(17, 11) and state.ingested_at == now
+
+    # 同じ発表をもう一度取得しても取り込みの回数は増えない
+    state.next_poll = now
+    assert daemon.poll(now) == {'ingested': [], 'unchanged': ['130000'], 'failed': []}
+    assert counters(state) == (2, 1, 1, 0, 1)
+    assert 'jma_refresh_ingested_total{office="130000"} 1' in daemon.render_metrics(now)
+
+def test_poll_counts_payload_already_in_db_as_unchanged(daemon, capsys):
+    # 他のプロセスが同じ発表をすでに取り込んでいた（デーモンはまだ知らない）
+    data = benchmark.make_forecast_payload('130000', '東京都', [('130010', '東京地方')], REPORT)
+    assert insert_data_from_json(data, daemon.db_name, office_code='130000')
+    now = jst(17, 11, 2)
+    state = daemon.offices['130000']
+    state.next_poll = now
+    assert daemon.poll(now) == {'ingested': [], 'unchanged': ['130000'], 'failed': []}
+    assert counters(state) == (1, 0, 1, 0, 1)
+    # 取り込み済みの発表時刻に追いつき、次の定時（max_interval 以内）まで待つ
+    assert state.report_time == jst(17, 11)
+    assert state.next_poll == jst(17, 14, 2)
+
+def test_poll_counts_fetch_failure(daemon, forecast_server, capsys):
+    forecast_server.failures['130000'] = 500
+    now = jst(17, 11, 2)
+    daemon.load_state(now)
+    assert daemon.poll(now) == {'ingested': [], 'unchanged': [], 'failed': ['130000']}
+    state = daemon.offices['130000']
+    assert counters(state) == (1, 0, 0, 1, 1)
+    assert state.report_time is None
+    assert state.next_poll == now + timedelta(seconds=daemon.retry_interval)
@@ -0,0 +1,64 @@
+import io
+import os
+import sqlite3
+import contextlib
+import benchmark
+from create_weather_db import TABLE_COLUMNS, CURRENT_COLUMNS
+from weather_db_v2 import (DIMENSIONS, ENCODINGS, V2_COLUMNS, V2_CURRENT_COLUMNS, SCHEMA_VERSION,
+                           from_epoch, migrate, schema_version)
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_DB = os.path.join(JMA2_DIR, 'area.db')
+
+def v1_rows(conn, table):
+    """従来のスキーマの行（発表官署はIDの代わりに名前）"""
+    columns = ', '.join(['p.name'] + [f't.{column}' for column in TABLE_COLUMNS[table][1:]])
+    return sorted(conn.execute(f'''
+        SELECT {columns} FROM {table} t
+        LEFT JOIN publishing_offices p ON p.id = t.publishing_office_id
+    '''), key=repr)
+
+def decoded_v2_rows(conn, table):
+    """v2 の行をディメンションテーブルと結合し、時刻を ISO 8601 の文字列に戻して従来の形式にする"""
+    select, joins, times = [], [], []
+    for i, (column, v2_column) in enumerate(zip(TABLE_COLUMNS[table], V2_COLUMNS[table])):
+        encoding = ENCODINGS.get(column, (column, None))[1]
+        if encoding in DIMENSIONS:
+            joins.append(f"LEFT JOIN {encoding} d{i} ON d{i}.id = t.{v2_column}")
+            select.append(f"d{i}.{DIMENSIONS[encoding]}")
+        else:
+            select.append(f"t.{v2_column}")
+            if encoding == 'time':
+                times.append(i)
+    rows = []
+    for row in conn.execute(f"SELECT {', '.join(select)} FROM {table} t {' '.join(joins)}"):
+        row = list(row)
+        for i in times:
+            row[i] = from_epoch(row[i]).isoformat()
+        rows.append(tuple(row))
+    return sorted(rows, key=repr)
+
+def test_migrate_preserves_rows(tmp_path, capsys):
+    v1_db = str(tmp_path / 'weather.db')
+    v2_db = str(tmp_path / 'weather_v2.db')
+    benchmark.build_history_db(v1_db, 3, AREA_DB)
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = migrate(v1_db, v2_db)
+
+    v1 = sqlite3.connect(v1_db)
+    v2 = sqlite3.connect(v2_db)
+    try:
+        assert schema_version(v2) == SCHEMA_VERSION
+        for table in TABLE_COLUMNS:
+            expected = v1_rows(v1, table)
+            assert counts[table] == len(expected) > 0
+            assert decoded_v2_rows(v2, table) == expected, table
+        # current_forecasts は時刻だけをUNIX時刻にして移す
+        current = sorted(v1.execute(f"SELECT {', '.join(CURRENT_COLUMNS)} FROM current_forecasts"))
+        assert current
+        assert sorted((area, from_epoch(target).isoformat(), from_epoch(report).isoformat(), *values)
+                      for area, target, report, *values
+                      in v2.execute(f"SELECT {', '.join(V2_CURRENT_COLUMNS)} FROM current_forecasts")) == current
+    finally:
+        v1.close()
+        v2.close()
@@ -0,0 +1,63 @@
+import os
+import json
+import http.client
+import pytest
+import benchmark
+from create_weather_db import create_database, insert_data_from_json
+from weather_service import WeatherService
+
+JMA2_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AREA_DB = os.path.join(JMA2_DIR, 'area.db')
+
+def ingest(db_name, report_datetime):
+    data = benchmark.make_forecast_payload('130000', '東京都', [('130010', '東京地方')], report_datetime)
+    assert insert_data_from_json(data, db_name, office_code='130000')
+
+@pytest.fixture
+def service(tmp_path, capsys):
+    db_name = str(tmp_path / 'weather.db')
+    create_database(db_name)
+    ingest(db_name, '2024-12-17T11:00:00+09:00')
+    service = WeatherService(db_name, AREA_DB)
+    service.db_name = db_name
+    service.start(port=0)
+    yield service
+    service.stop()
+
+def request(service, path, headers=None):
+    host, port = service.server.server_address
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.getheader('ETag'), response.read()
+    finally:
+        conn.close()
+
+def test_if_none_match_returns_304(service):
+    status, etag, body = request(service, '/forecasts/130010')
+    assert status == 200 and etag
+    forecast = json.loads(body)
+    assert forecast['report_datetime'] == '2024-12-17T11:00:00+09:00'
+    assert forecast['forecasts']
+
+    status, not_modified_etag, body = request(service, '/forecasts/130010', {'If-None-Match': etag})
+    assert (status, not_modified_etag, body) == (304, etag, b'')
+    # 弱いETagとして送られても一致とみなす
+    assert request(service, '/forecasts/130010', {'If-None-Match': 'W/' + etag})[0] == 304
+    assert request(service, '/forecasts/130010', {'If-None-Match': '"other"'})[0] == 200
+    assert json.loads(request(service, '/stats')[2])['not_modified'] == 2
+
+def test_etag_changes_after_new_report(service):
+    status, etag, _ = request(service, '/forecasts/130010')
+    assert status == 200
+    # 新しい発表を取り込むと current_forecasts が入れ替わり、古いETagでは 304 にならない
+    ingest(service.db_name, '2024-12-17T17:00:00+09:00')
+    status, new_etag, body = request(service, '/forecasts/130010', {'If-None-Match': etag})
+    assert status == 200 and new_etag != etag
+    assert json.loads(body)['report_datetime'] == '2024-12-17T17:00:00+09:00'
+    assert request(service, '/forecasts/130010', {'If-None-Match': new_etag})[0] == 304
+
+def test_unknown_paths_return_404(service):
+    assert request(service, '/forecasts/999999')[0] == 404
+    assert request(service, '/nothing')[0] == 404
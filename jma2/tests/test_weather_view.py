@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+from weather_view import KeyedList
+
+class FakeView:
+    """値をそのまま保持するビュー（control は作成ごとに別のオブジェクト）"""
+    def __init__(self):
+        self.control = SimpleNamespace(value=None)
+
+    def update(self, value):
+        if self.control.value == value:
+            return False
+        self.control.value = value
+        return True
+
+def make_list():
+    owner = SimpleNamespace(controls=[])
+    return owner, KeyedList(owner, 'controls', FakeView)
+
+def test_sync_reuses_views_for_existing_keys():
+    owner, keyed = make_list()
+    assert keyed.sync([('a', 1), ('b', 2)])
+    first = list(owner.controls)
+    # 値が同じなら何も変わらない
+    assert not keyed.sync([('a', 1), ('b', 2)])
+    assert owner.controls == first
+    # 値が変わったビューだけを書き換え、コントロールは使い回す
+    assert keyed.sync([('a', 1), ('b', 3)])
+    assert [control is previous for control, previous in zip(owner.controls, first)] == [True, True]
+    assert [control.value for control in owner.controls] == [1, 3]
+    assert keyed.stats() == {'created': 2, 'patched': 3, 'removed': 0}
+
+def test_sync_reorders_and_removes():
+    owner, keyed = make_list()
+    keyed.sync([('a', 1), ('b', 2), ('c', 3)])
+    a, b, c = owner.controls
+    # 並べ替えではビューを作り直さない
+    assert keyed.sync([('c', 3), ('a', 1), ('b', 2)])
+    assert owner.controls == [c, a, b]
+    assert keyed.stats()['created'] == 3
+    # 消えたキーのビューは破棄し、新しいキーだけを作る
+    assert keyed.sync([('b', 2), ('d', 4)])
+    assert owner.controls[0] is b and owner.controls[1] not in (a, c)
+    assert list(keyed.views) == ['b', 'd']
+    assert keyed.stats() == {'created': 4, 'patched': 4, 'removed': 2}
+    keyed.clear()
+    assert owner.controls == [] and keyed.stats()['removed'] == 4
@@ -0,0 +1,406 @@
+import os
+import sqlite3
+import argparse
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from create_weather_db import (TABLE_COLUMNS, DEFAULT_PRAGMAS, extract_rows, get_report_version, is_ingested,
+                               load_watermarks, save_watermarks, CURRENT_COLUMNS, extract_current_rows,
+                               replace_current_forecasts)
+
+# スキーマのバージョン（PRAGMA user_version に記録する。weather.db の従来のスキーマは 0）
+SCHEMA_VERSION = 2
+
+# 時刻を表示するときのタイムゾーン（JMAの発表時刻・対象時刻はすべて +09:00）
+JST = timezone(timedelta(hours=9))
+
+# 従来のスキーマの列 -> (v2 の列, 変換)。
+# 変換が 'time' の列はUNIX時刻の整数に、テーブル名の列はそのディメンションテーブルのIDにする。
+# ここにない列はそのまま保存する
+ENCODINGS = {
+    'publishing_office_id': ('office_id', 'offices'),
+    'report_datetime': ('report_time', 'time'),
+    'area_code': ('area_id', 'areas'),
+    'target_datetime': ('target_time', 'time'),
+    'target_date': ('target_time', 'time'),
+    'weather_code': ('weather_code_id', 'weather_codes'),
+    'weather_text': ('weather_text_id', 'texts'),
+    'wind_text': ('wind_text_id', 'texts'),
+    'wave_text': ('wave_text_id', 'texts'),
+}
+
+# ディメンションテーブル -> 値の列
+DIMENSIONS = {
+    'offices': 'name',
+    'areas': 'code',
+    'weather_codes': 'code',
+    'texts': 'text',
+}
+
+# 各予報テーブルの v2 の列（従来のスキーマの TABLE_COLUMNS と同じ順番）
+V2_COLUMNS = {table: tuple(ENCODINGS.get(column, (column,))[0] for column in columns)
+              for table, columns in TABLE_COLUMNS.items()}
+
+# 各予報テーブルの主キー（エリア -> 対象時刻 -> 発表時刻の順に並ぶため、エリアごとの時刻の範囲検索が連続した読み込みになる）
+PRIMARY_KEYS = {
+    'weather_forecasts': ('area_id', 'target_time', 'report_time'),
+    'precipitation_probability_forecasts': ('area_id', 'target_time', 'report_time'),
+    'temperature_forecasts': ('area_id', 'target_time', 'report_time'),
+    'weekly_forecasts': ('area_id', 'target_time', 'report_time'),
+    'climate_averages': ('area_id', 'type', 'report_time'),
+}
+
+# current_forecasts の列（従来のスキーマの CURRENT_COLUMNS と同じ順番で、時刻だけUNIX時刻の整数）。
+# 読み込み時に結合しなくて済むよう、エリアコードと文章はディメンションのIDにせずそのまま持つ
+V2_CURRENT_COLUMNS = (
+    'area_code', 'target_time', 'report_time', 'weather_code',
+    'weather_text', 'wind_text', 'wave_text', 'probability', 'temperature',
+)
+
+def build_upsert_sql(table):
+    """v2 の予報テーブルへのINSERT文（主キーが重複したら値を更新し、値が同じなら何も書き込まない）"""
+    columns = V2_COLUMNS[table]
+    values = [column for column in columns if column not in PRIMARY_KEYS[table]]
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            f" ON CONFLICT ({', '.join(PRIMARY_KEYS[table])}) DO UPDATE SET "
+            + ', '.join(f"{column} = excluded.{column}" for column in values)
+            + " WHERE " + ' OR '.join(f"{column} IS NOT excluded.{column}" for column in values))
+
+UPSERT_SQL = {table: build_upsert_sql(table) for table in TABLE_COLUMNS}
+
+@lru_cache(maxsize=4096)
+def to_epoch(text):
+    """ISO 8601 の時刻の文字列をUNIX時刻（秒）の整数にする（None はそのまま）"""
+    if text is None:
+        return None
+    return int(datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp())
+
+def from_epoch(epoch):
+    """UNIX時刻（秒）を日本時間の datetime にする"""
+    return datetime.fromtimestamp(epoch, JST)
+
+def create_database(db_name='weather_v2.db'):
+    """
+    v2 のスキーマでデータベースを作成します。
+    時刻はUNIX時刻（秒）の整数、エリア・発表官署・天気コード・天気/風/波の文章はディメンションテーブルのIDで保存し、
+    予報テーブルは主キーで並んだ WITHOUT ROWID テーブルにします（行IDと自然キーのインデックスを別に持たない）。
+    """
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+
+    for table, column in DIMENSIONS.items():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                {column} TEXT NOT NULL UNIQUE
+            )
+        ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weather_forecasts (
+            area_id INTEGER NOT NULL,
+            target_time INTEGER NOT NULL,
+            report_time INTEGER NOT NULL,
+            office_id INTEGER,
+            weather_code_id INTEGER,
+            weather_text_id INTEGER,
+            wind_text_id INTEGER,
+            wave_text_id INTEGER,
+            PRIMARY KEY (area_id, target_time, report_time)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precipitation_probability_forecasts (
+            area_id INTEGER NOT NULL,
+            target_time INTEGER NOT NULL,
+            report_time INTEGER NOT NULL,
+            office_id INTEGER,
+            probability INTEGER,
+            PRIMARY KEY (area_id, target_time, report_time)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS temperature_forecasts (
+            area_id INTEGER NOT NULL,
+            target_time INTEGER NOT NULL,
+            report_time INTEGER NOT NULL,
+            office_id INTEGER,
+            temperature REAL,
+            PRIMARY KEY (area_id, target_time, report_time)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weekly_forecasts (
+            area_id INTEGER NOT NULL,
+            target_time INTEGER NOT NULL,
+            report_time INTEGER NOT NULL,
+            office_id INTEGER,
+            weather_code_id INTEGER,
+            precipitation_probability INTEGER,
+            reliability TEXT,
+            PRIMARY KEY (area_id, target_time, report_time)
+        ) WITHOUT ROWID
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS climate_averages (
+            area_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            report_time INTEGER NOT NULL,
+            office_id INTEGER,
+            min_value REAL,
+            max_value REAL,
+            PRIMARY KEY (area_id, type, report_time)
+        ) WITHOUT ROWID
+    ''')
+
+    # 各エリアの最新の発表の予報（取り込み時にエリアごとに入れ替える）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS current_forecasts (
+            area_code TEXT NOT NULL,
+            target_time INTEGER NOT NULL,
+            report_time INTEGER NOT NULL,
+            weather_code TEXT,
+            weather_text TEXT,
+            wind_text TEXT,
+            wave_text TEXT,
+            probability INTEGER,
+            temperature REAL,
+            PRIMARY KEY (area_code, target_time)
+        ) WITHOUT ROWID
+    ''')
+
+    # officeごとに最後に取り込んだ発表時刻（予報JSONの文字列と比べるため、従来どおり文字列で保存する）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_watermarks (
+            office_code TEXT PRIMARY KEY,
+            report_datetime TEXT,
+            weekly_report_datetime TEXT,
+            ingested_at TEXT
+        )
+    ''')
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    conn.close()
+    print(f"データベース '{db_name}'（スキーマ v{SCHEMA_VERSION}）とテーブルを作成しました。")
+
+def schema_version(conn):
+    """接続先のデータベースのスキーマのバージョンを返す（従来のスキーマは 0）"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+class Dimensions:
+    """
+    ディメンションテーブルの値とIDの対応をメモリに保持し、行を v2 の形式に変換します。
+    未登録の値だけをその場で挿入するため、値ごとに INSERT OR IGNORE と SELECT を繰り返さずに済みます。
+
+    :param conn: v2 のデータベースの接続
+    """
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+        self.reload()
+
+    def reload(self):
+        """データベースから対応を読み直す（ロールバックした後に呼ぶ）"""
+        self.ids = {table: {value: id_ for id_, value in self.cursor.execute(f"SELECT id, {column} FROM {table}")}
+                    for table, column in DIMENSIONS.items()}
+
+    def intern(self, table, value):
+        """値のIDを返す（未登録なら挿入する。None はそのまま）"""
+        if value is None:
+            return None
+        ids = self.ids[table]
+        id_ = ids.get(value)
+        if id_ is None:
+            self.cursor.execute(f"INSERT INTO {table} ({DIMENSIONS[table]}) VALUES (?)", (value,))
+            id_ = ids[value] = self.cursor.lastrowid
+        return id_
+
+    def encoder(self, table):
+        """従来のスキーマの行（TABLE_COLUMNS[table] の順）を v2 の行に変換する関数を返す"""
+        converters = []
+        for column in TABLE_COLUMNS[table]:
+            encoding = ENCODINGS.get(column, (column, None))[1]
+            if encoding == 'time':
+                converters.append(to_epoch)
+            elif encoding is not None:
+                converters.append(lambda value, dimension=encoding: self.intern(dimension, value))
+            else:
+                converters.append(None)
+
+        def encode(row):
+            return tuple(value if convert is None else convert(value) for convert, value in zip(converters, row))
+        return encode
+
+class V2Writer:
+    """
+    予報JSONを v2 のスキーマのデータベースに書き込むライター（BatchWriter と同じ使い方）。
+
+    :param db_name: 書き込むデータベースファイルの名前
+    :param batch_size: 1トランザクションで書き込む行数の目安
+    :param skip_unchanged: True なら ingest_watermarks に記録済みの発表と同じか古いデータを読み飛ばす
+    """
+    def __init__(self, db_name='weather_v2.db', batch_size=50000, skip_unchanged=True):
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_name)
+        if schema_version(self.conn) != SCHEMA_VERSION:
+            self.conn.close()
+            raise ValueError(f"'{db_name}' はスキーマ v{SCHEMA_VERSION} のデータベースではありません")
+        for name, value in DEFAULT_PRAGMAS.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        self.cursor = self.conn.cursor()
+        self.dimensions = Dimensions(self.conn)
+        self.encoders = {table: self.dimensions.encoder(table) for table in TABLE_COLUMNS}
+        self.pending = {table: [] for table in TABLE_COLUMNS}
+        self.pending_count = 0
+        self.rows_written = 0
+        self.skip_unchanged = skip_unchanged
+        self.watermarks = load_watermarks(self.cursor)
+        self.pending_watermarks = []
+        self.pending_current = []
+        self.offices_skipped = 0
+        self.offices_written = 0
+
+    def add(self, data, office_code=None):
+        """予報JSONを1件追加する（BatchWriter.add と同じ）"""
+        if not data:
+            return False
+        if office_code:
+            version = get_report_version(data)
+            if self.skip_unchanged and is_ingested(version, self.watermarks.get(office_code)):
+                self.offices_skipped += 1
+                return False
+            self.watermarks[office_code] = version
+            self.pending_watermarks.append((office_code, *version))
+        self.offices_written += 1
+        # 発表官署はIDの代わりに名前を渡し、行の変換時にIDにする
+        for table, table_rows in extract_rows(data, data[0]['publishingOffice']).items():
+            encode = self.encoders[table]
+            self.pending[table].extend(map(encode, table_rows))
+            self.pending_count += len(table_rows)
+        self.pending_current.append({
+            area_code: [(area, to_epoch(target), to_epoch(report), *values)
+                        for area, target, report, *values in rows]
+            for area_code, rows in extract_current_rows(data).items()
+        })
+        if self.pending_count >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """溜まっている行を1トランザクションで書き込む"""
+        try:
+            for table, table_rows in self.pending.items():
+                if table_rows:
+                    self.cursor.executemany(UPSERT_SQL[table], table_rows)
+            for current in self.pending_current:
+                replace_current_forecasts(self.cursor, current, V2_CURRENT_COLUMNS)
+            save_watermarks(self.cursor, self.pending_watermarks)
+            self.conn.commit()
+            self.rows_written += self.pending_count
+        except sqlite3.Error as e:
+            print(f"データベースエラーが発生しました: {e}")
+            self.conn.rollback()
+            # ロールバックで消えたディメンションのIDと取り込み済みの目印を読み直す
+            self.dimensions.reload()
+            self.watermarks = load_watermarks(self.cursor)
+            raise
+        finally:
+            self.pending = {table: [] for table in TABLE_COLUMNS}
+            self.pending_count = 0
+            self.pending_watermarks = []
+            self.pending_current = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+            self.conn.close()
+
+def migrate(src_db='weather.db', dst_db='weather_v2.db', batch_size=50000):
+    """
+    従来のスキーマの weather.db を v2 のスキーマに変換します。
+    一時ファイルに作成してから dst_db と置き換えるため、途中で失敗しても dst_db は変わりません。
+    従来の temperature_forecasts の temp_type, temperature_upper, temperature_lower 列は
+    取り込み時に使われていないため移行しません。
+
+    :param src_db: 変換元のデータベース
+    :param dst_db: 作成する v2 のデータベース
+    :param batch_size: 1回に読み込んで書き込む行数
+    :return: {テーブル名: 移行した行数}
+    """
+    tmp_name = f"{dst_db}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    counts = {}
+    src = sqlite3.connect(f"file:{os.path.abspath(src_db)}?mode=ro", uri=True)
+    try:
+        create_database(tmp_name)
+        dst = sqlite3.connect(tmp_name)
+        try:
+            cursor = dst.cursor()
+            dimensions = Dimensions(dst)
+            for table, columns in TABLE_COLUMNS.items():
+                encode = dimensions.encoder(table)
+                # 発表官署はIDの代わりに名前を読み、v2 のIDに付け替える。
+                # 自然キーが重複している古いデータベースでも、後から挿入された行が残るよう id 順に読む
+                select_columns = ', '.join(['p.name'] + [f't.{column}' for column in columns[1:]])
+                rows = src.execute(f'''
+                    SELECT {select_columns} FROM {table} t
+                    LEFT JOIN publishing_offices p ON p.id = t.publishing_office_id
+                    ORDER BY t.id
+                ''')
+                counts[table] = 0
+                while True:
+                    batch = rows.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    cursor.executemany(UPSERT_SQL[table], [encode(row) for row in batch])
+                    counts[table] += len(batch)
+            # 取り込み済みの発表（従来のスキーマに ingest_watermarks がある場合）
+            if src.execute("SELECT 1 FROM sqlite_master WHERE name = 'ingest_watermarks'").fetchone():
+                cursor.executemany('''
+                    INSERT INTO ingest_watermarks (office_code, report_datetime, weekly_report_datetime, ingested_at)
+                    VALUES (?, ?, ?, ?)
+                ''', src.execute('''
+                    SELECT office_code, report_datetime, weekly_report_datetime, ingested_at FROM ingest_watermarks
+                '''))
+            # 最新の発表の予報（従来のスキーマに current_forecasts がある場合）
+            if src.execute("SELECT 1 FROM sqlite_master WHERE name = 'current_forecasts'").fetchone():
+                cursor.executemany(
+                    f"INSERT INTO current_forecasts ({', '.join(V2_CURRENT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(V2_CURRENT_COLUMNS))})",
+                    [(area, to_epoch(target), to_epoch(report), *values) for area, target, report, *values
+                     in src.execute(f"SELECT {', '.join(CURRENT_COLUMNS)} FROM current_forecasts")])
+            dst.commit()
+            # 主キーの順に詰め直す（挿入順が主キーの順と違うため、ページに空きが残る）
+            dst.execute("VACUUM")
+        finally:
+            dst.close()
+        os.replace(tmp_name, dst_db)
+    finally:
+        src.close()
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="weather.db を v2 のスキーマ（整数の時刻・ディメンションテーブル）に変換します")
+    parser.add_argument('--src', default='weather.db', help="変換元の weather.db")
+    parser.add_argument('--dst', default='weather_v2.db', help="作成する v2 のデータベース")
+    args = parser.parse_args()
+    for table, count in migrate(args.src, args.dst).items():
+        print(f"{table}: {count} 行")
+    print(f"'{args.src}' を '{args.dst}' に変換しました。")
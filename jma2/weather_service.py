@@ -0,0 +1,246 @@
+import json
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+from main_1 import WeatherApp
+from weather_db_v2 import from_epoch
+
+# 予報の各列のJSONでの名前（get_weather_forecast の列の順）
+FORECAST_FIELDS = ('datetime', 'weather', 'wind', 'probability', 'temperature')
+
+# 地方・都道府県の一覧は起動時に読み込んだ area.db から返すため、発表時刻によらない
+STATIC_VERSION = 'static'
+
+def encode_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def make_etag(body):
+    """レスポンス本文からETag（強いETag）を作る"""
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match ヘッダーに etag が含まれるか（弱いETagとしても比較する）"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+class ResponseCache:
+    """
+    HTTPサービスのレスポンスのメモリキャッシュ。キーごとに、作成したときの発表時刻（バージョン）と
+    本文・ETagを保持し、バージョンが変わっていなければ weather.db を検索せずに同じ本文を返します。
+    件数が max_entries を超えると、最も長く使われていないものから破棄します（LRU）。
+
+    :param max_entries: 保持するレスポンスの最大数
+    """
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # キー -> (バージョン, ETag, 本文)（末尾ほど最近使われた）
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """バージョンが一致する (ETag, 本文) を返す（なければ None）"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, body):
+        """本文を保存して (ETag, 本文) を返す"""
+        etag = make_etag(body)
+        with self.lock:
+            self.entries[key] = (version, etag, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return etag, body
+
+class WeatherService:
+    """
+    WeatherApp のクエリを読み取り専用のHTTP/JSONで提供するサービス。
+    予報のレスポンスはエリアごとに発表時刻（get_report_version）をバージョンとしてキャッシュし、
+    新しい発表を取り込むまでは同じ本文とETagを返します（If-None-Match が一致すれば 304）。
+    weather.db は WeatherApp の読み取り専用の接続プールで読むため、WALモードであれば
+    取り込み中でも読み込みは待たされません。
+
+    エンドポイント:
+        GET /regions                          地方の一覧
+        GET /regions/{地方コード}/prefectures  地方に属する都道府県の一覧
+        GET /forecasts/{エリアコード}          エリアの最新の発表の天気予報
+        GET /stats                            キャッシュの統計
+
+    :param weather_db: weather.db のパス
+    :param area_db: area.db（または area.json / スナップショット）のパス
+    :param pool_size: weather.db の接続の最大数（同時に実行する検索の数）
+    :param cache_entries: キャッシュするレスポンスの最大数
+    """
+    def __init__(self, weather_db='weather.db', area_db='area.db', pool_size=8, cache_entries=1024):
+        self.app = WeatherApp(weather_db, area_db, pool_size)
+        self.cache = ResponseCache(cache_entries)
+        self.not_modified = 0
+        self.server = None
+        self.thread = None
+        try:
+            with self.app.weather_pool.connection() as conn:
+                self.journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"データベースエラー: {e}")
+            self.journal_mode = None
+        if self.journal_mode != 'wal':
+            print(f"weather.db がWALモードではありません（{self.journal_mode}）。取り込み中は読み込みが待たされます")
+
+    def regions(self):
+        return [{'code': code, 'name': name} for code, name in self.app.get_regions()]
+
+    def prefectures(self, region_code):
+        if self.app.areas.level(region_code) != 'centers':
+            return None
+        return [{'code': code, 'name': name} for code, name in self.app.get_prefectures(region_code)]
+
+    def report_version(self, area_code):
+        """予報のレスポンスのバージョン（v2 のUNIX時刻は ISO 8601 の文字列にする）"""
+        version = self.app.get_report_version(area_code)
+        return from_epoch(version).isoformat() if isinstance(version, int) else version
+
+    def forecast(self, area_code, version):
+        return {
+            'area_code': area_code,
+            'area_name': self.app.areas.name(area_code),
+            'report_datetime': version,
+            'forecasts': [dict(zip(FORECAST_FIELDS, row)) for row in self.app.get_weather_forecast(area_code)],
+        }
+
+    def stats(self):
+        cache = self.cache
+        with cache.lock:
+            return {
+                'entries': len(cache.entries),
+                'hits': cache.hits,
+                'misses': cache.misses,
+                'evictions': cache.evictions,
+                'not_modified': self.not_modified,
+                'journal_mode': self.journal_mode,
+            }
+
+    def resolve(self, path):
+        """
+        パスに対応するレスポンスを (ステータス, ETag, 本文) で返します。
+        キャッシュできるレスポンスは、バージョンを調べてから本文を作るため、その間に新しい発表が
+        取り込まれた場合は古いバージョンで新しい本文を保存することがありますが、次の要求で作り直されます。
+        """
+        parts = [unquote(part) for part in urlsplit(path).path.split('/') if part]
+        if parts == ['stats']:
+            return 200, None, encode_json(self.stats())
+        if parts == ['regions']:
+            key, version, build = ('regions',), STATIC_VERSION, self.regions
+        elif len(parts) == 3 and parts[0] == 'regions' and parts[2] == 'prefectures':
+            if parts[1] not in self.app.areas:
+                return 404, None, encode_json({'error': f"地方が見つかりません: {parts[1]}"})
+            key, version = ('prefectures', parts[1]), STATIC_VERSION
+            build = lambda: self.prefectures(parts[1])
+        elif len(parts) == 2 and parts[0] == 'forecasts':
+            area_code = parts[1]
+            if area_code not in self.app.areas:
+                return 404, None, encode_json({'error': f"エリアが見つかりません: {area_code}"})
+            key, version = ('forecasts', area_code), self.report_version(area_code)
+            build = lambda: self.forecast(area_code, version)
+        else:
+            return 404, None, encode_json({'error': f"見つかりません: {path}"})
+
+        cached = self.cache.get(key, version)
+        if cached is None:
+            value = build()
+            if value is None:
+                return 404, None, encode_json({'error': f"見つかりません: {path}"})
+            cached = self.cache.put(key, version, encode_json(value))
+        etag, body = cached
+        return 200, etag, body
+
+    def serve(self, host='127.0.0.1', port=8000):
+        """HTTPサーバーを作成して返す（serve_forever() は呼び出し側で行う）"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 接続を使い回せるよう HTTP/1.1 で応答する（レスポンスには必ず Content-Length を付ける）
+            protocol_version = 'HTTP/1.1'
+            # ヘッダーと本文を別に送るため、Nagleアルゴリズムで本文の送信が遅れないようにする
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                try:
+                    status, etag, body = service.resolve(self.path)
+                except (sqlite3.Error, KeyError) as e:
+                    status, etag, body = 500, None, encode_json({'error': str(e)})
+                if etag and etag_matches(self.headers.get('If-None-Match'), etag):
+                    with service.cache.lock:
+                        service.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if etag:
+                    self.send_header('ETag', etag)
+                    # キャッシュしてもよいが、使う前に必ずETagで検証する
+                    self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def start(self, host='127.0.0.1', port=8000):
+        """HTTPサーバーをバックグラウンドのスレッドで起動し、待ち受けているアドレスを返す"""
+        self.server = self.serve(host, port)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='weather-service', daemon=True)
+        self.thread.start()
+        return self.server.server_address
+
+    def stop(self):
+        """HTTPサーバーを止め、接続を閉じる"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = self.thread = None
+        self.app.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="weather.db の天気予報を読み取り専用のHTTP/JSONで提供します")
+    parser.add_argument('--db', default='weather.db', help="読み込む weather.db")
+    parser.add_argument('--area-db', default='area.db', help="エリア階層を読み込む area.db")
+    parser.add_argument('--host', default='127.0.0.1', help="待ち受けるアドレス")
+    parser.add_argument('--port', type=int, default=8000, help="待ち受けるポート")
+    parser.add_argument('--pool-size', type=int, default=8, help="weather.db の接続の最大数")
+    parser.add_argument('--cache-entries', type=int, default=1024, help="キャッシュするレスポンスの最大数")
+    args = parser.parse_args()
+    service = WeatherService(args.db, args.area_db, args.pool_size, args.cache_entries)
+    server = service.serve(args.host, args.port)
+    print(f"http://{args.host}:{server.server_address[1]}/ で待ち受けています（Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.app.close()
@@ -0,0 +1,127 @@
+import flet as ft
+
+def set_value(control, name, value):
+    """コントロールのプロパティを、値が変わる場合だけ書き換える（書き換えたら True）"""
+    if getattr(control, name) == value:
+        return False
+    setattr(control, name, value)
+    return True
+
+class KeyedList:
+    """
+    キーごとにビューを使い回して、コントロールのリスト（ListView.controls, DataTable.rows など）を
+    新しいデータに合わせます。
+    新しいキーのビューだけを作り、既存のキーは値が変わったプロパティだけを書き換えます。
+    Flet は変わったプロパティだけをクライアントに送るため、毎回作り直すより更新が小さくなります。
+
+    :param owner: リストを持つコントロール（ListView, DataTable など）
+    :param attr: リストのプロパティ名（'controls', 'rows' など）
+    :param create: ビューを作る関数。ビューは control 属性と、値を反映して変更があれば True を返す update(value) を持つ
+    """
+    def __init__(self, owner, attr, create):
+        self.owner = owner
+        self.attr = attr
+        self.create = create
+        # キー -> ビュー（表示順）
+        self.views = {}
+        self.created = 0
+        self.patched = 0
+        self.removed = 0
+
+    def sync(self, items):
+        """
+        (キー, 値) のリストを表示に反映します。
+        表示するコントロールやその内容が変わった場合は True を返します。
+        """
+        views = {}
+        changed = False
+        for key, value in items:
+            view = self.views.get(key)
+            if view is None:
+                view = self.create()
+                self.created += 1
+                changed = True
+            if view.update(value):
+                self.patched += 1
+                changed = True
+            views[key] = view
+        self.removed += len(self.views.keys() - views.keys())
+        self.views = views
+
+        controls = [view.control for view in views.values()]
+        current = getattr(self.owner, self.attr)
+        if len(controls) != len(current) or any(a is not b for a, b in zip(controls, current)):
+            setattr(self.owner, self.attr, controls)
+            changed = True
+        return changed
+
+    def clear(self):
+        """表示をすべて消す"""
+        self.removed += len(self.views)
+        self.views = {}
+        setattr(self.owner, self.attr, [])
+
+    def stats(self):
+        """作成・更新・削除したビューの数を返す"""
+        return {'created': self.created, 'patched': self.patched, 'removed': self.removed}
+
+class DayCardView:
+    """
+    1日分の天気を表示するカード。
+    値は date, description, icon_src, wind, wave, pop, temp をキーに持つ辞書です。
+    """
+    def __init__(self):
+        self.date_text = ft.Text(size=18, weight="bold")
+        self.description_text = ft.Text(size=16)
+        self.icon = ft.Image(width=100, height=100, fit=ft.ImageFit.CONTAIN)
+        self.wind_text = ft.Text(size=16)
+        self.wave_text = ft.Text(size=16)
+        self.pop_text = ft.Text(size=16)
+        self.temp_text = ft.Text(size=16)
+
+        # 天気アイコンと天気説明を左右に配置
+        weather_row = ft.Row(
+            controls=[
+                self.description_text,
+                self.icon
+            ],
+            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,  # 左右に配置
+            vertical_alignment=ft.CrossAxisAlignment.CENTER,
+            spacing=10
+        )
+
+        self.control = ft.Card(
+            content=ft.Container(
+                padding=10,
+                content=ft.Column([
+                    self.date_text,
+                    weather_row,
+                    self.wind_text,
+                    self.wave_text,
+                    self.pop_text,
+                    self.temp_text,
+                ])
+            )
+        )
+
+    def update(self, day):
+        changes = [
+            set_value(self.date_text, 'value', f"日付: {day['date']}"),
+            set_value(self.description_text, 'value', f"天気: {day.get('description', 'データなし')}"),
+            set_value(self.icon, 'src', day['icon_src']),
+            set_value(self.wind_text, 'value', f"風: {day.get('wind', 'データなし')}"),
+            set_value(self.wave_text, 'value', f"波: {day.get('wave', 'データなし')}"),
+            set_value(self.pop_text, 'value', f"降水確率: {day.get('pop', 'データなし')}%"),
+            set_value(self.temp_text, 'value', f"気温: {day.get('temp', 'データなし')}°C"),
+        ]
+        return any(changes)
+
+class ForecastRowView:
+    """天気予報テーブルの1行。値はセルに表示する文字列のタプルです"""
+    def __init__(self, columns=5):
+        self.texts = [ft.Text() for _ in range(columns)]
+        self.control = ft.DataRow(cells=[ft.DataCell(text) for text in self.texts])
+
+    def update(self, values):
+        changes = [set_value(text, 'value', value) for text, value in zip(self.texts, values)]
+        return any(changes)